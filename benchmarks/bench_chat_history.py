@@ -0,0 +1,126 @@
+"""Time replaying a long conversation into the chat view.
+
+Fills an offscreen ChatHistory with N text messages either one row at a time
+(the old replay path: one insert and one scroll timer per message) or through
+ChatHistory.add_messages (one insert, one layout pass, one scroll), and
+reports the time until the view has settled at the bottom.
+
+    python benchmarks/bench_chat_history.py --messages 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication
+
+from client import ChatHistory, ChatMessage
+
+WORDS = ("hello there how are you doing today let's meet at the station "
+         "sounds good see you soon bring the notes from class").split()
+
+
+def make_messages(count, seed=1):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        lines = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 30)))
+                 for _ in range(rng.choice((1, 1, 1, 2, 3)))]
+        sender = 'alice' if i % 2 else 'bob'
+        messages.append((
+            '<br>'.join(lines),
+            f'2026-01-01 12:{i // 60 % 60:02d}:{i % 60:02d}',
+            sender == 'alice',
+            sender
+        ))
+    return messages
+
+
+def settle(app, history, timeout=30.0):
+    # Run the event loop until the last row is laid out and scrolled into view
+    view = history.view
+    model = history.model
+    scrollbar = view.verticalScrollBar()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        app.processEvents()
+        if history.scroll_timer.isActive() or history.flush_timer.isActive():
+            continue
+        last = view.visualRect(model.index(model.rowCount() - 1, 0))
+        if scrollbar.value() == scrollbar.maximum() and last.isValid() \
+                and last.bottom() <= view.viewport().height():
+            return True
+    return False
+
+
+def replay_per_message(history, messages):
+    for text, timestamp, is_sender, sender in messages:
+        history.model.append(ChatMessage(text, timestamp, is_sender, None, sender=sender))
+        QTimer.singleShot(100, history.scroll_to_bottom)
+
+
+def replay_bulk(history, messages):
+    history.add_messages([
+        ChatMessage(text, timestamp, is_sender, None, sender=sender)
+        for text, timestamp, is_sender, sender in messages
+    ])
+
+
+def run(app, mode, messages):
+    history = ChatHistory()
+    history.resize(800, 600)
+    history.show()
+    app.processEvents()
+
+    replay = replay_per_message if mode == 'per_message' else replay_bulk
+    start = time.perf_counter()
+    replay(history, messages)
+    inserted = time.perf_counter()
+    settled = settle(app, history)
+    done = time.perf_counter()
+
+    history.close()
+    history.deleteLater()
+    app.processEvents()
+    return {
+        'mode': mode,
+        'messages': len(messages),
+        'insert_ms': round((inserted - start) * 1000, 2),
+        'total_ms': round((done - start) * 1000, 2),
+        'settled': settled,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--mode', choices=['per_message', 'bulk', 'both'], default='both')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    messages = make_messages(args.messages)
+    modes = ['per_message', 'bulk'] if args.mode == 'both' else [args.mode]
+
+    results = []
+    for mode in modes:
+        runs = [run(app, mode, messages) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r['total_ms'])
+        results.append(best)
+        print(f"{mode:<12} insert {best['insert_ms']:>9.2f} ms   settled {best['total_ms']:>9.2f} ms"
+              f"{'' if best['settled'] else '   (did not settle)'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
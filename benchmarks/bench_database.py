@@ -0,0 +1,285 @@
+"""Time ChatDatabase methods against synthetic chat.db files.
+
+Builds a database with --users users and --messages messages (a share of
+them images), spread over a skewed set of conversations so a few users are
+much busier than the rest, then times each ChatDatabase method for a busy
+and a typical user. Every SQL statement a method runs is captured and
+reported with its EXPLAIN QUERY PLAN and the number of SQLite VM
+instructions the method executed (not rows scanned, though a full scan
+makes it grow with the table), so a query that falls back to a full table
+scan shows up even when the table is still small.
+
+Generated files are kept in --data-dir and reused by later runs with the
+same parameters. Each run works on a scratch copy, so the write operations
+never change the cached file.
+
+    python benchmarks/bench_database.py --users 1000 --messages 1000000 --image-ratio 0.05
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ChatDatabase
+
+WORDS = ("hello there how are you doing today let's meet at the station "
+         "sounds good see you soon bring the notes from class").split()
+
+# VM instructions between progress handler calls; instruction counts are multiples of this
+PROGRESS_STEP = 10
+
+
+def database_path(args):
+    name = (f"chat-{args.users}u-{args.messages}m-{args.image_ratio:g}img-{args.image_bytes}b-"
+            f"{args.partners}p{'-avatars' if args.avatars else ''}-{args.seed}.db")
+    return os.path.join(args.data_dir, name)
+
+
+def generate(path, args):
+    rng = random.Random(args.seed)
+    image = base64.b64encode(os.urandom(args.image_bytes)).decode('utf-8')
+    usernames = [f'user{i:06d}' for i in range(args.users)]
+
+    # Schema comes from ChatDatabase itself; rows are bulk-inserted underneath it
+    db = ChatDatabase(path)
+    cursor = db.conn.cursor()
+    registered = datetime(2025, 1, 1)
+    cursor.executemany(
+        """INSERT INTO users (username, password, display_name, status_message,
+                              profile_image, registration_date, last_seen)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        [(username, 'password', username.title(), 'hi there',
+          image if args.avatars else None, str(registered), str(registered))
+         for username in usernames]
+    )
+
+    # Pareto weights: a handful of users carry most of the traffic
+    cum_weights = list(itertools.accumulate(rng.paretovariate(1.2) for _ in usernames))
+    partners = {
+        username: rng.sample(usernames, min(args.partners, len(usernames)))
+        for username in usernames
+    }
+    moment = registered
+    batch = []
+    for i in range(args.messages):
+        sender = rng.choices(usernames, cum_weights=cum_weights)[0]
+        receiver = rng.choice(partners[sender])
+        moment += timedelta(seconds=rng.randint(1, 90))
+        if rng.random() < args.image_ratio:
+            message_type, content = 'image', image
+        else:
+            message_type = 'text'
+            content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 30)))
+        batch.append((sender, receiver, message_type, content, str(moment)))
+        if len(batch) == 50000:
+            cursor.executemany(
+                "INSERT INTO chat_history (sender, receiver, message_type, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+            batch = []
+            print(f"  {i + 1} / {args.messages} messages", end='\r', flush=True)
+    cursor.executemany(
+        "INSERT INTO chat_history (sender, receiver, message_type, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+        batch
+    )
+
+    # Drop the derived tables so reopening rebuilds them from chat_history
+    # with ChatDatabase's own migration
+    cursor.execute("DROP TABLE contacts")
+    cursor.execute("DROP TABLE conversations")
+    db.conn.commit()
+    db.conn.close()
+    db = ChatDatabase(path)
+    db.conn.execute("ANALYZE")
+    db.conn.commit()
+    db.conn.close()
+    print()
+
+
+def pick_users(db):
+    cursor = db.conn.cursor()
+    cursor.execute("SELECT sender, COUNT(*) AS n FROM chat_history GROUP BY sender ORDER BY n DESC")
+    counts = cursor.fetchall()
+    busy = counts[0][0]
+    typical = counts[len(counts) // 2][0]
+    peer_of = {}
+    for username in (busy, typical):
+        cursor.execute(
+            "SELECT receiver, COUNT(*) AS n FROM chat_history WHERE sender = ? GROUP BY receiver ORDER BY n DESC LIMIT 1",
+            (username,)
+        )
+        peer_of[username] = cursor.fetchone()[0]
+    cursor.execute("SELECT MAX(id) FROM chat_history")
+    return {'busy': busy, 'typical': typical}, peer_of, cursor.fetchone()[0]
+
+
+def operations(users, peer_of, last_id):
+    ops = []
+    for label, username in users.items():
+        peer = peer_of[username]
+        ops += [
+            (f'get_user_chat_history[{label}]', lambda db, u=username: db.get_user_chat_history(u)),
+            (f'get_user_chat_history_delta[{label}]',
+             lambda db, u=username: db.get_user_chat_history(u, max(0, last_id - 1000))),
+            (f'get_chat_history[{label}]', lambda db, u=username, p=peer: db.get_chat_history(u, p)),
+            (f'get_conversations[{label}]', lambda db, u=username: db.get_conversations(u)),
+            (f'get_contacts_with_profiles[{label}]', lambda db, u=username: db.get_contacts_with_profiles(u)),
+            (f'search_messages[{label}]', lambda db, u=username: db.search_messages(u, 'station')),
+        ]
+    busy, typical = users['busy'], users['typical']
+    ops += [
+        ('get_all_users_with_profiles', lambda db: db.get_all_users_with_profiles()),
+        ('search_users', lambda db: db.search_users('user00')),
+        ('verify_user', lambda db: db.verify_user(typical, 'password')),
+        ('update_profile', lambda db: db.update_profile(typical, status_message=f'bench {time.time()}')),
+        ('save_message[text]', lambda db: db.save_message(busy, typical, 'text', 'benchmark message')),
+        ('mark_conversation_read', lambda db: db.mark_conversation_read(typical, busy)),
+    ]
+    return ops
+
+
+def explain(conn, statements):
+    plans = []
+    for sql in statements:
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        except sqlite3.Error as e:
+            plans.append({'sql': sql[:200], 'error': str(e)})
+            continue
+        detail = [row[3] for row in rows]
+        plans.append({
+            'sql': ' '.join(sql.split())[:200],
+            'plan': detail,
+            # "SCAN t" walks the whole table; "SCAN t USING ... INDEX" does not
+            'full_scan': any(line.startswith('SCAN') and 'INDEX' not in line for line in detail)
+        })
+    return plans
+
+
+def measure(db, name, func, repeat):
+    statements = []
+
+    def trace(sql):
+        stripped = sql.strip()
+        # Skip trigger markers and FTS5's statements on its own shadow tables
+        if stripped and not stripped.startswith('--') and "'main'." not in stripped \
+                and stripped.split()[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            statements.append(stripped)
+
+    instructions = [0]
+
+    def progress():
+        instructions[0] += PROGRESS_STEP
+        return 0
+
+    # One traced run to collect statements and VM instructions, then timed runs
+    db.conn.set_trace_callback(trace)
+    db.conn.set_progress_handler(progress, PROGRESS_STEP)
+    result = func(db)
+    db.conn.set_progress_handler(None, 0)
+    db.conn.set_trace_callback(None)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(db)
+        times.append((time.perf_counter() - start) * 1000)
+
+    ordered = sorted(times)
+    return {
+        'name': name,
+        'rows': len(result) if isinstance(result, list) else None,
+        'min_ms': round(ordered[0], 3),
+        'median_ms': round(statistics.median(ordered), 3),
+        'max_ms': round(ordered[-1], 3),
+        'vm_instructions': instructions[0],
+        'statements': explain(db.conn, dict.fromkeys(statements)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--image-ratio', type=float, default=0.0, help='share of messages that are images')
+    parser.add_argument('--image-bytes', type=int, default=30000, help='size of each image before base64')
+    parser.add_argument('--avatars', action='store_true', help='give every user a profile image')
+    parser.add_argument('--partners', type=int, default=10, help='conversation partners per user')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'kukuri-bench'))
+    parser.add_argument('--regenerate', action='store_true', help='rebuild the database even if cached')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = database_path(args)
+    if args.regenerate and os.path.exists(path):
+        os.remove(path)
+    if not os.path.exists(path):
+        print(f"Generating {path}")
+        start = time.perf_counter()
+        generate(path, args)
+        print(f"Generated in {time.perf_counter() - start:.1f} s")
+
+    # Finish any search backfill in the cached file so search timings
+    # reflect a complete index and later runs don't repeat it
+    db = ChatDatabase(path)
+    while db.index_search_batch(50000):
+        pass
+    db.conn.close()
+
+    # update_profile, save_message and mark_conversation_read write to the
+    # database, so every run starts from a fresh copy of the cached file
+    scratch = os.path.join(args.data_dir, f'scratch-{os.getpid()}.db')
+    shutil.copyfile(path, scratch)
+    try:
+        start = time.perf_counter()
+        db = ChatDatabase(scratch)
+        open_ms = (time.perf_counter() - start) * 1000
+        users, peer_of, last_id = pick_users(db)
+        results = [{'name': 'open', 'min_ms': round(open_ms, 3), 'median_ms': round(open_ms, 3),
+                    'max_ms': round(open_ms, 3), 'rows': None, 'vm_instructions': None, 'statements': []}]
+        for name, func in operations(users, peer_of, last_id):
+            results.append(measure(db, name, func, args.repeat))
+        db.conn.close()
+    finally:
+        os.remove(scratch)
+
+    print(f"{os.path.basename(path)}  ({os.path.getsize(path) / 2**20:.1f} MiB)   "
+          f"busy {users['busy']}   typical {users['typical']}")
+    print(f"{'operation':<44}{'rows':>8}{'median':>11}{'max':>11}{'vm instrs':>12}  plan")
+    for result in results:
+        scans = [s for s in result['statements'] if s.get('full_scan')]
+        flag = 'FULL SCAN' if scans else ''
+        rows = '' if result['rows'] is None else result['rows']
+        instructions = '' if result['vm_instructions'] is None else result['vm_instructions']
+        print(f"{result['name']:<44}{rows:>8}{result['median_ms']:>11.3f}{result['max_ms']:>11.3f}"
+              f"{instructions:>12}  {flag}")
+        for statement in scans:
+            print(f"    {statement['sql'][:100]}")
+            for line in statement['plan']:
+                print(f"      {line}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'config': {key: value for key, value in vars(args).items() if key != 'json'},
+                'database': {'path': path, 'bytes': os.path.getsize(path), **users},
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
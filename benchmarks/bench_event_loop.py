@@ -0,0 +1,149 @@
+"""Round-trip latency of the client's asyncio/Qt event loop integration.
+
+Echoes small JSON messages through a local websocket server while the
+asyncio loop is driven either by the old 50 ms QTimer polling tick or by
+qasync's QEventLoop, and reports latency percentiles plus idle CPU time.
+
+    python benchmarks/bench_event_loop.py --messages 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import websockets
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication
+
+from loadtest import latency_summary
+
+try:
+    import qasync
+except ImportError:
+    qasync = None
+
+
+def start_echo_server(port):
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def echo(websocket, path=None):
+            async for message in websocket:
+                await websocket.send(message)
+
+        loop.run_until_complete(websockets.serve(echo, 'localhost', port))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+
+async def measure(port, count, gap, idle):
+    latencies = []
+    async with websockets.connect(f'ws://localhost:{port}') as websocket:
+        for seq in range(count):
+            start = time.perf_counter()
+            await websocket.send(json.dumps({'type': 'ping', 'seq': seq}))
+            await websocket.recv()
+            latencies.append((time.perf_counter() - start) * 1000)
+            # Messages arrive at arbitrary points between ticks in real use
+            await asyncio.sleep(gap)
+
+    # CPU burnt while nothing happens on the socket
+    cpu_start = time.process_time()
+    await asyncio.sleep(idle)
+    idle_cpu = (time.process_time() - cpu_start) * 1000
+    return latencies, idle_cpu
+
+
+def run_polling(app, port, args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    timer = QTimer()
+    timer.setInterval(50)
+
+    def process_async_tasks():
+        loop.stop()
+        loop.run_forever()
+
+    timer.timeout.connect(process_async_tasks)
+
+    task = loop.create_task(measure(port, args.messages, args.gap, args.idle))
+    task.add_done_callback(lambda _: app.quit())
+    timer.start()
+    app.exec()
+    timer.stop()
+    loop.close()
+    return task.result()
+
+
+def run_qasync(app, port, args):
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    with loop:
+        return loop.run_until_complete(measure(port, args.messages, args.gap, args.idle))
+
+
+def summarize(mode, latencies, idle_cpu, idle):
+    return {
+        'mode': mode,
+        'mean_ms': round(statistics.mean(latencies), 3),
+        **latency_summary(latencies),
+        'idle_seconds': idle,
+        'idle_cpu_ms': round(idle_cpu, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--gap', type=float, default=0.013, help='seconds between messages')
+    parser.add_argument('--idle', type=float, default=2.0, help='seconds of idle time to sample CPU')
+    parser.add_argument('--mode', choices=['polling', 'qasync', 'both'], default='both')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    modes = ['polling', 'qasync'] if args.mode == 'both' else [args.mode]
+    if 'qasync' in modes and qasync is None:
+        print("qasync not installed, skipping integrated loop")
+        modes.remove('qasync')
+    if not modes:
+        sys.exit(1)
+
+    start_echo_server(args.port)
+    app = QApplication(sys.argv)
+
+    results = []
+    for mode in modes:
+        runner = run_polling if mode == 'polling' else run_qasync
+        latencies, idle_cpu = runner(app, args.port, args)
+        results.append(summarize(mode, latencies, idle_cpu, args.idle))
+
+    print(f"{'mode':<10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'idle cpu':>12}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['mean_ms']:>10.2f}{result['p50_ms']:>10.2f}"
+              f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}"
+              f"{result['idle_cpu_ms']:>12.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
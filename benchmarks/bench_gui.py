@@ -0,0 +1,345 @@
+"""Time the chat client's heaviest UI paths offscreen.
+
+Starts a ChatClient with QT_QPA_PLATFORM=offscreen, no server, and
+synthetic data, then measures:
+
+  conversation_render   opening a conversation of N text and image messages
+                        until every image is decoded, the view sits at the
+                        bottom and a frame has been painted
+  conversation_switch   switching back and forth between two open chats
+  contact_list          filling the contact list with N contacts with avatars
+  theme_switch          loading and applying each installed theme, first
+                        (compile) and later (cached) passes
+
+Each metric reports wall time over --repeat runs plus, from one extra run,
+the peak resident memory (Linux, via /proc/self/clear_refs and VmHWM), how
+much RSS stayed allocated and the peak of Python allocations
+(tracemalloc). The client runs in a scratch directory with a copy of
+themes/, so no settings or local stores are touched.
+
+    python benchmarks/bench_gui.py --messages 2000 --contacts 1000
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+WORKDIR = tempfile.mkdtemp(prefix='kukuri-gui-bench-')
+os.environ['XDG_DATA_HOME'] = os.path.join(WORKDIR, 'data')
+shutil.copytree(os.path.join(ROOT, 'themes'), os.path.join(WORKDIR, 'themes'))
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QThreadPool
+from PyQt6.QtGui import QColor, QImage, QLinearGradient, QPainter
+from PyQt6.QtWidgets import QApplication
+
+from client import ChatClient, avatar_cache
+from client_store import HistoryCache
+
+WORDS = ("hello there how are you doing today let's meet at the station "
+         "sounds good see you soon bring the notes from class").split()
+
+
+def make_png(width, height, hue):
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    painter = QPainter(image)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor.fromHsv(hue % 360, 200, 230))
+    gradient.setColorAt(1, QColor.fromHsv((hue + 120) % 360, 200, 120))
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, 'PNG')
+    return base64.b64encode(bytes(data)).decode('utf-8')
+
+
+def make_history(count, image_ratio, me, peer, seed):
+    rng = random.Random(seed)
+    image = make_png(800, 600, seed * 37) if image_ratio else None
+    messages = []
+    for i in range(count):
+        sender = me if i % 3 == 0 else peer
+        if image and rng.random() < image_ratio:
+            message_type, content = 'image', image
+        else:
+            message_type = 'text'
+            content = '<br>'.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 30)))
+                                  for _ in range(rng.choice((1, 1, 1, 2, 3))))
+        messages.append({
+            'id': i + 1,
+            'timestamp': f'2026-01-01 12:{i // 60 % 60:02d}:{i % 60:02d}',
+            'sender': sender,
+            'type': message_type,
+            'content': content
+        })
+    return messages
+
+
+def make_contacts(count, seed):
+    rng = random.Random(seed)
+    avatars = [make_png(100, 100, hue) for hue in range(0, 360, 24)]
+    return [{
+        'username': f'contact{i:05d}',
+        'display_name': f'Contact {i}',
+        'status_message': ' '.join(rng.choice(WORDS) for _ in range(4)),
+        'profile_image': avatars[i % len(avatars)],
+        'additional_image': None,
+        'last_seen': None,
+        'online': rng.random() < 0.3
+    } for i in range(count)]
+
+
+def read_status(field):
+    try:
+        with open('/proc/self/status') as f:
+            match = re.search(rf'^{field}:\s+(\d+) kB', f.read(), re.MULTILINE)
+        return int(match.group(1)) * 1024 if match else None
+    except OSError:
+        return None
+
+
+def reset_peak_rss():
+    # Linux resets VmHWM to the current RSS when "5" is written here
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Bench:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.client = ChatClient()
+        self.client.resize(1100, 750)
+        self.client.show()
+        self.process(0.2)
+        self.client.username = 'me'
+
+    def process(self, seconds=0.0):
+        deadline = time.perf_counter() + seconds
+        while True:
+            self.app.processEvents()
+            if time.perf_counter() >= deadline:
+                return
+
+    def idle(self, view=None):
+        if QThreadPool.globalInstance().activeThreadCount():
+            return False
+        if view is not None:
+            if view.decoder.tasks or view.pending:
+                return False
+            if any(timer.isActive() for timer in (view.scroll_timer, view.flush_timer, view.relayout_timer)):
+                return False
+        return True
+
+    def settle(self, view=None, rows=None, timeout=60.0):
+        # Run the event loop until nothing is queued, then force one full paint
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            self.app.processEvents()
+            if rows is not None and (view is None or view.model.rowCount() < rows):
+                view = self.client.chat_history
+                continue
+            if self.idle(view):
+                break
+        self.client.grab()
+        return time.perf_counter() < deadline
+
+    def timed(self, name, prepare, action, repeat=None, **info):
+        # prepare() resets state outside the measurement; action() is timed
+        times = []
+        for _ in range(repeat or self.args.repeat):
+            prepare()
+            self.settle()
+            start = time.perf_counter()
+            action()
+            times.append((time.perf_counter() - start) * 1000)
+
+        prepare()
+        self.settle()
+        rss_before = read_status('VmRSS')
+        peak_known = reset_peak_rss()
+        tracemalloc.start()
+        action()
+        python_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        peak = read_status('VmHWM') if peak_known else None
+        rss_after = read_status('VmRSS')
+
+        result = {
+            'name': name,
+            **info,
+            'min_ms': round(min(times), 3),
+            'median_ms': round(statistics.median(times), 3),
+            'max_ms': round(max(times), 3),
+            'peak_rss_bytes': peak,
+            'peak_rss_growth_bytes': peak - rss_before if peak and rss_before else None,
+            'retained_rss_bytes': rss_after - rss_before if rss_after and rss_before else None,
+            'python_peak_bytes': python_peak,
+        }
+        print_result(result)
+        return result
+
+    def set_contacts(self, contacts):
+        self.client.conversations = {}
+        self.client.update_contacts_list([{'username': 'me', 'display_name': 'Me'}] + contacts)
+
+    def select(self, username):
+        index = self.client.contacts_model.index_of(username)
+        self.client.contacts_list.setCurrentIndex(index)
+        self.client.contact_selected(index)
+
+    def load_histories(self, histories):
+        cache = HistoryCache(None, per_conversation=10 ** 7, total=10 ** 8)
+        for peer, messages in histories.items():
+            cache.get(peer)
+            for message in messages:
+                cache.append(peer, dict(message))
+        self.client.chat_histories = cache
+        # Hidden views are trimmed to the same limits
+        self.client.chat_views.row_limit = cache.per_conversation
+        self.client.chat_views.total_rows = cache.total
+
+    def reset_views(self):
+        self.client.current_contact = None
+        self.client.chat_history = self.client.chat_views.reset()
+
+    def conversation_render(self):
+        peers = ['alice', 'bob']
+        self.set_contacts([{'username': peer, 'display_name': peer.title()} for peer in peers])
+        histories = {
+            peer: make_history(self.args.messages, self.args.image_ratio, 'me', peer, seed)
+            for seed, peer in enumerate(peers, 1)
+        }
+        self.load_histories(histories)
+        rows = self.args.messages
+
+        results = [self.timed(
+            'conversation_render', self.reset_views,
+            lambda: (self.select('alice'), self.settle(rows=rows)),
+            messages=rows, image_ratio=self.args.image_ratio
+        )]
+
+        def open_both():
+            self.reset_views()
+            for peer in peers:
+                self.select(peer)
+                self.settle(rows=rows)
+
+        state = {'next': 'alice'}
+
+        def switch():
+            self.select(state['next'])
+            self.settle(self.client.chat_history)
+            state['next'] = 'bob' if state['next'] == 'alice' else 'alice'
+
+        results.append(self.timed(
+            'conversation_switch', open_both, switch,
+            repeat=max(self.args.repeat, 5), messages=rows
+        ))
+        self.reset_views()
+        return results
+
+    def contact_list(self):
+        contacts = make_contacts(self.args.contacts, 3)
+
+        def prepare():
+            self.client.contacts_model.set_contacts([])
+            avatar_cache.pixmaps.clear()
+            avatar_cache.total_bytes = 0
+
+        def populate():
+            self.set_contacts(contacts)
+            self.settle()
+
+        return [self.timed('contact_list', prepare, populate, contacts=len(contacts))]
+
+    def theme_switch(self):
+        manager = self.client.theme_manager
+        themes = manager.get_available_themes()
+        results = []
+        for theme in themes:
+            # First load compiles the theme; later ones reuse the compiled QSS
+            def prepare(theme=theme):
+                manager.compiled.pop(theme, None)
+                manager.compiled_from.pop(theme, None)
+                manager.load_theme(themes[0] if theme != themes[0] else themes[-1])
+                self.client.apply_current_theme()
+
+            def apply(theme=theme):
+                manager.load_theme(theme)
+                self.client.apply_current_theme()
+                self.settle()
+
+            results.append(self.timed(f'theme_switch[{theme}, cold]', prepare, apply, theme=theme, cached=False))
+
+            def prepare_warm(theme=theme):
+                manager.load_theme(theme)
+                manager.load_theme(themes[0] if theme != themes[0] else themes[-1])
+                self.client.apply_current_theme()
+
+            results.append(self.timed(f'theme_switch[{theme}, warm]', prepare_warm, apply, theme=theme, cached=True))
+        return results
+
+
+def print_result(result):
+    peak = result['peak_rss_bytes']
+    growth = result['peak_rss_growth_bytes']
+    print(f"{result['name']:<38}{result['median_ms']:>11.2f}{result['max_ms']:>11.2f}"
+          f"{(peak or 0) / 2**20:>12.1f}{(growth or 0) / 2**20:>12.1f}"
+          f"{result['python_peak_bytes'] / 2**20:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000, help='messages per conversation')
+    parser.add_argument('--image-ratio', type=float, default=0.1, help='share of image messages')
+    parser.add_argument('--contacts', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', choices=['conversation', 'contacts', 'themes'],
+                        help='run only these groups')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    bench = Bench(app, args)
+    groups = {
+        'conversation': bench.conversation_render,
+        'contacts': bench.contact_list,
+        'themes': bench.theme_switch,
+    }
+
+    print(f"{'metric':<38}{'median ms':>11}{'max ms':>11}{'peak MiB':>12}{'+peak MiB':>12}{'py MiB':>12}")
+    results = []
+    for name, run in groups.items():
+        if not args.only or name in args.only:
+            results.extend(run())
+
+    bench.client.close()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'config': {key: value for key, value in vars(args).items() if key != 'json'},
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
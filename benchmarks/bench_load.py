@@ -0,0 +1,336 @@
+"""Load-test a ChatServer with simulated users.
+
+Registers N users through chat_sdk.ChatSession, logs them in (optionally
+with avatars), links each to a few contacts and then has every user send
+text and image messages to random contacts at a Poisson rate while a
+churn task drops and re-opens connections. Reports login time, message
+throughput, send->ack and end-to-end delivery latency percentiles and the
+server's resident memory.
+
+By default a fresh server is started on --port in a temporary directory, so
+its chat.db starts empty. Pass --url (and --server-pid for memory figures)
+to load an already running server instead.
+
+    python benchmarks/bench_load.py --users 200 --duration 30 --rate 0.5
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_sdk import ChatSession, MessageAck, MessageReceived
+from loadtest import latency_summary, make_png, start_server, wait_for_server
+
+WORDS = ("hello there how are you doing today let's meet at the station "
+         "sounds good see you soon bring the notes from class").split()
+
+
+def read_rss(pid):
+    # Linux only; other platforms report no memory figures
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class LoadRun:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.usernames = [f'load{i:05d}' for i in range(args.users)]
+        self.sessions = {}  # {username: ChatSession}, absent while churned out
+        self.contacts = {}  # {username: [contact, ...]}
+        self.client_ids = itertools.count(1)
+
+        self.sent = {}  # {client_id: send time}
+        self.sent_by_id = {}  # {server message id: send time}
+        self.delivered = {}  # {server message id: receive time}
+        self.ack_latencies = []
+        self.login_times = []
+        self.churn_login_times = []
+        self.counts = {'text': 0, 'image': 0, 'send_errors': 0, 'churns': 0, 'login_errors': 0}
+        self.rss_samples = []
+
+        self.image = make_png(args.image_size, args.image_size, 1) if args.image_ratio else None
+
+    def watch(self, session):
+        session.on(MessageAck, self.on_ack)
+        session.on(MessageReceived, self.on_message)
+
+    def on_ack(self, event):
+        started = self.sent.pop(event.client_id, None)
+        if started is not None:
+            self.ack_latencies.append((time.perf_counter() - started) * 1000)
+            self.sent_by_id[event.id] = started
+
+    def on_message(self, event):
+        self.delivered[event.id] = time.perf_counter()
+
+    async def open_session(self, username, times):
+        session = ChatSession(self.args.url, request_timeout=self.args.timeout)
+        self.watch(session)
+        started = time.perf_counter()
+        await session.connect()
+        result = await session.login(username, 'load-password')
+        if not result.success:
+            await session.close()
+            raise RuntimeError(result.message)
+        times.append((time.perf_counter() - started) * 1000)
+        self.sessions[username] = session
+        return session
+
+    async def bounded(self, coroutines):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def run(coroutine):
+            async with semaphore:
+                try:
+                    return await coroutine
+                except Exception as e:
+                    return e
+
+        return await asyncio.gather(*(run(c) for c in coroutines))
+
+    async def register_all(self):
+        avatar = make_png(96, 96, 2) if self.args.avatars else None
+
+        async def register(username):
+            session = ChatSession(self.args.url, request_timeout=self.args.timeout)
+            await session.connect()
+            try:
+                await session.register(username, 'load-password', username.title(), avatar)
+            finally:
+                await session.close()
+
+        await self.bounded(register(username) for username in self.usernames)
+
+    async def login_all(self):
+        results = await self.bounded(
+            self.open_session(username, self.login_times) for username in self.usernames
+        )
+        self.counts['login_errors'] += sum(isinstance(result, Exception) for result in results)
+
+    async def link_contacts(self):
+        count = min(self.args.contacts, len(self.usernames) - 1)
+
+        async def link(username):
+            others = [name for name in self.usernames if name != username]
+            self.contacts[username] = self.rng.sample(others, count)
+            session = self.sessions.get(username)
+            if session is None:
+                return
+            for contact in self.contacts[username]:
+                await session.add_contact(contact, wait=True)
+
+        await self.bounded(link(username) for username in self.usernames)
+
+    async def sender(self, username, end):
+        rng = random.Random(f'{self.args.seed}-{username}')
+        while True:
+            delay = rng.expovariate(self.args.rate)
+            if time.perf_counter() + delay >= end:
+                return
+            await asyncio.sleep(delay)
+            session = self.sessions.get(username)
+            if session is None or not self.contacts.get(username):
+                continue
+
+            receiver = rng.choice(self.contacts[username])
+            if self.image and rng.random() < self.args.image_ratio:
+                message_type, content = 'image', self.image
+            else:
+                message_type = 'text'
+                content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 30)))
+
+            client_id = next(self.client_ids)
+            self.sent[client_id] = time.perf_counter()
+            try:
+                await session.send_message(receiver, content, message_type, client_id)
+                self.counts[message_type] += 1
+            except Exception:
+                self.sent.pop(client_id, None)
+                self.counts['send_errors'] += 1
+
+    async def churn(self, end):
+        # Drop a random online user and log them back in, `--churn` times a second
+        if not self.args.churn:
+            return
+        while True:
+            delay = self.rng.expovariate(self.args.churn)
+            if time.perf_counter() + delay >= end:
+                return
+            await asyncio.sleep(delay)
+            online = [name for name in self.usernames if name in self.sessions]
+            if not online:
+                continue
+            username = self.rng.choice(online)
+            session = self.sessions.pop(username)
+            asyncio.get_running_loop().create_task(self.rejoin(username, session))
+
+    async def rejoin(self, username, session):
+        await session.close()
+        self.counts['churns'] += 1
+        try:
+            await self.open_session(username, self.churn_login_times)
+        except Exception:
+            self.counts['login_errors'] += 1
+
+    async def sample_rss(self, stop):
+        if not self.args.server_pid:
+            return
+        while not stop.is_set():
+            rss = read_rss(self.args.server_pid)
+            if rss is not None:
+                self.rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        stop = asyncio.Event()
+        sampler = asyncio.get_running_loop().create_task(self.sample_rss(stop))
+        phases = {}
+
+        started = time.perf_counter()
+        await self.register_all()
+        phases['register_s'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await self.login_all()
+        phases['login_s'] = time.perf_counter() - started
+        idle_rss = read_rss(self.args.server_pid) if self.args.server_pid else None
+
+        started = time.perf_counter()
+        await self.link_contacts()
+        phases['contacts_s'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        end = started + self.args.duration
+        await asyncio.gather(
+            self.churn(end),
+            *(self.sender(username, end) for username in self.usernames)
+        )
+        await asyncio.sleep(self.args.drain)
+        traffic = time.perf_counter() - started
+
+        stop.set()
+        await sampler
+        await asyncio.gather(*(session.close() for session in self.sessions.values()),
+                             return_exceptions=True)
+        return self.report(phases, traffic, idle_rss)
+
+    def report(self, phases, traffic, idle_rss):
+        delivery = [
+            (self.delivered[message_id] - sent) * 1000
+            for message_id, sent in self.sent_by_id.items()
+            if message_id in self.delivered
+        ]
+        sent = self.counts['text'] + self.counts['image']
+        return {
+            'config': {
+                key: value for key, value in vars(self.args).items()
+                if key not in ('json', 'server_pid')
+            },
+            'phases': {key: round(value, 3) for key, value in phases.items()},
+            'traffic_seconds': round(traffic, 3),
+            'messages': {
+                'sent': sent,
+                'text': self.counts['text'],
+                'image': self.counts['image'],
+                'acked': len(self.sent_by_id),
+                'delivered': len(delivery),
+                'send_errors': self.counts['send_errors'],
+                'sent_per_second': round(sent / self.args.duration, 2),
+                'delivered_per_second': round(len(delivery) / self.args.duration, 2),
+            },
+            'connections': {
+                'churns': self.counts['churns'],
+                'login_errors': self.counts['login_errors'],
+            },
+            'login_ms': latency_summary(self.login_times),
+            'churn_login_ms': latency_summary(self.churn_login_times),
+            'ack_ms': latency_summary(self.ack_latencies),
+            'delivery_ms': latency_summary(delivery),
+            'server_rss_bytes': {
+                'after_login': idle_rss,
+                'peak': max(self.rss_samples) if self.rss_samples else None,
+                'end': self.rss_samples[-1] if self.rss_samples else None,
+            },
+        }
+
+
+def print_report(result):
+    messages = result['messages']
+    print(f"users {result['config']['users']}   traffic {result['traffic_seconds']:.1f} s   "
+          f"churns {result['connections']['churns']}   login errors {result['connections']['login_errors']}")
+    print(f"sent {messages['sent']} ({messages['image']} images)   acked {messages['acked']}   "
+          f"delivered {messages['delivered']}   {messages['delivered_per_second']} msg/s")
+    print(f"{'':<14}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for key in ('login_ms', 'churn_login_ms', 'ack_ms', 'delivery_ms'):
+        stats = result[key]
+        if not stats['count']:
+            continue
+        print(f"{key:<14}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+    rss = result['server_rss_bytes']
+    if rss['peak']:
+        print(f"server rss    after login {rss['after_login'] / 2**20:.1f} MiB   "
+              f"peak {rss['peak'] / 2**20:.1f} MiB   end {rss['end'] / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of message traffic')
+    parser.add_argument('--rate', type=float, default=0.5, help='messages per second per user')
+    parser.add_argument('--image-ratio', type=float, default=0.05, help='share of messages that are images')
+    parser.add_argument('--image-size', type=int, default=160, help='edge of the square test image in pixels')
+    parser.add_argument('--avatars', action='store_true', help='register users with a profile image')
+    parser.add_argument('--contacts', type=int, default=5, help='contacts per user; messages go to these')
+    parser.add_argument('--churn', type=float, default=0.0, help='reconnects per second across all users')
+    parser.add_argument('--concurrency', type=int, default=50, help='parallel registrations/logins')
+    parser.add_argument('--drain', type=float, default=2.0, help='seconds to wait for in-flight messages')
+    parser.add_argument('--timeout', type=float, default=30.0, help='request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8790, help='port for the server this tool starts')
+    parser.add_argument('--url', help='load an already running server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='pid of the --url server, for memory figures')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    server = None
+    if not args.url:
+        workdir = tempfile.mkdtemp(prefix='kukuri-load-')
+        server = start_server(args.port, workdir)
+        args.url = f'ws://localhost:{args.port}'
+        args.server_pid = server.pid
+
+    try:
+        asyncio.run(wait_for_server(args.url))
+        result = asyncio.run(LoadRun(args).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+import asyncio
+import inspect
+import itertools
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import websockets
+
+DEFAULT_URL = 'ws://localhost:8765'
+
+
+# Typed views of the server's frames. Every event keeps the frame it came
+# from in `data` so fields the SDK doesn't know about are still reachable.
+@dataclass
+class Event:
+    data: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+@dataclass
+class RegisterResult(Event):
+    success: bool = False
+    message: Optional[str] = None
+
+@dataclass
+class LoginResult(Event):
+    success: bool = False
+    message: Optional[str] = None
+    contacts: List[dict] = field(default_factory=list)
+    conversations: List[dict] = field(default_factory=list)
+    chat_history: List[dict] = field(default_factory=list)
+
+@dataclass
+class MessageReceived(Event):
+    id: Optional[int] = None
+    sender: str = ''
+    message_type: str = 'text'
+    content: Any = None
+    timestamp: Optional[str] = None
+
+@dataclass
+class MessageAck(Event):
+    client_id: Any = None
+    id: Optional[int] = None
+    receiver: Optional[str] = None
+    timestamp: Optional[str] = None
+
+@dataclass
+class StatusUpdate(Event):
+    username: str = ''
+    online: bool = False
+
+@dataclass
+class ProfileUpdated(Event):
+    username: str = ''
+    profile: dict = field(default_factory=dict)
+
+@dataclass
+class ProfileUpdateResult(Event):
+    success: bool = False
+
+@dataclass
+class ProfileData(Event):
+    profile: dict = field(default_factory=dict)
+
+@dataclass
+class ContactAdded(Event):
+    success: bool = False
+    contact: Optional[dict] = None
+    message: Optional[str] = None
+
+@dataclass
+class ContactRemoved(Event):
+    success: bool = False
+    contact: Optional[str] = None
+
+@dataclass
+class UserSearchResults(Event):
+    query: str = ''
+    results: List[dict] = field(default_factory=list)
+
+@dataclass
+class SearchResults(Event):
+    query: str = ''
+    offset: int = 0
+    results: List[dict] = field(default_factory=list)
+    has_more: bool = False
+
+@dataclass
+class UnknownEvent(Event):
+    type: Optional[str] = None
+
+# Emitted by the session itself, not parsed from frames
+@dataclass
+class Disconnected(Event):
+    reason: Optional[str] = None
+    reconnecting: bool = False
+
+@dataclass
+class Reconnected(Event):
+    attempts: int = 0
+    login: Optional[LoginResult] = None
+
+
+def parse_event(frame):
+    kind = frame.get('type')
+    success = frame.get('status') == 'success'
+    if kind == 'message':
+        return MessageReceived(frame, frame.get('id'), frame.get('sender', ''), frame.get('message_type', 'text'),
+                               frame.get('content'), frame.get('timestamp'))
+    if kind == 'message_ack':
+        return MessageAck(frame, frame.get('client_id'), frame.get('id'), frame.get('receiver'), frame.get('timestamp'))
+    if kind == 'status_update':
+        return StatusUpdate(frame, frame.get('username', ''), frame.get('status') == 'online')
+    if kind == 'profile_update':
+        return ProfileUpdated(frame, frame.get('username', ''), frame.get('profile') or {})
+    if kind == 'profile_update_result':
+        return ProfileUpdateResult(frame, success)
+    if kind == 'profile_data':
+        return ProfileData(frame, frame.get('profile') or {})
+    if kind == 'add_contact':
+        return ContactAdded(frame, success, frame.get('contact'), frame.get('message'))
+    if kind == 'remove_contact':
+        return ContactRemoved(frame, success, frame.get('contact'))
+    if kind == 'user_search':
+        return UserSearchResults(frame, frame.get('query', ''), frame.get('results', []))
+    if kind == 'search':
+        return SearchResults(frame, frame.get('query', ''), frame.get('offset', 0),
+                             frame.get('results', []), frame.get('has_more', False))
+    if kind == 'login':
+        return LoginResult(frame, success, frame.get('message'), frame.get('contacts', []),
+                           frame.get('conversations', []), frame.get('chat_history') or [])
+    if kind == 'register':
+        return RegisterResult(frame, success, frame.get('message'))
+    return UnknownEvent(frame, kind)
+
+
+# Headless client for the Kukuri protocol. One reader task turns frames into
+# events for listeners and for the requests waiting on them (matched by the
+# request_id the server echoes back); one writer task drains a bounded send
+# queue, so callers wait when the socket can't keep up instead of buffering
+# without limit. With reconnect on, a dropped connection is retried with
+# jittered backoff and the last login is replayed before queued frames go out.
+# Nothing here touches Qt, so one process can run many sessions.
+class ChatSession:
+    def __init__(self, url=DEFAULT_URL, reconnect=False, send_queue_size=256,
+                 request_timeout=30.0, max_size=100 * 1024 * 1024,
+                 since_id: Optional[Callable[[], int]] = None,
+                 reconnect_delay=0.5, max_reconnect_delay=30.0):
+        self.url = url
+        self.reconnect = reconnect
+        self.request_timeout = request_timeout
+        self.max_size = max_size
+        self.since_id = since_id or (lambda: 0)  # sync cursor sent when logging in again
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.websocket = None
+        self.username = None
+        self.credentials = None  # (username, password) of the last successful login
+        self.send_queue = asyncio.Queue(maxsize=send_queue_size)
+        self.pending = {}  # {request_id: future}
+        self.listeners = {}  # {event class: [callback, ...]}
+        self.request_ids = itertools.count(1)
+        self.reader_task = None
+        self.writer_task = None
+        self.is_open = False  # between connect() and close(), even while reconnecting
+
+    @property
+    def connected(self):
+        return self.websocket is not None and self.websocket.open
+
+    def on(self, event_type, callback):
+        # Callbacks run on the reader task in frame order; coroutine callbacks
+        # are awaited, which holds back later frames until they finish
+        self.listeners.setdefault(event_type, []).append(callback)
+        return callback
+
+    def off(self, event_type, callback):
+        callbacks = self.listeners.get(event_type, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    async def wait_for(self, event_type, predicate=None, timeout=None):
+        future = asyncio.get_running_loop().create_future()
+
+        def check(event):
+            if not future.done() and (predicate is None or predicate(event)):
+                future.set_result(event)
+
+        self.on(event_type, check)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.off(event_type, check)
+
+    async def connect(self):
+        if self.connected:
+            return
+        self.websocket = await websockets.connect(self.url, max_size=self.max_size)
+        self.is_open = True
+        self.start_tasks()
+
+    async def close(self):
+        self.is_open = False
+        for task in (self.writer_task, self.reader_task):
+            if task and task is not asyncio.current_task():
+                task.cancel()
+        if self.websocket is not None:
+            await self.websocket.close()
+        self.fail_pending(ConnectionError('Session closed'))
+
+    async def flush(self, timeout=None):
+        # Waits until every queued frame has been handed to the socket (or
+        # dropped); False if that took longer than `timeout`
+        try:
+            await asyncio.wait_for(self.send_queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start_tasks(self):
+        loop = asyncio.get_running_loop()
+        self.reader_task = loop.create_task(self.read_frames(self.websocket))
+        self.writer_task = loop.create_task(self.write_frames(self.websocket))
+
+    async def send(self, payload):
+        # Waits for room in the queue; frames sent while reconnecting go out
+        # once the session is back
+        if not self.is_open:
+            raise ConnectionError('Session is not connected')
+        await self.send_queue.put(json.dumps(payload))
+
+    async def request(self, payload, timeout=None):
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await self.send({**payload, 'request_id': request_id})
+            return await asyncio.wait_for(future, timeout or self.request_timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    def fail_pending(self, error):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def write_frames(self, websocket):
+        while True:
+            frame = await self.send_queue.get()
+            try:
+                await websocket.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                print(f"Dropped frame, connection closed: {frame[:80]}")
+                return
+            finally:
+                self.send_queue.task_done()
+
+    async def read_frames(self, websocket):
+        reason = None
+        try:
+            async for raw in websocket:
+                await self.handle_frame(json.loads(raw))
+        except websockets.exceptions.ConnectionClosed as e:
+            reason = str(e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reason = f"Error reading frame: {e}"
+
+        if websocket is not self.websocket:
+            return
+        if self.writer_task:
+            self.writer_task.cancel()
+        reconnecting = self.is_open and self.reconnect and self.credentials is not None
+        self.fail_pending(ConnectionError(reason or 'Connection closed'))
+        await self.dispatch(Disconnected({}, reason, reconnecting))
+        if reconnecting:
+            await self.reconnect_loop()
+        else:
+            self.is_open = False
+
+    async def handle_frame(self, frame):
+        event = parse_event(frame)
+        future = self.pending.pop(frame.get('request_id'), None)
+        if future is not None and not future.done():
+            future.set_result(event)
+            # Let the caller act on its response before later frames arrive
+            await asyncio.sleep(0)
+        await self.dispatch(event)
+
+    async def dispatch(self, event):
+        for callback in list(self.listeners.get(type(event), ())):
+            try:
+                result = callback(event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error in {type(event).__name__} listener: {e}")
+
+    async def reconnect_loop(self):
+        delay = self.reconnect_delay
+        attempts = 0
+        while self.is_open:
+            attempts += 1
+            # Jitter keeps many sessions from reconnecting in lockstep
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            try:
+                websocket = await websockets.connect(self.url, max_size=self.max_size)
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print(f"Reconnect attempt {attempts} failed: {e}")
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            self.websocket = websocket
+            loop = asyncio.get_running_loop()
+            self.reader_task = loop.create_task(self.read_frames(websocket))
+            try:
+                # Log in again before anything queued while offline is sent
+                username, password = self.credentials
+                request_id = next(self.request_ids)
+                future = loop.create_future()
+                self.pending[request_id] = future
+                await websocket.send(json.dumps({
+                    'type': 'login',
+                    'username': username,
+                    'password': password,
+                    'since_id': self.since_id(),
+                    'request_id': request_id
+                }))
+                login = await asyncio.wait_for(future, self.request_timeout)
+            except Exception as e:
+                # Closing makes the new reader notice and start over
+                print(f"Login after reconnect failed: {e}")
+                await websocket.close()
+                return
+            
+            if not login.success:
+                print(f"Login after reconnect rejected: {login.message}")
+                self.is_open = False
+                await websocket.close()
+                await self.dispatch(Disconnected({}, login.message, False))
+                return
+
+            self.writer_task = loop.create_task(self.write_frames(websocket))
+            await self.dispatch(Reconnected({}, attempts, login))
+            return
+
+    async def register(self, username, password, display_name=None,
+                       profile_image=None, additional_image=None) -> RegisterResult:
+        return await self.request({
+            'type': 'register',
+            'username': username,
+            'password': password,
+            'display_name': display_name,
+            'profile_image': profile_image,
+            'additional_image': additional_image
+        })
+
+    async def login(self, username, password, since_id=None) -> LoginResult:
+        result = await self.request({
+            'type': 'login',
+            'username': username,
+            'password': password,
+            'since_id': self.since_id() if since_id is None else since_id
+        })
+        if result.success:
+            self.username = username
+            self.credentials = (username, password)
+        return result
+
+    async def send_message(self, receiver, content, message_type='text', client_id=None, wait=False):
+        payload = {
+            'type': 'message',
+            'message_type': message_type,
+            'sender': self.username,
+            'receiver': receiver,
+            'content': content,
+            'client_id': client_id
+        }
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def update_profile(self, wait=False, **fields):
+        payload = {'type': 'profile_update', 'username': self.username, **fields}
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def request_profile(self, username, wait=True):
+        payload = {'type': 'profile_request', 'requested_username': username}
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def add_contact(self, contact, wait=False):
+        payload = {'type': 'add_contact', 'contact': contact}
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def remove_contact(self, contact, wait=False):
+        payload = {'type': 'remove_contact', 'contact': contact}
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def search_users(self, query, limit=None, wait=False):
+        payload = {'type': 'user_search', 'query': query}
+        if limit is not None:
+            payload['limit'] = limit
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def search_messages(self, query, limit=None, offset=0, wait=True):
+        payload = {'type': 'search', 'query': query, 'offset': offset}
+        if limit is not None:
+            payload['limit'] = limit
+        if wait:
+            return await self.request(payload)
+        await self.send(payload)
+
+    async def mark_read(self, peer):
+        await self.send({'type': 'mark_read', 'peer': peer})
+
+    async def save_unread(self, unread_messages):
+        await self.send({
+            'type': 'save_unread',
+            'username': self.username,
+            'unread_messages': unread_messages
+        })
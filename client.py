@@ -3,13 +3,25 @@ from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 import sys
 import asyncio
-import websockets
 import json
 import base64
+import hashlib
+import re
+from collections import OrderedDict
 from datetime import datetime
 from plyer import notification 
 
-from theme_manager import ThemeManager
+try:
+    import qasync
+except ImportError:
+    qasync = None
+
+from theme_manager import ThemeBundleTask, ThemeManager
+from chat_sdk import (
+    ChatSession, ContactAdded, ContactRemoved, MessageAck, MessageReceived,
+    ProfileUpdated, ProfileUpdateResult, Reconnected, StatusUpdate, UserSearchResults
+)
+from client_store import ClientStore, HistoryCache, last_message_id_for, store_exists, write_attachment
 import os
 
 class ProfileEditDialog(QDialog):
@@ -24,52 +36,7 @@ class ProfileEditDialog(QDialog):
     def init_ui(self):
         self.setWindowTitle('Edit Profile')
         self.setMinimumWidth(400)
-        self.setStyleSheet("""
-            QDialog {
-                background-color: #1a1a1a;
-            }
-            QLabel {
-                color: white;
-                font-size: 14px;
-                margin-top: 10px;
-            }
-            QLineEdit {
-                padding: 8px;
-                border-radius: 5px;
-                background-color: #2d2d2d;
-                color: white;
-                border: 1px solid #3d3d3d;
-                margin-bottom: 5px;
-            }
-            QLineEdit:focus {
-                border: 1px solid #3B82F6;
-            }
-            QPushButton {
-                padding: 8px 15px;
-                border-radius: 5px;
-                background-color: #3B82F6;
-                color: white;
-                border: none;
-                margin-top: 15px;
-            }
-            QPushButton:hover {
-                background-color: #2563EB;
-            }
-            QPushButton#cancelButton {
-                background-color: #4B5563;
-            }
-            QPushButton#cancelButton:hover {
-                background-color: #374151;
-            }
-            QPushButton#imageButton {
-                margin-top: 5px;
-                background-color: #4B5563;
-                padding: 5px 10px;
-            }
-            QPushButton#imageButton:hover {
-                background-color: #374151;
-            }
-        """)
+        self.setObjectName('profileDialog')
 
         layout = QVBoxLayout(self)
         layout.setSpacing(10)
@@ -86,10 +53,7 @@ class ProfileEditDialog(QDialog):
         
         self.profile_preview = QLabel()
         self.profile_preview.setFixedSize(128, 128)
-        self.profile_preview.setStyleSheet("""
-            background-color: #2d2d2d;
-            border-radius: 64px;
-        """)
+        self.profile_preview.setObjectName('profilePreview')
         
         if self.current_profile.get('profile_image'):
             self.set_profile_preview(self.current_profile['profile_image'])
@@ -143,11 +107,7 @@ class ProfileEditDialog(QDialog):
         
         self.additional_preview = QLabel()
         self.additional_preview.setFixedSize(200, 100)
-        self.additional_preview.setStyleSheet("""
-            background-color: #2d2d2d;
-            border-radius: 5px;
-            padding: 5px;
-        """)
+        self.additional_preview.setObjectName('additionalPreview')
         
         if self.current_profile.get('additional_image'):
             pixmap = QPixmap()
@@ -269,410 +229,1284 @@ class ProfileEditDialog(QDialog):
             
         return data
 
-class MessageBubble(QWidget):
-    def __init__(self, message, timestamp, is_sender=False, profile_image=None, parent=None):
+class AvatarCache:
+    # Rounded avatar pixmaps shared by every view, keyed by
+    # (username, image hash, size) and evicted LRU past a byte budget.
+    # An image that fails to decode is cached as a null pixmap, so it is
+    # not decoded again on every paint; callers draw their fallback.
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.pixmaps = OrderedDict()  # {(username, digest, size): QPixmap}
+        self.digests = {}  # {username: (base64 image, digest)}
+
+    def digest(self, username, image):
+        # Hash each distinct image string once per user
+        cached = self.digests.get(username)
+        if cached is not None and cached[0] is image:
+            return cached[1]
+        digest = hashlib.blake2b(image.encode('ascii', 'ignore'), digest_size=8).hexdigest()
+        self.digests[username] = (image, digest)
+        return digest
+
+    def get(self, username, image, size):
+        if not image:
+            return None
+        key = (username, self.digest(username, image), size)
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+            return None if pixmap.isNull() else pixmap
+        
+        pixmap = self.render(image, size)
+        if pixmap is None:
+            pixmap = QPixmap()
+        self.pixmaps[key] = pixmap
+        self.total_bytes += pixmap.width() * pixmap.height() * 4
+        while self.total_bytes > self.max_bytes and len(self.pixmaps) > 1:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.total_bytes -= evicted.width() * evicted.height() * 4
+        return None if pixmap.isNull() else pixmap
+
+    def render(self, image, size):
+        try:
+            source = QPixmap()
+            source.loadFromData(base64.b64decode(image))
+        except Exception as e:
+            print(f"Error processing profile image: {e}")
+            return None
+        if source.isNull():
+            return None
+        
+        source = source.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatioByExpanding,
+                               Qt.TransformationMode.SmoothTransformation)
+        x = (source.width() - size) // 2
+        y = (source.height() - size) // 2
+        
+        pixmap = QPixmap(size, size)
+        pixmap.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        path = QPainterPath()
+        path.addEllipse(0, 0, size, size)
+        painter.setClipPath(path)
+        painter.drawPixmap(0, 0, source, x, y, size, size)
+        painter.end()
+        return pixmap
+
+avatar_cache = AvatarCache()
+
+class Profile:
+    # Decoded profile of one user as last reported by the server
+    __slots__ = ('username', 'display_name', 'status_message', 'profile_image',
+                 'additional_image', 'last_seen', 'online')
+    FIELDS = ('display_name', 'status_message', 'profile_image', 'additional_image', 'last_seen')
+
+    def __init__(self, username):
+        self.username = username
+        self.display_name = username
+        self.status_message = ''
+        self.profile_image = None
+        self.additional_image = None
+        self.last_seen = None
+        self.online = False
+
+    def update(self, data):
+        # The server sends profile_image in contact lists and profile_picture
+        # in profile_update broadcasts; missing keys leave the field as is.
+        if 'profile_picture' in data and 'profile_image' not in data:
+            data = dict(data, profile_image=data['profile_picture'])
+        for field in self.FIELDS:
+            if field in data:
+                setattr(self, field, data[field])
+        self.display_name = self.display_name or self.username
+        self.status_message = self.status_message or ''
+        if 'online' in data:
+            self.online = bool(data['online'])
+
+    def to_dict(self):
+        # Shape of the server's contact entries, as kept in ClientStore.
+        # Presence is not persisted.
+        return dict({'username': self.username}, **{field: getattr(self, field) for field in self.FIELDS})
+
+class ProfileStore:
+    # Every profile the client has seen, keyed by username, so renderers
+    # look senders up in O(1) instead of scanning the contact list.
+    def __init__(self):
+        self.profiles = {}  # {username: Profile}
+
+    def __contains__(self, username):
+        return username in self.profiles
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def get(self, username):
+        return self.profiles.get(username)
+
+    def values(self):
+        return self.profiles.values()
+
+    def profile_image(self, username):
+        profile = self.profiles.get(username)
+        return profile.profile_image if profile else None
+
+    def display_name(self, username):
+        profile = self.profiles.get(username)
+        return profile.display_name if profile else username
+
+    def set_all(self, contacts):
+        self.profiles = {}
+        for contact in contacts:
+            self.update(contact['username'], contact)
+
+    def update(self, username, data):
+        profile = self.profiles.get(username)
+        if profile is None:
+            profile = self.profiles[username] = Profile(username)
+        profile.update(data)
+        return profile
+
+    def set_online(self, username, online):
+        profile = self.profiles.get(username)
+        if profile is None or profile.online == online:
+            return False
+        profile.online = online
+        return True
+
+    def clear(self):
+        self.profiles = {}
+
+class ImageDecodeTask(QRunnable):
+    class Signals(QObject):
+        finished = pyqtSignal(object, QImage)
+
+    def __init__(self, message, content, max_width, path=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = ImageDecodeTask.Signals()
+        self.message = message
+        self.content = content
+        self.path = path
+        self.max_width = max_width
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            self.signals.finished.emit(self, QImage())
+            return
+        try:
+            if self.path:
+                # Attachments from the local store are read here, off the GUI thread
+                image = QImage(self.path)
+            else:
+                image = QImage.fromData(base64.b64decode(self.content))
+            if image.width() > self.max_width:
+                image = image.scaledToWidth(self.max_width, Qt.TransformationMode.SmoothTransformation)
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            image = QImage()
+        # Always report back, even when cancelled: that releases the task
+        self.signals.finished.emit(self, image)
+
+class ImageDecoder(QObject):
+    # Decodes and scales chat images on the shared QThreadPool. Results come
+    # back on the GUI thread through `decoded`; cancel_all() drops queued
+    # work and discards the results of anything still running.
+    decoded = pyqtSignal(object, QImage)  # (ChatMessage, scaled image or null image)
+
+    # Cancelled tasks the pool had already started. The pool does not own
+    # them, so they are held here until run() returns; class-wide so they
+    # also outlive a view that is deleted meanwhile.
+    cancelled = set()
+
+    def __init__(self, max_width=300, parent=None):
         super().__init__(parent)
-        self.setProperty("is_sender", is_sender)
-        
-        main_layout = QHBoxLayout(self)
-        main_layout.setContentsMargins(10, 2, 10, 2)
-        main_layout.setSpacing(8)
-        
-        if is_sender:
-            main_layout.addStretch()
-        
-        if not is_sender:
-            profile_frame = QFrame()
-            profile_frame.setStyleSheet("""
-                QFrame {
-                    background: transparent;
-                    border: none;
-                    min-width: 45px;
-                    min-height: 45px;
-                    max-width: 45px;
-                    max-height: 45px;
-                }
-            """)
-            
-            profile_frame_layout = QGridLayout(profile_frame)
-            profile_frame_layout.setContentsMargins(0, 0, 0, 0)
-            profile_frame_layout.setSpacing(0)
-            
-            profile_container = QLabel()
-            profile_container.setFixedSize(45, 45)
-            profile_container.setStyleSheet("""
-                QLabel {
-                    background-color: #2d2d2d;
-                    border-radius: 22.5px;
-                    padding: 0px;
-                    margin: 0px;
-                }
-            """)
-            
-            if profile_image:
-                try:
-                    pixmap = QPixmap()
-                    pixmap.loadFromData(base64.b64decode(profile_image))
-                    
-                    target_size = 45
-                    aspect_ratio = pixmap.width() / pixmap.height()
-                    
-                    if aspect_ratio > 1:
-                        height = target_size
-                        width = int(height * aspect_ratio)
-                    else:
-                        width = target_size
-                        height = int(width / aspect_ratio)
-                    
-                    scaled_pixmap = pixmap.scaled(width, height, 
-                                                Qt.AspectRatioMode.KeepAspectRatio,
-                                                Qt.TransformationMode.SmoothTransformation)
-                    
-                    if width > height:
-                        x = (width - target_size) // 2
-                        y = 0
-                    else:
-                        x = 0
-                        y = (height - target_size) // 2
-                        
-                    cropped_pixmap = scaled_pixmap.copy(x, y, target_size, target_size)
-                    
-                    final_pixmap = QPixmap(target_size, target_size)
-                    final_pixmap.fill(Qt.GlobalColor.transparent)
-                    
-                    painter = QPainter(final_pixmap)
-                    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-                    
-                    path = QPainterPath()
-                    path.addEllipse(0, 0, target_size, target_size)
-                    painter.setClipPath(path)
-                    
-                    painter.drawPixmap(0, 0, cropped_pixmap)
-                    painter.end()
-                    
-                    profile_container.setPixmap(final_pixmap)
-                except Exception as e:
-                    print(f"Error processing profile image: {e}")
+        self.max_width = max_width
+        self.pool = QThreadPool.globalInstance()
+        self.tasks = set()
+
+    @staticmethod
+    def release(task, image):
+        ImageDecoder.cancelled.discard(task)
+
+    def request(self, message, content=None, path=None):
+        task = ImageDecodeTask(message, content, self.max_width, path)
+        task.signals.finished.connect(ImageDecoder.release)
+        task.signals.finished.connect(self.task_finished)
+        self.tasks.add(task)
+        self.pool.start(task)
+
+    def task_finished(self, task, image):
+        if task not in self.tasks:
+            return
+        self.tasks.discard(task)
+        self.decoded.emit(task.message, image)
+
+    def cancel_all(self):
+        for task in self.tasks:
+            task.cancelled = True
+            if not self.pool.tryTake(task):
+                ImageDecoder.cancelled.add(task)
+        self.tasks.clear()
+
+class AttachmentTask(QRunnable):
+    # Decodes, hashes and writes a batch of image payloads into the store's
+    # attachments on the shared QThreadPool; the database is only touched
+    # back on the GUI thread (see ChatClient.save_messages)
+    class Signals(QObject):
+        finished = pyqtSignal(object, object)  # (task, {message id: (sha256, size) or None})
+
+    def __init__(self, attachments_dir, payloads):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = AttachmentTask.Signals()
+        self.attachments_dir = attachments_dir
+        self.payloads = payloads  # {message id: base64 content}
+
+    def run(self):
+        written = {}
+        for message_id, content in self.payloads.items():
+            try:
+                written[message_id] = write_attachment(self.attachments_dir, content)
+            except OSError as e:
+                print(f"Error writing attachment: {e}")
+                written[message_id] = None
+        self.signals.finished.emit(self, written)
+
+class ChatMessage:
+    __slots__ = ('text', 'timestamp', 'is_sender', 'profile_image', 'image', 'sender',
+                 'image_pending', 'image_source', 'pixmap', 'size_key', 'size')
+
+    def __init__(self, text, timestamp, is_sender=False, profile_image=None, image=None, sender=None):
+        self.text = text
+        self.timestamp = timestamp
+        self.is_sender = is_sender
+        self.profile_image = profile_image
+        self.image = image
+        self.sender = sender
+        self.image_pending = False
+        self.image_source = None  # (base64 content, file path) until decoded
+        self.pixmap = None
+        # Measured row size, valid while size_key matches the delegate's layout key
+        self.size_key = None
+        self.size = None
+
+class MessageListModel(QAbstractListModel):
+    MessageRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.messages[index.row()]
+        if role == self.MessageRole:
+            return message
+        if role == Qt.ItemDataRole.DisplayRole:
+            return message.text
+        return None
+
+    def append(self, message):
+        self.extend([message])
+
+    def extend(self, messages):
+        if not messages:
+            return
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row + len(messages) - 1)
+        self.messages.extend(messages)
+        self.endInsertRows()
+
+    def prepend(self, messages):
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self.messages[:0] = messages
+        self.endInsertRows()
+
+    def remove_first(self, count):
+        self.beginRemoveRows(QModelIndex(), 0, count - 1)
+        del self.messages[:count]
+        self.endRemoveRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.messages = []
+        self.endResetModel()
+
+class MessageBubbleDelegate(QStyledItemDelegate):
+    # Paints a chat bubble per row instead of building widgets for it.
+    # Geometry and colors follow the old widget-based MessageBubble.
+    AVATAR_SIZE = 45
+    AVATAR_SPACING = 8
+    ROW_MARGINS = (20, 2, 20, 2)  # left, top, right, bottom
+    BUBBLE_PADDING = (8, 12, 8, 12)  # top, right, bottom, left
+    BUBBLE_RADIUS = 15
+    MIN_BUBBLE_WIDTH = 50
+    MAX_BUBBLE_WIDTH = 400
+    IMAGE_PADDING = 5
+    IMAGE_PLACEHOLDER = QSize(300, 200)
+    TIMESTAMP_SPACING = 3
+    DOCUMENT_CACHE_SIZE = 256  # laid-out text documents kept for recent rows
+
+    SENT_BACKGROUND = QColor('#0084FF')
+    SENT_TEXT = QColor('white')
+    RECEIVED_BACKGROUND = QColor('#E4E6EB')
+    RECEIVED_TEXT = QColor('black')
+    TIMESTAMP_COLOR = QColor('#65676B')
+    AVATAR_BACKGROUND = QColor('#2d2d2d')
+    PLACEHOLDER_BACKGROUND = QColor('#3a3b3c')
+    PLACEHOLDER_TEXT = QColor('#9ca3af')
+    # Colors taken from the theme palette when it sets them
+    THEMED_COLORS = {
+        'SENT_BACKGROUND': 'sent_background',
+        'SENT_TEXT': 'sent_text',
+        'RECEIVED_BACKGROUND': 'received_background',
+        'RECEIVED_TEXT': 'received_text',
+        'TIMESTAMP_COLOR': 'timestamp',
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.message_font = QFont()
+        self.message_font.setPixelSize(14)
+        self.timestamp_font = QFont()
+        self.timestamp_font.setPixelSize(10)
+        # {ChatMessage: ((width, text), QTextDocument)}, least recently used first
+        self.documents = OrderedDict()
+
+    def available_width(self, option):
+        view = self.parent()
+        width = view.viewport().width() if view is not None else option.rect.width()
+        left, _, right, _ = self.ROW_MARGINS
+        return max(width - left - right - self.AVATAR_SIZE - self.AVATAR_SPACING, self.MIN_BUBBLE_WIDTH)
+
+    def text_document(self, message, max_width):
+        # sizeHint and paint of the same row share one layout
+        key = (max_width, message.text)
+        cached = self.documents.get(message)
+        if cached is not None and cached[0] == key:
+            self.documents.move_to_end(message)
+            return cached[1]
+        
+        doc = QTextDocument()
+        doc.setDefaultFont(self.message_font)
+        doc.setDocumentMargin(0)
+        text_option = doc.defaultTextOption()
+        text_option.setWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
+        doc.setDefaultTextOption(text_option)
+        # Keep repeated spaces; the last of a run stays breakable so lines still wrap
+        html = re.sub(r' {2,}', lambda run: '&nbsp;' * (len(run.group()) - 1) + ' ', message.text)
+        doc.setHtml(html.replace('\n', '<br/>'))
+        
+        top, right, bottom, left = self.BUBBLE_PADDING
+        text_width = max_width - left - right
+        doc.setTextWidth(text_width)
+        doc.setTextWidth(min(max(doc.idealWidth(), self.MIN_BUBBLE_WIDTH - left - right), text_width))
+        
+        self.documents[message] = (key, doc)
+        self.documents.move_to_end(message)
+        while len(self.documents) > self.DOCUMENT_CACHE_SIZE:
+            self.documents.popitem(last=False)
+        return doc
+
+    def bubble_size(self, message, max_width):
+        top, right, bottom, left = self.BUBBLE_PADDING
+        if message.image_pending:
+            pad = self.IMAGE_PADDING * 2
+            return QSize(self.IMAGE_PLACEHOLDER.width() + pad, self.IMAGE_PLACEHOLDER.height() + pad)
+        if message.image is not None:
+            pad = self.IMAGE_PADDING * 2
+            return QSize(message.image.width() + pad, message.image.height() + pad)
+        
+        doc = self.text_document(message, max_width)
+        size = doc.size()
+        return QSize(int(size.width()) + left + right, int(size.height()) + top + bottom)
+
+    def sizeHint(self, option, index):
+        message = index.data(MessageListModel.MessageRole)
+        max_width = min(self.available_width(option), self.MAX_BUBBLE_WIDTH)
+        if message.size_key == max_width:
+            return message.size
+        
+        bubble = self.bubble_size(message, max_width)
+        timestamp_height = QFontMetrics(self.timestamp_font).height() + self.TIMESTAMP_SPACING
+        _, top, _, bottom = self.ROW_MARGINS
+        height = max(bubble.height() + timestamp_height, 0 if message.is_sender else self.AVATAR_SIZE)
+        
+        message.size_key = max_width
+        message.size = QSize(bubble.width(), height + top + bottom)
+        return message.size
+
+    def paint(self, painter, option, index):
+        message = index.data(MessageListModel.MessageRole)
+        size = self.sizeHint(option, index)
+        rect = option.rect
+        left_margin, top_margin, right_margin, _ = self.ROW_MARGINS
+        
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        
+        bubble_width = size.width()
+        if message.is_sender:
+            x = rect.right() - right_margin - bubble_width
+        else:
+            avatar_rect = QRect(rect.left() + left_margin, rect.top() + top_margin,
+                                self.AVATAR_SIZE, self.AVATAR_SIZE)
+            avatar = avatar_cache.get(message.sender, message.profile_image, self.AVATAR_SIZE)
+            if avatar is not None:
+                painter.drawPixmap(avatar_rect, avatar)
+            else:
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(self.AVATAR_BACKGROUND)
+                painter.drawEllipse(avatar_rect)
+            x = avatar_rect.right() + 1 + self.AVATAR_SPACING
+        
+        max_width = min(self.available_width(option), self.MAX_BUBBLE_WIDTH)
+        if message.image_pending:
+            pad = self.IMAGE_PADDING
+            bubble_rect = QRect(x, rect.top() + top_margin, bubble_width,
+                                self.IMAGE_PLACEHOLDER.height() + pad * 2)
+            placeholder_rect = QRect(QPoint(x + pad, bubble_rect.top() + pad), self.IMAGE_PLACEHOLDER)
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.PLACEHOLDER_BACKGROUND)
+            painter.drawRoundedRect(QRectF(placeholder_rect), self.BUBBLE_RADIUS, self.BUBBLE_RADIUS)
+            painter.setPen(self.PLACEHOLDER_TEXT)
+            painter.setFont(self.timestamp_font)
+            painter.drawText(placeholder_rect, Qt.AlignmentFlag.AlignCenter, "Loading image…")
+        elif message.image is not None:
+            if message.pixmap is None:
+                message.pixmap = QPixmap.fromImage(message.image)
+            pad = self.IMAGE_PADDING
+            bubble_rect = QRect(x, rect.top() + top_margin, bubble_width,
+                                message.image.height() + pad * 2)
+            image_rect = QRect(x + pad, bubble_rect.top() + pad,
+                               message.image.width(), message.image.height())
+            path = QPainterPath()
+            path.addRoundedRect(QRectF(image_rect), self.BUBBLE_RADIUS, self.BUBBLE_RADIUS)
+            painter.setClipPath(path)
+            painter.drawPixmap(image_rect, message.pixmap)
+            painter.setClipping(False)
+        else:
+            doc = self.text_document(message, max_width)
+            top, _, bottom, left = self.BUBBLE_PADDING
+            bubble_rect = QRect(x, rect.top() + top_margin, bubble_width,
+                                int(doc.size().height()) + top + bottom)
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.SENT_BACKGROUND if message.is_sender else self.RECEIVED_BACKGROUND)
+            painter.drawRoundedRect(QRectF(bubble_rect), self.BUBBLE_RADIUS, self.BUBBLE_RADIUS)
             
-            profile_frame_layout.addWidget(profile_container, 0, 0, Qt.AlignmentFlag.AlignCenter)
-            main_layout.addWidget(profile_frame)
-        
-        # Message Container
-        message_container = QWidget()
-        message_layout = QVBoxLayout(message_container)
-        message_layout.setContentsMargins(0, 0, 0, 0)
-        message_layout.setSpacing(1)
-        
-        #message_label = QLabel()
-        #message_label.setWordWrap(True)
-        #message_label.setTextFormat(Qt.TextFormat.RichText)
-        formatted_message = message.replace(' ', '&nbsp;')
-        formatted_message = formatted_message.replace('<br>', '<br/>')
-        formatted_message = formatted_message.replace('\n', '<br/>')
-
-        message_label = QLabel()
-        message_label.setWordWrap(True)
-        message_label.setTextFormat(Qt.TextFormat.RichText)
-        message_label.setProperty("class", "message")
-        message_label.setText(formatted_message)
-
-        #formatted_message = message.replace(' ', '&nbsp;')
-        #formatted_message = formatted_message.replace('<br>', '<br/>')
-        #formatted_message = formatted_message.replace('\n', '<br/>')
-        
-        message_label.setText(formatted_message)
-        
-        message_label.setMinimumWidth(50)
-        message_label.setMaximumWidth(400) 
-        
-        message_label.setStyleSheet(f"""
-            QLabel {{
-                background-color: {'#0084FF' if is_sender else '#E4E6EB'};
-                color: {'white' if is_sender else 'black'};
-                border-radius: 15px;
-                padding: 8px 12px;
-                margin: 0px;
-                font-size: 14px;
-                line-height: 1.4;  /* เพิ่ม line height เพื่อให้อ่านง่ายขึ้น */
-            }}
-        """)
-        message_layout.addWidget(message_label)
-        
-        time_label = QLabel(timestamp)
-        time_label.setStyleSheet("""
-            color: #65676B;
-            font-size: 10px;
-            margin-top: 2px;
-        """)
-        time_label.setAlignment(Qt.AlignmentFlag.AlignLeft if not is_sender else Qt.AlignmentFlag.AlignRight)
-        message_layout.addWidget(time_label)
-        
-        if is_sender:
-            message_container.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
-        
-        main_layout.addWidget(message_container)
-        
-        if not is_sender:
-            main_layout.addStretch()
-        
-        self.setSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Fixed)
-        message_container.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Fixed)
+            painter.translate(bubble_rect.left() + left, bubble_rect.top() + top)
+            context = QAbstractTextDocumentLayout.PaintContext()
+            context.palette.setColor(QPalette.ColorRole.Text,
+                                     self.SENT_TEXT if message.is_sender else self.RECEIVED_TEXT)
+            doc.documentLayout().draw(painter, context)
+            painter.translate(-(bubble_rect.left() + left), -(bubble_rect.top() + top))
+        
+        timestamp = str(message.timestamp)
+        metrics = QFontMetrics(self.timestamp_font)
+        timestamp_width = max(bubble_rect.width(), metrics.horizontalAdvance(timestamp))
+        timestamp_left = bubble_rect.right() + 1 - timestamp_width if message.is_sender else bubble_rect.left()
+        timestamp_rect = QRect(timestamp_left, bubble_rect.bottom() + 1 + self.TIMESTAMP_SPACING,
+                               timestamp_width, metrics.height())
+        alignment = Qt.AlignmentFlag.AlignRight if message.is_sender else Qt.AlignmentFlag.AlignLeft
+        painter.setFont(self.timestamp_font)
+        painter.setPen(self.TIMESTAMP_COLOR)
+        painter.drawText(timestamp_rect, alignment | Qt.AlignmentFlag.AlignVCenter, timestamp)
+        painter.restore()
+
+class ChatListView(QListView):
+    # Message list that paints the theme's chat background image under the
+    # rows, taken from the pixmaps ThemeAssetLoader decoded ahead of time.
+    # Nothing is decoded here; until the pixmap is ready only the color shows.
+    background_key = None
+
+    def paintEvent(self, event):
+        if ChatListView.background_key:
+            pixmap = QPixmapCache.find(ChatListView.background_key)
+            if pixmap is not None and not pixmap.isNull():
+                size = pixmap.deviceIndependentSize().toSize()
+                rect = self.viewport().rect()
+                painter = QPainter(self.viewport())
+                painter.drawPixmap(
+                    (rect.width() - size.width()) // 2,
+                    (rect.height() - size.height()) // 2,
+                    pixmap
+                )
+                painter.end()
+        super().paintEvent(event)
+
+class SectionBackground(QObject):
+    # Paints a theme section's background image on one container widget,
+    # over its stylesheet background and under its contents. Like
+    # ChatListView it only draws pixmaps ThemeAssetLoader already decoded.
+    def __init__(self, widget):
+        super().__init__(widget)
+        self.widget = widget
+        self.key = None
+        widget.installEventFilter(self)
+
+    def set_key(self, key):
+        if key != self.key:
+            self.key = key
+            self.widget.update()
+
+    def eventFilter(self, obj, event):
+        if obj is self.widget and event.type() == QEvent.Type.Paint and self.key:
+            pixmap = QPixmapCache.find(self.key)
+            if pixmap is not None and not pixmap.isNull():
+                size = pixmap.deviceIndependentSize().toSize()
+                rect = obj.rect()
+                painter = QPainter(obj)
+                painter.drawPixmap(
+                    (rect.width() - size.width()) // 2,
+                    (rect.height() - size.height()) // 2,
+                    pixmap
+                )
+                painter.end()
+        return False
 
 class ChatHistory(QWidget):
+    older_requested = pyqtSignal()  # scrolled to the top, load earlier messages
+
     def __init__(self, parent=None):
         super().__init__(parent)
         
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.scroll_area.setStyleSheet("""
-            QScrollArea {
-                background-color: #2d2d2d;
-                border: none;
-            }
-        """)
-        
-        self.messages_widget = QWidget()
-        self.messages_layout = QVBoxLayout(self.messages_widget)
-        self.messages_layout.setSpacing(2) 
-        self.messages_layout.setContentsMargins(10, 5, 10, 5)
-        self.messages_layout.addStretch()
-        
-        self.scroll_area.setWidget(self.messages_widget)
+        # Only visible rows are painted; there is no widget per message
+        self.model = MessageListModel(self)
+        self.view = ChatListView(self)
+        self.delegate = MessageBubbleDelegate(self.view)
+        self.view.setModel(self.model)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.view.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.view.setBatchSize(200)
+        self.view.setSpacing(0)
         
         main_layout = QVBoxLayout(self)
         main_layout.setContentsMargins(0, 0, 0, 0)
-        main_layout.addWidget(self.scroll_area)
+        main_layout.addWidget(self.view)
+        
+        self.decoder = ImageDecoder(parent=self)
+        self.decoder.decoded.connect(self.image_decoded)
+        
+        # Decoded images change row heights; relayout once for a burst of them
+        self.relayout_timer = QTimer(self)
+        self.relayout_timer.setSingleShot(True)
+        self.relayout_timer.setInterval(0)
+        self.relayout_timer.timeout.connect(self.relayout)
+        self.stick_to_bottom = False
+        
+        # One scroll for any number of inserts in the same burst
+        self.scroll_timer = QTimer(self)
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(0)
+        self.scroll_timer.timeout.connect(self.scroll_to_bottom)
+        
+        # Live messages are queued and inserted together once per frame
+        self.pending = []
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(16)
+        self.flush_timer.timeout.connect(self.flush_pending)
+        
+        # Follow the bottom while the (batched) layout keeps growing the range,
+        # unless the user has scrolled away from it
+        self.at_bottom = True
+        self.decodes_suspended = False
+        self.row_limit = None  # set while the view is hidden
+        self.view.verticalScrollBar().valueChanged.connect(self.scrolled)
+        self.view.verticalScrollBar().rangeChanged.connect(self.range_changed)
     
-    def add_message(self, message, timestamp, is_sender=False, profile_image=None, image_label=None):
-        bubble = MessageBubble(message, timestamp, is_sender, profile_image)
-        
-        style = "sent_message" if is_sender else "received_message"
-        if self.parent() and hasattr(self.parent(), 'theme_manager'):
-            self.parent().theme_manager.apply_theme_to_widget(bubble, style)
-        
-        if image_label:
-            bubble.message_layout.addWidget(image_label)
+    def scrolled(self, value):
+        scrollbar = self.view.verticalScrollBar()
+        self.at_bottom = value >= scrollbar.maximum()
+        if value == scrollbar.minimum() and scrollbar.maximum() > 0 and self.isVisible():
+            self.older_requested.emit()
+    
+    def range_changed(self, minimum, maximum):
+        if self.at_bottom:
+            self.view.verticalScrollBar().setValue(maximum)
+    
+    def create_message(self, text, timestamp, is_sender=False, profile_image=None, sender=None,
+                       image_content=None, image_path=None):
+        message = ChatMessage(text, timestamp, is_sender, profile_image, sender=sender)
+        if image_content or image_path:
+            message.image_pending = True
+            message.image_source = (image_content, image_path)
+            if not self.decodes_suspended:
+                self.decoder.request(message, image_content, image_path)
+        return message
+    
+    def suspend_decodes(self):
+        # Hidden views stop decoding; resume_decodes() re-requests what is still pending
+        self.decoder.cancel_all()
+        self.decodes_suspended = True
+    
+    def resume_decodes(self):
+        if not self.decodes_suspended:
+            return
+        self.decodes_suspended = False
+        for message in self.model.messages:
+            if message.image_pending and message.image_source:
+                self.decoder.request(message, *message.image_source)
+    
+    def prepend_messages(self, messages):
+        # Older history loaded on scroll-up; keep the rows on screen where they were
+        if not messages:
+            return
+        scrollbar = self.view.verticalScrollBar()
+        distance_from_bottom = scrollbar.maximum() - scrollbar.value()
+        self.model.prepend(messages)
+        self.view.doItemsLayout()
+        scrollbar.setValue(scrollbar.maximum() - distance_from_bottom)
+    
+    def add_messages(self, messages):
+        # Bulk insert: one rowsInserted, one layout pass and one scroll
+        if not messages:
+            return
+        self.view.setUpdatesEnabled(False)
+        self.model.extend(messages)
+        if self.row_limit is not None:
+            self.trim(self.row_limit)
+        self.view.doItemsLayout()
+        self.view.setUpdatesEnabled(True)
+        self.scroll_timer.start()
+    
+    def trim(self, limit):
+        # Drop the oldest rows past `limit`; scrolling up loads them again
+        excess = self.model.rowCount() - limit
+        if excess > 0:
+            self.model.remove_first(excess)
+    
+    def queue_message(self, message):
+        self.pending.append(message)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+    
+    def flush_pending(self):
+        messages, self.pending = self.pending, []
+        self.add_messages(messages)
+    
+    def image_decoded(self, message, image):
+        message.image_pending = False
+        message.image_source = None
+        if image.isNull():
+            message.text = "[Image unavailable]"
+        else:
+            message.image = image
+        message.size_key = None
         
-        self.messages_layout.insertWidget(self.messages_layout.count() - 1, bubble)
-        QTimer.singleShot(100, self.scroll_to_bottom)
+        scrollbar = self.view.verticalScrollBar()
+        if not self.relayout_timer.isActive():
+            self.stick_to_bottom = scrollbar.value() >= scrollbar.maximum()
+        self.relayout_timer.start()
+    
+    def relayout(self):
+        self.view.doItemsLayout()
+        if self.stick_to_bottom:
+            self.scroll_to_bottom()
     
     def scroll_to_bottom(self):
-        self.scroll_area.verticalScrollBar().setValue(
-            self.scroll_area.verticalScrollBar().maximum()
-        )
+        self.view.scrollToBottom()
         
     def clear(self):
-        while self.messages_layout.count() > 1:
-            item = self.messages_layout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
+        self.decoder.cancel_all()
+        self.flush_timer.stop()
+        self.pending = []
+        self.model.clear()
 
-class ContactListItem(QWidget):
-    clicked = pyqtSignal()
-    
-    def __init__(self, profile_data):
-        super().__init__()
-        self.setObjectName("contactListItem")
-        
-        self.setFixedHeight(74)
-        
-        layout = QHBoxLayout(self)
-        layout.setContentsMargins(10, 5, 10, 20)
-        layout.setSpacing(10)
+class ChatViewStack(QStackedWidget):
+    # Keeps the ChatHistory views of the last `capacity` conversations alive,
+    # so switching back to one is a setCurrentWidget instead of a rebuild.
+    # Views are evicted least recently shown first. Hidden views follow the
+    # history limits: each keeps at most `row_limit` rows, and views are
+    # evicted while all of them together hold more than `total_rows`.
+    older_requested = pyqtSignal()
+    trimmed = pyqtSignal(str)  # a hidden view dropped its oldest rows
+
+    def __init__(self, capacity=5, row_limit=500, total_rows=5000, parent=None):
+        super().__init__(parent)
+        # The view being shown is always one of them
+        self.capacity = max(1, capacity)
+        self.row_limit = row_limit
+        self.total_rows = total_rows
+        self.views = OrderedDict()  # {peer: ChatHistory}
+        # Shown while no conversation is open
+        self.placeholder = self.create_view()
+
+    def create_view(self):
+        view = ChatHistory(self)
+        view.older_requested.connect(self.older_requested)
+        self.addWidget(view)
+        return view
+
+    def view_for(self, peer):
+        return self.views.get(peer)
+
+    def show_conversation(self, peer):
+        view = self.views.get(peer)
+        created = view is None
+        if created:
+            view = self.views[peer] = self.create_view()
+        else:
+            self.views.move_to_end(peer)
+        
+        previous = self.currentWidget()
+        if previous is not view:
+            previous.suspend_decodes()
+            self.hide_view(previous)
+            self.setCurrentWidget(view)
+        view.row_limit = None
+        view.resume_decodes()
+        
+        while len(self.views) > self.capacity or (
+                len(self.views) > 1 and self.row_count() > self.total_rows):
+            _, evicted = self.views.popitem(last=False)
+            self.discard(evicted)
+        return view, created
+
+    def hide_view(self, view):
+        peer = next((peer for peer, warm in self.views.items() if warm is view), None)
+        if peer is None:
+            return
+        view.row_limit = self.row_limit
+        if view.model.rowCount() > self.row_limit:
+            view.trim(self.row_limit)
+            self.trimmed.emit(peer)
+
+    def discard(self, view):
+        view.clear()
+        self.removeWidget(view)
+        view.deleteLater()
+
+    def reset(self):
+        for view in self.views.values():
+            self.discard(view)
+        self.views.clear()
+        self.setCurrentWidget(self.placeholder)
+        return self.placeholder
+
+    def row_count(self):
+        return sum(view.model.rowCount() for view in self.views.values())
+
+class ContactListModel(QAbstractListModel):
+    # One row per contact, found by username through `rows` so presence,
+    # profile and unread changes emit dataChanged for a single row. Profile
+    # data is read from the shared ProfileStore; rows only hold the
+    # conversation state.
+    ContactRole = Qt.ItemDataRole.UserRole + 1
+    ProfileRole = Qt.ItemDataRole.UserRole + 2
+
+    def __init__(self, profiles, parent=None):
+        super().__init__(parent)
+        self.profiles = profiles
+        self.contacts = []  # row dicts: username, last_preview, unread
+        self.rows = {}  # {username: row}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.contacts)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        contact = self.contacts[index.row()]
+        if role == Qt.ItemDataRole.UserRole:
+            return contact['username']
+        if role == self.ContactRole:
+            return contact
+        if role == self.ProfileRole:
+            return self.profiles.get(contact['username'])
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.profiles.display_name(contact['username'])
+        return None
+
+    def set_contacts(self, contacts):
+        self.beginResetModel()
+        self.contacts = [dict(contact) for contact in contacts]
+        self.rows = {contact['username']: row for row, contact in enumerate(self.contacts)}
+        self.endResetModel()
+
+    def add(self, contact):
+        if contact['username'] in self.rows:
+            return
+        row = len(self.contacts)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.contacts.append(dict(contact))
+        self.rows[contact['username']] = row
+        self.endInsertRows()
+
+    def remove(self, username):
+        row = self.rows.get(username)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.contacts[row]
+        self.rows = {contact['username']: i for i, contact in enumerate(self.contacts)}
+        self.endRemoveRows()
+
+    def contact(self, username):
+        row = self.rows.get(username)
+        return self.contacts[row] if row is not None else None
+
+    def index_of(self, username):
+        row = self.rows.get(username)
+        return self.index(row, 0) if row is not None else QModelIndex()
+
+    def update(self, username, **fields):
+        row = self.rows.get(username)
+        if row is None:
+            return
+        contact = self.contacts[row]
+        if all(contact.get(key) == value for key, value in fields.items()):
+            return
+        contact.update(fields)
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index)
+
+    def profile_changed(self, username):
+        row = self.rows.get(username)
+        if row is not None:
+            index = self.index(row, 0)
+            self.dataChanged.emit(index, index)
+
+class ContactDelegate(QStyledItemDelegate):
+    # Paints a contact row: avatar with presence dot, name, last message or
+    # status, unread badge and the optional tag image.
+    ROW_HEIGHT = 74
+    ROW_SPACING = 5
+    AVATAR_SIZE = 64
+    TAG_SIZE = QSize(64, 40)
+    HOVER_COLOR = QColor("#262626")
+    SELECTED_COLOR = QColor("#2d2d2d")
+    AVATAR_BACKGROUND = QColor("#2d2d2d")
+    ONLINE_COLOR = QColor("#31A24C")
+    NAME_COLOR = QColor("white")
+    SECONDARY_COLOR = QColor("#9ca3af")
+    BADGE_COLOR = QColor("#E91E63")
+    THEMED_COLORS = {
+        'HOVER_COLOR': 'contact_hover',
+        'SELECTED_COLOR': 'contact_selected',
+        'ONLINE_COLOR': 'contact_online',
+        'NAME_COLOR': 'contact_name',
+        'BADGE_COLOR': 'contact_unread',
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tags = {}  # {username: (base64 image, scaled pixmap)}
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.ROW_HEIGHT + self.ROW_SPACING)
+
+    def tag_pixmap(self, profile):
+        image = profile.additional_image
+        if not image:
+            return None
+        cached = self.tags.get(profile.username)
+        if cached is not None and cached[0] is image:
+            return cached[1]
+        
+        pixmap = QPixmap()
+        try:
+            pixmap.loadFromData(base64.b64decode(image))
+        except Exception as e:
+            print(f"Error processing additional image: {e}")
+        if not pixmap.isNull():
+            pixmap = pixmap.scaled(self.TAG_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                                   Qt.TransformationMode.SmoothTransformation)
+        else:
+            pixmap = None
+        self.tags[profile.username] = (image, pixmap)
+        return pixmap
+
+    def paint(self, painter, option, index):
+        contact = index.data(ContactListModel.ContactRole)
+        profile = index.data(ContactListModel.ProfileRole)
+        if contact is None or profile is None:
+            return
+        username = contact['username']
         
-        self.profile_data = profile_data
-        
-        # Profile Frame
-        profile_frame = QFrame()
-        profile_frame.setStyleSheet("""
-            QFrame {
-                background: transparent;
-                border: none;
-                min-width: 64px;
-                min-height: 64px;
-                max-width: 64px;
-                max-height: 64px;
-            }
-        """)
-        
-        profile_frame_layout = QGridLayout(profile_frame)
-        profile_frame_layout.setContentsMargins(0, 0, 0, 0)
-        profile_frame_layout.setSpacing(0)
-        
-        profile_container = QLabel()
-        profile_container.setFixedSize(64, 64)
-        profile_container.setStyleSheet("""
-            QLabel {
-                background-color: #2d2d2d;
-                border-radius: 32px;
-                padding: 0px;
-                margin: 0px;
-            }
-        """)
-        profile_frame_layout.addWidget(profile_container, 0, 0, Qt.AlignmentFlag.AlignCenter)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
         
-        if profile_data.get('profile_image'):
-            try:
-                pixmap = QPixmap()
-                pixmap.loadFromData(base64.b64decode(profile_data['profile_image']))
-                
-                scaled_size = min(pixmap.width(), pixmap.height())
-                scaled_pixmap = pixmap.scaled(scaled_size, scaled_size, 
-                                            Qt.AspectRatioMode.KeepAspectRatioByExpanding,
-                                            Qt.TransformationMode.SmoothTransformation)
-                
-                x = (scaled_pixmap.width() - scaled_size) // 2
-                y = (scaled_pixmap.height() - scaled_size) // 2
-                cropped_pixmap = scaled_pixmap.copy(x, y, scaled_size, scaled_size)
-                
-                final_pixmap = QPixmap(64, 64)
-                final_pixmap.fill(Qt.GlobalColor.transparent)
-                
-                painter = QPainter(final_pixmap)
-                painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-                
-                path = QPainterPath()
-                path.addEllipse(0, 0, 64, 64)
-                painter.setClipPath(path)
-                
-                dest_rect = QRect(0, 0, 64, 64)
-                painter.drawPixmap(dest_rect, cropped_pixmap)
-                painter.end()
-                
-                profile_container.setPixmap(final_pixmap)
-            except Exception as e:
-                print(f"Error processing profile image: {e}")
-                profile_container.setText(profile_data['username'][0].upper())
-                profile_container.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        rect = option.rect.adjusted(0, 0, 0, -self.ROW_SPACING)
+        if option.state & QStyle.StateFlag.State_Selected:
+            background = self.SELECTED_COLOR
+        elif option.state & QStyle.StateFlag.State_MouseOver:
+            background = self.HOVER_COLOR
         else:
-            profile_container.setText(profile_data['username'][0].upper())
-            profile_container.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        layout.addWidget(profile_frame)
-        
-        text_container = QWidget()
-        text_layout = QVBoxLayout(text_container)
-        text_layout.setContentsMargins(0, 0, 0, 0)
-        text_layout.setSpacing(2)
-        
-        text_layout.setAlignment(Qt.AlignmentFlag.AlignVCenter)
-        
-        self.name_label = QLabel(profile_data.get('display_name', profile_data['username']))
-        self.name_label.setObjectName("usernameLabel")
-        self.name_label.setStyleSheet("color: white; font-weight: bold; font-size: 14px;")
-        text_layout.addWidget(self.name_label)
-        
-        if profile_data.get('status_message'):
-            status_label = QLabel(profile_data['status_message'])
-            status_label.setStyleSheet("color: #9ca3af; font-size: 12px;")
-            text_layout.addWidget(status_label)
-        
-        layout.addWidget(text_container, stretch=1)
-        
-        if profile_data.get('additional_image'):
-            tag_container = QLabel()
-            tag_container.setFixedSize(64, 40)
-            tag_container.setStyleSheet("""
-                QLabel {
-                    border-radius: 5px;
-                    padding: 0px;
-                    margin: 0px;
-                }
-            """)
-            
-            try:
-                tag_pixmap = QPixmap()
-                tag_pixmap.loadFromData(base64.b64decode(profile_data['additional_image']))
-                scaled_tag = tag_pixmap.scaled(64, 40, 
-                                             Qt.AspectRatioMode.KeepAspectRatio,
-                                             Qt.TransformationMode.SmoothTransformation)
-                tag_container.setPixmap(scaled_tag)
-            except Exception as e:
-                print(f"Error processing additional image: {e}")
-            
-            layout.addWidget(tag_container)
+            background = None
+        if background is not None:
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(background)
+            painter.drawRoundedRect(QRectF(rect), 10, 10)
+        
+        # Avatar
+        avatar_rect = QRect(rect.left() + 10, rect.center().y() - self.AVATAR_SIZE // 2,
+                            self.AVATAR_SIZE, self.AVATAR_SIZE)
+        avatar = avatar_cache.get(username, profile.profile_image, self.AVATAR_SIZE)
+        if avatar is not None:
+            painter.drawPixmap(avatar_rect, avatar)
+        else:
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.AVATAR_BACKGROUND)
+            painter.drawEllipse(avatar_rect)
+            initial_font = QFont(option.font)
+            initial_font.setPixelSize(24)
+            painter.setFont(initial_font)
+            painter.setPen(self.NAME_COLOR)
+            painter.drawText(avatar_rect, Qt.AlignmentFlag.AlignCenter, username[:1].upper())
+        
+        if profile.online:
+            dot = QRect(avatar_rect.right() - 14, avatar_rect.bottom() - 14, 14, 14)
+            painter.setPen(QPen(background or QColor("#1a1a1a"), 2))
+            painter.setBrush(self.ONLINE_COLOR)
+            painter.drawEllipse(dot)
+        
+        # Right-hand side: tag image, then unread badge
+        right = rect.right() - 10
+        tag = self.tag_pixmap(profile)
+        if tag is not None:
+            tag_rect = QRect(right - self.TAG_SIZE.width() + 1, rect.center().y() - self.TAG_SIZE.height() // 2,
+                             self.TAG_SIZE.width(), self.TAG_SIZE.height())
+            painter.drawPixmap(
+                tag_rect.left() + (tag_rect.width() - tag.width()) // 2,
+                tag_rect.top() + (tag_rect.height() - tag.height()) // 2,
+                tag
+            )
+            right = tag_rect.left() - 10
+        
+        unread = contact.get('unread', 0)
+        if unread:
+            badge_font = QFont(option.font)
+            badge_font.setPixelSize(11)
+            badge_font.setBold(True)
+            badge_text = str(unread) if unread < 100 else "99+"
+            badge_width = max(20, QFontMetrics(badge_font).horizontalAdvance(badge_text) + 12)
+            badge_rect = QRect(right - badge_width + 1, rect.center().y() - 10, badge_width, 20)
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.BADGE_COLOR)
+            painter.drawRoundedRect(QRectF(badge_rect), 10, 10)
+            painter.setFont(badge_font)
+            painter.setPen(self.NAME_COLOR)
+            painter.drawText(badge_rect, Qt.AlignmentFlag.AlignCenter, badge_text)
+            right = badge_rect.left() - 10
+        
+        # Name and last message (or status message)
+        text_left = avatar_rect.right() + 11
+        text_width = max(0, right - text_left)
+        
+        name_font = QFont(option.font)
+        name_font.setPixelSize(14)
+        name_font.setBold(True)
+        name_metrics = QFontMetrics(name_font)
+        
+        secondary = contact.get('last_preview') or profile.status_message
+        secondary_font = QFont(option.font)
+        secondary_font.setPixelSize(12)
+        secondary_metrics = QFontMetrics(secondary_font)
+        
+        text_height = name_metrics.height()
+        if secondary:
+            text_height += 2 + secondary_metrics.height()
+        top = rect.center().y() - text_height // 2
+        
+        painter.setFont(name_font)
+        painter.setPen(self.NAME_COLOR)
+        name = profile.display_name
+        painter.drawText(
+            QRect(text_left, top, text_width, name_metrics.height()),
+            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+            name_metrics.elidedText(name, Qt.TextElideMode.ElideRight, text_width)
+        )
+        if secondary:
+            painter.setFont(secondary_font)
+            painter.setPen(self.SECONDARY_COLOR)
+            painter.drawText(
+                QRect(text_left, top + name_metrics.height() + 2, text_width, secondary_metrics.height()),
+                Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                secondary_metrics.elidedText(secondary, Qt.TextElideMode.ElideRight, text_width)
+            )
         
-        self.setStyleSheet("""
-            QWidget#contactListItem {
-                background-color: transparent;
-                border-radius: 8px;
-                padding: 0px;
-            }
-            QWidget#contactListItem:hover {
-                background-color: rgba(255, 255, 255, 0.1);
-            }
-        """)
-
+        painter.restore()
 
-    def get_username(self):
-        return self.profile_data['username']
-
-    def get_display_name(self):
-        return self.profile_data.get('display_name', self.profile_data['username'])
+# Base look of the main window and its dialogs, installed once on the
+# QApplication together with the compiled themes (see ThemeManager.apply_theme).
+# Widgets are picked by objectName and dynamic properties; only the theme
+# sections ThemeManager installs on their own widgets carry a stylesheet.
+# Dialog rules name the dialog too, so they outrank a theme's button rules.
+APP_STYLESHEET = """
+    #chatWindow {
+        background-color: #1a1a1a;
+    }
+    #chatWindow QLabel {
+        color: white;
+    }
+    #chatWindow QLineEdit {
+        padding: 8px;
+        border-radius: 20px;
+        background-color: #2d2d2d;
+        color: white;
+        border: none;
+    }
+    #chatWindow QLineEdit:focus {
+        border: 1px solid #3B82F6;
+    }
+    #chatWindow QPushButton {
+        padding: 8px 15px;
+        border-radius: 20px;
+        background-color: #3B82F6;
+        color: white;
+        border: none;
+    }
+    #chatWindow QPushButton:hover {
+        background-color: #2563EB;
+    }
+    #chatWindow QListWidget {
+        background-color: #1a1a1a;
+        border: none;
+    }
+    #chatWindow QTextEdit {
+        background-color: #2d2d2d;
+        color: white;
+        border: none;
+        border-radius: 10px;
+        padding: 10px;
+    }
+    #chatWindow QScrollBar:vertical {
+        border: none;
+        background: #1a1a1a;
+        width: 10px;
+        margin: 0;
+    }
+    #chatWindow QScrollBar::handle:vertical {
+        background: #3d3d3d;
+        min-height: 20px;
+        border-radius: 5px;
+    }
+    #chatWindow QScrollBar::add-line:vertical,
+    #chatWindow QScrollBar::sub-line:vertical {
+        border: none;
+        background: none;
+    }
     
-    def mousePressEvent(self, event):
-        self.clicked.emit()
-        super().mousePressEvent(event)
-
-class ChatListItem(QWidget):
-    clicked = pyqtSignal()
+    #chatWindow #sidebar {
+        background-color: #141414;
+    }
+    #chatWindow #sidebar QPushButton {
+        background-color: #2d2d2d;
+        border-radius: 20px;
+        padding: 0;
+        font-size: 20px;
+        color: #999;
+    }
+    #chatWindow #sidebar QPushButton:hover {
+        background-color: #3d3d3d;
+        color: white;
+    }
+    #chatWindow #sidebar QPushButton#avatarButton {
+        font-size: 14px;
+        font-weight: bold;
+        color: white;
+    }
     
-    def __init__(self, username, last_message="", time="", is_online=False):
-        super().__init__()
-        self.setObjectName("chatListItem")
-        layout = QHBoxLayout(self)
-        layout.setContentsMargins(10, 5, 10, 5)
-        
-        profile_widget = QLabel()
-        profile_widget.setFixedSize(40, 40)
-        profile_widget.setStyleSheet("""
-            background-color: #3A3B3C;
-            border-radius: 20px;
-            color: white;
-            qproperty-alignment: AlignCenter;
-        """)
-        profile_widget.setText(username[0].upper())
-        
-        layout.addWidget(profile_widget)
-        
-        text_widget = QWidget()
-        text_layout = QVBoxLayout(text_widget)
-        text_layout.setContentsMargins(10, 0, 0, 0)
-        text_layout.setSpacing(0)
-        
-        name_label = QLabel(username)
-        name_label.setStyleSheet("font-weight: bold; color: white; font-size: 14px;")
-        text_layout.addWidget(name_label)
-        
-        message_label = QLabel(last_message)
-        message_label.setStyleSheet("color: #8E8E8E; font-size: 13px;")
-        text_layout.addWidget(message_label)
-        
-        layout.addWidget(text_widget, stretch=1)
-        
-        if time:
-            time_label = QLabel(time)
-            time_label.setStyleSheet("color: #8E8E8E; font-size: 12px;")
-            layout.addWidget(time_label)
-        
-        if is_online:
-            self.setStyleSheet("""
-                QWidget#chatListItem {
-                    background-color: transparent;
-                    border-radius: 8px;
-                }
-                QWidget#chatListItem:hover {
-                    background-color: rgba(255, 255, 255, 0.1);
-                }
-            """)
+    #chatWindow #chatListPanel {
+        background-color: #1a1a1a;
+    }
+    #chatWindow QLineEdit#searchInput {
+        margin: 5px 0;
+        padding: 8px 15px;
+        background-color: #2d2d2d;
+    }
+    #chatWindow QListWidget#searchResults {
+        background-color: #2d2d2d;
+        border-radius: 10px;
+        color: white;
+    }
+    #chatWindow QListWidget#searchResults::item {
+        padding: 6px 10px;
+    }
+    #chatWindow QListWidget#searchResults::item:hover {
+        background-color: #3d3d3d;
+    }
+    #chatWindow QListView#contactsList {
+        background: transparent;
+        border: none;
+        outline: none;
+    }
+    
+    #chatWindow #chatArea {
+        background-color: #2d2d2d;
+    }
+    #chatWindow #chatHeader {
+        background-color: #2d2d2d;
+        border-bottom: 1px solid #3d3d3d;
+    }
+    #chatWindow QLabel#chatTitle {
+        font-size: 16px;
+        font-weight: bold;
+        color: white;
+    }
+    #chatWindow QLabel#chatTitle[placeholder="true"] {
+        color: #999;
+    }
+    #chatWindow ChatHistory, #chatWindow ChatHistory QWidget {
+        background-color: #2d2d2d;
+        margin-bottom: 20px;
+    }
+    #chatWindow ChatHistory QListView {
+        background-color: #2d2d2d;
+        border: none;
+        padding: 5px 0px;
+    }
+    #chatWindow #messageInputContainer {
+        background-color: #1a1a1a;
+        border-radius: 17px;
+    }
+    #chatWindow QTextEdit#messageInput {
+        background-color: transparent;
+        border: none;
+        border-radius: 0;
+        color: white;
+        font-size: 14px;
+        padding: 8px 0;
+    }
     
-    def mousePressEvent(self, event):
-        self.clicked.emit()
-        super().mousePressEvent(event)
+    #chatWindow QLabel#debugReadout {
+        font-family: monospace;
+        color: white;
+    }
+    #chatWindow QMenu#loginMenu {
+        background-color: #2d2d2d;
+        border: 1px solid #3d3d3d;
+        color: white;
+        padding: 5px;
+    }
+    #chatWindow QMenu#loginMenu::item {
+        padding: 5px 20px;
+    }
+    #chatWindow QMenu#loginMenu::item:selected {
+        background-color: #3d3d3d;
+    }
+    #chatWindow #loginDialog QLabel#statusLabel {
+        color: red;
+    }
+    
+    #chatWindow QDialog#registerDialog {
+        background-color: #1a1a1a;
+    }
+    #chatWindow #registerDialog QLabel {
+        color: white;
+        font-size: 14px;
+    }
+    #chatWindow #registerDialog QLineEdit {
+        padding: 8px;
+        border-radius: 20px;
+        background-color: #2d2d2d;
+        color: white;
+        border: none;
+        font-size: 14px;
+    }
+    #chatWindow #registerDialog QPushButton {
+        padding: 8px 15px;
+        border-radius: 20px;
+        background-color: #3B82F6;
+        color: white;
+        border: none;
+    }
+    #chatWindow #registerDialog QPushButton:hover {
+        background-color: #2563EB;
+    }
+    #chatWindow #registerDialog QLabel#profilePreview {
+        background-color: #2d2d2d;
+        border-radius: 50px;
+    }
+    #chatWindow #registerDialog QLabel#additionalPreview {
+        background-color: #2d2d2d;
+        border-radius: 10px;
+    }
+    #chatWindow #registerDialog QLabel#statusLabel {
+        color: #FF4444;
+    }
+    
+    #chatWindow QDialog#profileDialog {
+        background-color: #1a1a1a;
+    }
+    #chatWindow #profileDialog QLabel {
+        color: white;
+        font-size: 14px;
+        margin-top: 10px;
+    }
+    #chatWindow #profileDialog QLineEdit {
+        padding: 8px;
+        border-radius: 5px;
+        background-color: #2d2d2d;
+        color: white;
+        border: 1px solid #3d3d3d;
+        margin-bottom: 5px;
+    }
+    #chatWindow #profileDialog QLineEdit:focus {
+        border: 1px solid #3B82F6;
+    }
+    #chatWindow #profileDialog QPushButton {
+        padding: 8px 15px;
+        border-radius: 5px;
+        background-color: #3B82F6;
+        color: white;
+        border: none;
+        margin-top: 15px;
+    }
+    #chatWindow #profileDialog QPushButton:hover {
+        background-color: #2563EB;
+    }
+    #chatWindow #profileDialog QPushButton#cancelButton {
+        background-color: #4B5563;
+    }
+    #chatWindow #profileDialog QPushButton#cancelButton:hover {
+        background-color: #374151;
+    }
+    #chatWindow #profileDialog QPushButton#imageButton {
+        margin-top: 5px;
+        background-color: #4B5563;
+        padding: 5px 10px;
+    }
+    #chatWindow #profileDialog QPushButton#imageButton:hover {
+        background-color: #374151;
+    }
+    #chatWindow #profileDialog QLabel#profilePreview {
+        background-color: #2d2d2d;
+        border-radius: 64px;
+    }
+    #chatWindow #profileDialog QLabel#additionalPreview {
+        background-color: #2d2d2d;
+        border-radius: 5px;
+        padding: 5px;
+    }
+"""
+
+def apply_palette(delegate_class, palette):
+    # Point a delegate class's themed colors at the theme palette, falling
+    # back to the colors it was defined with
+    if 'DEFAULT_COLORS' not in delegate_class.__dict__:
+        delegate_class.DEFAULT_COLORS = {
+            attr: getattr(delegate_class, attr) for attr in delegate_class.THEMED_COLORS
+        }
+    for attr, key in delegate_class.THEMED_COLORS.items():
+        setattr(delegate_class, attr, palette.get(key, delegate_class.DEFAULT_COLORS[attr]))
 
 class ChatClient(QMainWindow):
-    message_received = pyqtSignal(str, str, str)
     status_updated = pyqtSignal(str, bool)
     
     def __init__(self):
@@ -683,31 +1517,65 @@ class ChatClient(QMainWindow):
         #self.current_contact = None
         #self.unread_messages = {}
         #self.theme_manager = None
-        #self._contacts_data = []
-        self.websocket = None
         self.username = None
         self.chat_histories = {}
         self.current_contact = None
         self.unread_messages = {}
-        self._contacts_data = []
+        self.conversations = {}  # {peer: summary from the server's conversations table}
+        self.profiles = ProfileStore()
+        self.store = None  # ClientStore of the logged-in (or last) user
+        self.pending_messages = {}  # {client_id: sent message awaiting message_ack}
+        self.attachment_tasks = {}  # {AttachmentTask: (store, messages, cached entries, complete)}
+        
+        # All protocol work happens in the session; the window only reacts to its events
+        self.session = ChatSession(reconnect=True, since_id=self.sync_cursor)
+        self.session.on(MessageReceived, self.handle_incoming_message)
+        self.session.on(MessageAck, self.handle_message_ack)
+        self.session.on(UserSearchResults, lambda event: self.show_user_search_results(event.query, event.results))
+        self.session.on(ContactAdded, self.handle_contact_added)
+        self.session.on(ContactRemoved, self.handle_contact_removed)
+        self.session.on(ProfileUpdated, lambda event: self.handle_profile_update(event.username, event.profile))
+        self.session.on(ProfileUpdateResult, self.handle_profile_update_result)
+        self.session.on(StatusUpdate, self.handle_status_event)
+        self.session.on(Reconnected, self.handle_reconnected)
+        self.next_client_id = 0
+        
+        # Messages shown in the open conversation are read on arrival; the
+        # server hears about it at most once a second per burst
+        self.read_peers = set()
+        self.read_timer = QTimer(self)
+        self.read_timer.setSingleShot(True)
+        self.read_timer.setInterval(1000)
+        self.read_timer.timeout.connect(self.send_read_receipts)
+        self.closing = False  # receipts and unread counts are being flushed before closing
         
 
         self.settings_file = "settings.json"
         self.theme_manager = ThemeManager()
+        self.theme_manager.base_stylesheet = APP_STYLESHEET
+        
+        # Reload the active theme when its files change, once editing settles
+        self.theme_watcher = QFileSystemWatcher(self)
+        self.theme_watcher.directoryChanged.connect(lambda: self.theme_reload_timer.start())
+        self.theme_watcher.fileChanged.connect(lambda: self.theme_reload_timer.start())
+        self.theme_reload_timer = QTimer(self)
+        self.theme_reload_timer.setSingleShot(True)
+        self.theme_reload_timer.setInterval(300)
+        self.theme_reload_timer.timeout.connect(self.reload_theme)
+        self.theme_manager.assets.loaded.connect(self.theme_asset_loaded)
+        
+        # Theme images are pre-scaled for the window; rescale when it grows
+        self.asset_resize_timer = QTimer(self)
+        self.asset_resize_timer.setSingleShot(True)
+        self.asset_resize_timer.setInterval(250)
+        self.asset_resize_timer.timeout.connect(self.rescale_theme_assets)
+        self.theme_bundle_task = None
+        self.history_limits = self.read_settings().get('history_limits', {})
+        self.chat_histories = self.new_history_cache()
 
         self.message_input = QTextEdit()
+        self.message_input.setObjectName("messageInput")
         self.message_input.setPlaceholderText("Type a message...")
-        self.message_input.setStyleSheet("""
-            QTextEdit {
-                background-color: #1a1a1a;
-                border-radius: 20px;
-                padding: 8px 15px;
-                font-size: 14px;
-                color: white;
-                min-height: 40px;
-                max-height: 120px;
-            }
-        """)
         
         document = self.message_input.document()
         document.contentsChanged.connect(self.adjust_input_height)
@@ -716,59 +1584,271 @@ class ChatClient(QMainWindow):
         self.message_input.installEventFilter(self)
         
         self.init_ui()
+        self.theme_manager.assets.set_target(self.size(), self.devicePixelRatioF())
         QTimer.singleShot(0, self.initialize_theme)
+        QTimer.singleShot(0, self.restore_cached_session)
 
     def initialize_theme(self):
         try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    current_theme = settings.get('current_theme', 'default')
-            else:
+            settings = self.read_settings()
+            current_theme = settings.get('current_theme')
+            if not current_theme:
                 current_theme = 'default'
                 self.save_settings({'current_theme': current_theme})
             
-            if self.theme_manager.load_theme(current_theme):
-                self.apply_current_theme()
-            else:
+            if not self.theme_manager.load_theme(current_theme):
                 print(f"ไม่สามารถโหลด theme: {current_theme} ได้ กำลังใช้ default theme แทน")
                 self.theme_manager.load_theme('default')
-                self.apply_current_theme()
                 
         except Exception as e:
             print(f"เกิดข้อผิดพลาดในการโหลด theme: {e}")
             self.theme_manager.load_theme('default')
-            self.apply_current_theme()
+        self.apply_current_theme()
+        self.watch_current_theme()
+
+    def watch_current_theme(self):
+        watched = self.theme_watcher.directories() + self.theme_watcher.files()
+        if watched:
+            self.theme_watcher.removePaths(watched)
+        
+        theme_name = self.theme_manager.current_theme_name
+        if not theme_name:
+            return
+        theme_dir = self.theme_manager.themes_dir / theme_name
+        # Editors often save by replacing the file, which drops the file
+        # watch; the directory watch catches that and we re-add the file
+        paths = [str(theme_dir)]
+        if (theme_dir / "theme.json").exists():
+            paths.append(str(theme_dir / "theme.json"))
+        # Asset files too, since an edited image doesn't touch theme.json
+        paths += [str(path) for path in self.theme_manager.asset_files() if path.exists()]
+        self.theme_watcher.addPaths(paths)
+
+    def reload_theme(self):
+        try:
+            changed = self.theme_manager.reload_current_theme()
+            if changed:
+                print(f"Theme reloaded, changed sections: {', '.join(sorted(changed))}")
+                self.apply_theme_sections(changed)
+        except Exception as e:
+            print(f"Error reloading theme: {e}")
+        self.watch_current_theme()
+
+    def apply_theme_sections(self, changed):
+        # Only what the changed sections feed is redone: sections with a
+        # widget of their own get their QSS set on that widget alone, the
+        # application stylesheet is reinstalled only if its part differs,
+        # and delegate colors and the window font follow their own sections
+        self.theme_manager.install_sections(self, changed)
+        self.theme_manager.install_stylesheet()
+        palette = self.theme_manager.current_palette()
+        if 'window' in changed:
+            self.setFont(palette.get('font', QApplication.font()))
+        if changed & {'chat_area', 'sent_message', 'received_message'}:
+            self.apply_bubble_palette(palette)
+        if 'contact_list' in changed:
+            self.apply_contact_palette(palette)
+        if changed & set(ThemeManager.BACKGROUND_SECTIONS):
+            self.apply_backgrounds()
+
+    def apply_bubble_palette(self, palette):
+        apply_palette(MessageBubbleDelegate, palette)
+        self.update_chat_views()
+
+    def apply_backgrounds(self):
+        # Show each section's background image only once it has been decoded
+        keys = {}
+        for section in ThemeManager.BACKGROUND_SECTIONS:
+            key = self.theme_manager.background_key(section)
+            keys[section] = key if key and self.theme_manager.assets.pixmap(key) else None
+        if keys['chat_area'] != ChatListView.background_key:
+            ChatListView.background_key = keys['chat_area']
+            self.update_chat_views()
+        for section, background in self.section_backgrounds.items():
+            background.set_key(keys[section])
+
+    def update_chat_views(self):
+        for view in self.chat_views.views.values():
+            view.view.viewport().update()
 
-    def load_settings(self):
+    def theme_asset_loaded(self, key):
+        if key in {self.theme_manager.background_key(section) for section in ThemeManager.BACKGROUND_SECTIONS}:
+            self.apply_backgrounds()
+
+    def rescale_theme_assets(self):
+        if self.theme_manager.assets.set_target(self.size(), self.devicePixelRatioF()):
+            self.theme_manager.preload_assets()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.asset_resize_timer.start()
+
+    def apply_contact_palette(self, palette):
+        apply_palette(ContactDelegate, palette)
+        self.contacts_list.viewport().update()
+
+    def read_settings(self):
         try:
             if os.path.exists(self.settings_file):
                 with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    current_theme = settings.get('current_theme', 'default')
-            else:
-                current_theme = 'default'
-                self.save_settings({'current_theme': current_theme})
-            
-            if self.theme_manager.load_theme(current_theme):
-                self.apply_current_theme()
-            else:
-                print(f"Failed to load theme: {current_theme}, falling back to default")
-                self.theme_manager.load_theme('default')
-                self.apply_current_theme()
-                
+                    return json.load(f)
         except Exception as e:
-            print(f"Error loading settings: {e}")
-            self.theme_manager.load_theme('default')
-            self.apply_current_theme()
+            print(f"Error reading settings: {e}")
+        return {}
 
     def save_settings(self, settings):
         try:
+            # Merge so saving the theme doesn't drop other keys (and vice versa)
+            merged = self.read_settings()
+            merged.update(settings)
             with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, indent=4)
+                json.dump(merged, f, indent=4)
         except Exception as e:
             print(f"Error saving settings: {e}")
 
+    def open_store(self, username):
+        if self.store:
+            if self.store.username == username:
+                return
+            self.store.close()
+        
+        self.store = ClientStore(username)
+        self.chat_histories = self.new_history_cache(self.store)
+        self.pending_messages = {}
+        self.read_peers = set()
+        self.current_contact = None
+        self.chat_history = self.chat_views.reset()
+
+    def restore_cached_session(self):
+        # Show the last user's contacts and conversations straight from disk;
+        # logging in then only fetches what changed since
+        username = self.read_settings().get('last_username')
+        if self.username or not username or not store_exists(username):
+            return
+        
+        try:
+            self.open_store(username)
+            self.username = username
+            self.conversations = {
+                summary['peer']: summary for summary in self.store.get_conversations()
+            }
+            self.unread_messages = {
+                peer: summary['unread_count']
+                for peer, summary in self.conversations.items()
+                if summary['unread_count']
+            }
+            self.update_contacts_list(self.store.get_contacts())
+            self.setWindowTitle(f'Chat Application - {username} (offline)')
+        except Exception as e:
+            print(f"Error restoring cached session: {e}")
+
+    def new_history_cache(self, store=None):
+        return HistoryCache(
+            store,
+            per_conversation=self.history_limits.get('per_conversation', 500),
+            total=self.history_limits.get('total', 5000)
+        )
+
+    def history_for(self, peer):
+        # Conversations are read from the store the first time they're needed
+        return self.chat_histories.get(peer)
+
+    def remember_message(self, peer, message):
+        self.chat_histories.get(peer)
+        self.chat_histories.append(peer, message)
+
+    def load_older_messages(self):
+        if not self.current_contact:
+            return
+        older = self.chat_histories.load_older(self.current_contact, 100)
+        self.chat_history.prepend_messages([
+            self.chat_message_for(message) for message in older
+        ])
+
+    def apply_login(self, result):
+        # Shared by the login dialog and by the session logging in again
+        # after a reconnect
+        self.conversations = {
+            summary['peer']: summary
+            for summary in result.conversations
+        }
+        self.store.save_conversations(list(self.conversations.values()))
+        self.unread_messages = {
+            peer: summary['unread_count']
+            for peer, summary in self.conversations.items()
+            if summary['unread_count']
+        }
+        self.update_contacts_list(result.contacts)
+        self.store.save_contacts([profile.to_dict() for profile in self.profiles.values()])
+        
+        self.apply_history_delta(result.chat_history)
+
+    def sync_cursor(self):
+        return self.store.last_message_id() if self.store else 0
+
+    def apply_history_delta(self, history):
+        if not history:
+            return
+        # A delta repeats messages that already arrived live since the last
+        # one; only the new ones are shown
+        entries = {}
+        added = self.save_messages(history, entries, complete=True)
+        
+        for chat in history:
+            if chat['id'] not in added:
+                continue
+            contact = chat['receiver'] if chat['sender'] == self.username else chat['sender']
+            message = {
+                'id': chat['id'],
+                'timestamp': chat['timestamp'],
+                'sender': chat['sender'],
+                'type': chat['message_type'],
+                'content': chat['content']
+            }
+            self.chat_histories.append(contact, message)
+            entries[chat['id']] = message
+            
+            view = self.chat_views.view_for(contact)
+            if view:
+                view.queue_message(self.chat_message_for(message, view))
+
+    def save_messages(self, messages, entries=None, complete=False):
+        # Records messages in the store; returns the ids neither stored nor
+        # on their way there. Image payloads are written on the thread pool
+        # first and the messages recorded once that is done, with the
+        # history entries in `entries` ({id: entry}, which the caller may
+        # still fill in) switched to the attachment references.
+        if not messages:
+            return set()
+        ids = [message['id'] for message in messages]
+        stored = self.store.stored_ids(ids)
+        pending = set().union(*(
+            (message['id'] for message in batch[1]) for batch in self.attachment_tasks.values()
+        ))
+        payloads = {
+            message['id']: message['content'] for message in messages
+            if message['id'] not in stored and message['message_type'] == 'image' and message.get('content')
+        }
+        if payloads:
+            task = AttachmentTask(self.store.attachments_dir, payloads)
+            task.signals.finished.connect(self.attachments_written)
+            self.attachment_tasks[task] = (self.store, messages, entries if entries is not None else {}, complete)
+            QThreadPool.globalInstance().start(task)
+        else:
+            self.store.add_messages(messages, complete)
+        return set(ids) - stored - pending
+
+    def attachments_written(self, task, written):
+        store, messages, entries, complete = self.attachment_tasks.pop(task)
+        for message_id, attachment in written.items():
+            entry = entries.get(message_id)
+            if attachment and entry is not None:
+                entry['attachment'] = attachment[0]
+                entry['content'] = None
+        # Dropped if another user logged in meanwhile; the next delta brings them back
+        if store is self.store:
+            store.add_messages(messages, complete, written)
+
     def adjust_input_height(self):
         doc_height = self.message_input.document().size().height()
         new_height = min(doc_height + 16, 120)
@@ -789,83 +1869,7 @@ class ChatClient(QMainWindow):
 
     def init_ui(self):
         self.setWindowTitle('MomoTalk')
-        self.setStyleSheet("""
-            QMainWindow {
-                background-color: #1a1a1a;
-            }
-            QLabel {
-                color: white;
-            }
-            QLineEdit {
-                padding: 8px;
-                border-radius: 20px;
-                background-color: #2d2d2d;
-                color: white;
-                border: none;
-            }
-            QLineEdit:focus {
-                border: 1px solid #3B82F6;
-            }
-            QPushButton {
-                padding: 8px 15px;
-                border-radius: 20px;
-                background-color: #3B82F6;
-                color: white;
-                border: none;
-            }
-            QPushButton:hover {
-                background-color: #2563EB;
-            }
-            QPushButton#loginButton {
-                background-color: #2d2d2d;
-                border-radius: 20px;
-                padding: 0;
-                font-size: 14px;
-                color: #999;
-            }
-            QPushButton#loginButton:hover {
-                background-color: #3d3d3d;
-                color: white;
-            }
-            QPushButton#settingsButton {
-                background-color: #2d2d2d;
-                border-radius: 20px;
-                padding: 0;
-                font-size: 20px;
-                color: #999;
-            }
-            QPushButton#settingsButton:hover {
-                background-color: #3d3d3d;
-                color: white;
-            }
-            QListWidget {
-                background-color: #1a1a1a;
-                border: none;
-            }
-            QTextEdit {
-                background-color: #2d2d2d;
-                color: white;
-                border: none;
-                border-radius: 10px;
-                padding: 10px;
-            }
-            QScrollBar:vertical {
-                border: none;
-                background: #1a1a1a;
-                width: 10px;
-                margin: 0;
-            }
-            QScrollBar::handle:vertical {
-                background: #3d3d3d;
-                min-height: 20px;
-                border-radius: 5px;
-            }
-            QScrollBar::add-line:vertical,
-            QScrollBar::sub-line:vertical {
-                border: none;
-                background: none;
-            }
-        """)
+        self.setObjectName(ThemeManager.ROOT_OBJECT_NAME)
         
         # Main layout
         main_widget = QWidget()
@@ -876,27 +1880,16 @@ class ChatClient(QMainWindow):
         
         # Left sidebar
         left_sidebar = QWidget()
+        left_sidebar.setObjectName("sidebar")
         left_sidebar.setFixedWidth(50)
-        left_sidebar.setStyleSheet("background-color: #141414;")
         left_layout = QVBoxLayout(left_sidebar)
         left_layout.setContentsMargins(5, 10, 5, 10)
         left_layout.setSpacing(10)
         
         # Profile button
         self.profile_btn = QPushButton()
+        self.profile_btn.setObjectName("avatarButton")
         self.profile_btn.setFixedSize(40, 40)
-        self.profile_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #2d2d2d;
-                border-radius: 20px;
-                padding: 0;
-                color: white;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #3d3d3d;
-            }
-        """)
         self.profile_btn.setVisible(False)
         left_layout.addWidget(self.profile_btn)
         
@@ -904,19 +1897,6 @@ class ChatClient(QMainWindow):
         self.edit_profile_btn = QPushButton("📝")
         self.edit_profile_btn.setObjectName("profileButton")
         self.edit_profile_btn.setFixedSize(40, 40)
-        self.edit_profile_btn.setStyleSheet("""
-            QPushButton#profileButton {
-                background-color: #2d2d2d;
-                border-radius: 20px;
-                padding: 0;
-                font-size: 20px;
-                color: #999;
-            }
-            QPushButton#profileButton:hover {
-                background-color: #3d3d3d;
-                color: white;
-            }
-        """)
         self.edit_profile_btn.clicked.connect(self.show_profile_editor)
         self.edit_profile_btn.setVisible(False)
         left_layout.addWidget(self.edit_profile_btn)
@@ -925,19 +1905,6 @@ class ChatClient(QMainWindow):
         self.login_btn = QPushButton("👤")
         self.login_btn.setObjectName("loginButton")
         self.login_btn.setFixedSize(40, 40)
-        self.login_btn.setStyleSheet("""
-            QPushButton#loginButton {
-                background-color: #2d2d2d;
-                border-radius: 20px;
-                padding: 0;
-                font-size: 20px;
-                color: #999;
-            }
-            QPushButton#loginButton:hover {
-                background-color: #3d3d3d;
-                color: white;
-            }
-        """)
         self.login_btn.clicked.connect(self.show_login_menu)
         left_layout.addWidget(self.login_btn)
         
@@ -955,62 +1922,66 @@ class ChatClient(QMainWindow):
         
         # Chat list panel
         chat_list_panel = QWidget()
+        chat_list_panel.setObjectName("chatListPanel")
         chat_list_panel.setMinimumWidth(300)
-        chat_list_panel.setStyleSheet("background-color: #1a1a1a;")
         chat_list_layout = QVBoxLayout(chat_list_panel)
         chat_list_layout.setContentsMargins(10, 10, 10, 10)
         
         # Search bar
-        search_input = QLineEdit()
-        search_input.setPlaceholderText("🔍 Search")
-        search_input.setStyleSheet("""
-            QLineEdit {
-                margin: 5px 0;
-                padding: 8px 15px;
-                background-color: #2d2d2d;
-            }
-        """)
-        chat_list_layout.addWidget(search_input)
+        self.search_input = QLineEdit()
+        self.search_input.setObjectName("searchInput")
+        self.search_input.setPlaceholderText("🔍 Search")
+        self.search_input.returnPressed.connect(self.request_add_contact)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
+        chat_list_layout.addWidget(self.search_input)
+        
+        # Search as you type, debounced so only the last keystroke hits the server
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.request_user_search)
+        
+        self.search_results = QListWidget()
+        self.search_results.setObjectName("searchResults")
+        self.search_results.setMaximumHeight(200)
+        self.search_results.setVisible(False)
+        self.search_results.itemClicked.connect(self.search_result_selected)
+        chat_list_layout.addWidget(self.search_results)
         
         # Contacts list
-        self.contacts_list = QListWidget()
-        self.contacts_list.setStyleSheet("""
-            QListWidget {
-                background: transparent;
-                border: none;
-            }
-            QListWidget::item {
-                background: transparent;
-                border-radius: 10px;
-                padding: 5px;
-                margin-bottom: 5px;
-            }
-            QListWidget::item:selected {
-                background-color: #2d2d2d;
-            }
-            QListWidget::item:hover {
-                background-color: #262626;
-            }
-        """)
-        self.contacts_list.itemClicked.connect(self.contact_selected)
+        self.contacts_model = ContactListModel(self.profiles, self)
+        self.contacts_list = QListView()
+        self.contacts_list.setObjectName("contactsList")
+        self.contacts_list.setModel(self.contacts_model)
+        self.contacts_list.setItemDelegate(ContactDelegate(self.contacts_list))
+        self.contacts_list.setMouseTracking(True)
+        self.contacts_list.setUniformItemSizes(True)
+        self.contacts_list.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.contacts_list.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.contacts_list.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.contacts_list.clicked.connect(self.contact_selected)
+        self.contacts_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.contacts_list.customContextMenuRequested.connect(self.show_contact_menu)
         chat_list_layout.addWidget(self.contacts_list)
         
         # Chat area
         chat_area = QWidget()
-        chat_area.setStyleSheet("background-color: #2d2d2d;")
+        chat_area.setObjectName("chatArea")
         chat_layout = QVBoxLayout(chat_area)
         chat_layout.setContentsMargins(0, 0, 0, 0)
         chat_layout.setSpacing(0)
         
         # Chat header
         chat_header = QWidget()
+        chat_header.setObjectName("chatHeader")
+        chat_header.setAttribute(Qt.WidgetAttribute.WA_StyledBackground)
         chat_header.setFixedHeight(60)
-        chat_header.setStyleSheet("background-color: #2d2d2d; border-bottom: 1px solid #3d3d3d;")
         header_layout = QHBoxLayout(chat_header)
         header_layout.setContentsMargins(20, 0, 20, 0)
         
         self.chat_title = QLabel("Please login first!")
-        self.chat_title.setStyleSheet("font-size: 16px; font-weight: bold; color: #999;")
+        self.chat_title.setObjectName("chatTitle")
+        self.chat_title.setProperty("placeholder", True)
         header_layout.addWidget(self.chat_title)
         
         chat_layout.addWidget(chat_header)
@@ -1019,15 +1990,16 @@ class ChatClient(QMainWindow):
         # self.chat_history = QTextEdit()
         # self.chat_history.setReadOnly(True)
 
-        # Neo
-        self.chat_history = ChatHistory()
-        self.chat_history.setStyleSheet("""
-            QWidget {
-                background-color: #2d2d2d;
-                margin-bottom: 20px;
-            }
-        """)
-        chat_layout.addWidget(self.chat_history)
+        # Neo: one ChatHistory per recently opened conversation
+        self.chat_views = ChatViewStack(
+            self.history_limits.get('warm_views', 5),
+            self.chat_histories.per_conversation,
+            self.chat_histories.total
+        )
+        self.chat_views.trimmed.connect(lambda peer: self.chat_histories.trim(peer))
+        self.chat_views.older_requested.connect(self.load_older_messages)
+        self.chat_history = self.chat_views.placeholder
+        chat_layout.addWidget(self.chat_views)
         
         # Message input area
         input_widget = QWidget()
@@ -1038,28 +2010,15 @@ class ChatClient(QMainWindow):
 
         # Container input
         input_container = QWidget()
+        input_container.setObjectName("messageInputContainer")
+        input_container.setAttribute(Qt.WidgetAttribute.WA_StyledBackground)
         input_container.setFixedHeight(35) 
-        input_container.setStyleSheet("""
-            QWidget {
-                background-color: #1a1a1a;
-                border-radius: 17px;  /* ครึ่งหนึ่งของความสูงเพื่อให้มนพอดี */
-            }
-        """)
 
         input_container_layout = QHBoxLayout(input_container)
         input_container_layout.setContentsMargins(10, 0, 10, 0)  
         input_container_layout.setSpacing(0)
 
         self.message_input.setFixedHeight(50)
-        self.message_input.setStyleSheet("""
-            QTextEdit {
-                background-color: transparent;
-                border: none;
-                color: white;
-                font-size: 14px;
-                padding: 8px 0;
-            }
-        """)
 
         input_container_layout.addWidget(self.message_input)
         input_layout.addWidget(input_container, stretch=1) 
@@ -1084,17 +2043,64 @@ class ChatClient(QMainWindow):
         main_layout.addWidget(left_sidebar)
         main_layout.addWidget(chat_container)
         
+        # The chat list paints its own background image (ChatListView)
+        self.section_backgrounds = {
+            'window': SectionBackground(self),
+            'header': SectionBackground(chat_header),
+            'sidebar': SectionBackground(left_sidebar),
+            'contact_list': SectionBackground(chat_list_panel),
+            'input_field': SectionBackground(input_container),
+        }
+        
         self.resize(1200, 800)
+        
+        debug_shortcut = QShortcut(QKeySequence("F12"), self)
+        debug_shortcut.activated.connect(self.show_debug_view)
+
+    def memory_readout(self):
+        stats = self.chat_histories.stats()
+        lines = [
+            f"Resident conversations: {stats['conversations']}",
+            f"Resident messages: {stats['messages']} "
+            f"(limit {self.chat_histories.per_conversation}/conversation, {self.chat_histories.total} total)",
+            f"Resident message text: {stats['text_bytes'] / 1024:.1f} KiB",
+            f"Warm chat views: {len(self.chat_views.views)} "
+            f"(limit {self.chat_views.capacity}, {self.chat_views.row_count()} rows)",
+            f"Avatar cache: {avatar_cache.total_bytes / 1024:.1f} KiB in {len(avatar_cache.pixmaps)} pixmaps",
+            f"Sent messages awaiting ack: {len(self.pending_messages)}",
+        ]
+        try:
+            with open('/proc/self/statm') as f:
+                rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            lines.append(f"Process RSS: {rss / (1024 * 1024):.1f} MiB")
+        except (OSError, ValueError, AttributeError):
+            pass
+        return "\n".join(lines)
+
+    def show_debug_view(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Debug')
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        layout = QVBoxLayout(dialog)
+        
+        readout = QLabel(self.memory_readout())
+        readout.setObjectName("debugReadout")
+        readout.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        layout.addWidget(readout)
+        
+        refresh_timer = QTimer(dialog)
+        refresh_timer.setInterval(1000)
+        refresh_timer.timeout.connect(lambda: readout.setText(self.memory_readout()))
+        refresh_timer.start()
+        
+        dialog.show()
 
     def show_profile_editor(self):
         if not self.username:
             return
             
-        current_profile = {}
-        for contact in self._contacts_data:
-            if contact['username'] == self.username:
-                current_profile = contact
-                break
+        profile = self.profiles.get(self.username)
+        current_profile = profile.to_dict() if profile else {}
         
         dialog = ProfileEditDialog(self.username, current_profile, self)
         if dialog.exec() == QDialog.DialogCode.Accepted:
@@ -1102,11 +2108,7 @@ class ChatClient(QMainWindow):
             
             async def update_profile():
                 try:
-                    await self.websocket.send(json.dumps({
-                        'type': 'profile_update',
-                        'username': self.username,
-                        **updated_data
-                    }))
+                    await self.session.update_profile(**updated_data)
                     
                     QMessageBox.information(self, 'Success', 'Profile update request sent!')
     
@@ -1117,20 +2119,7 @@ class ChatClient(QMainWindow):
 
     def show_login_menu(self):
         menu = QMenu(self)
-        menu.setStyleSheet("""
-            QMenu {
-                background-color: #2d2d2d;
-                border: 1px solid #3d3d3d;
-                color: white;
-                padding: 5px;
-            }
-            QMenu::item {
-                padding: 5px 20px;
-            }
-            QMenu::item:selected {
-                background-color: #3d3d3d;
-            }
-        """)
+        menu.setObjectName("loginMenu")
         
         login_action = menu.addAction("Login")
         register_action = menu.addAction("Register")
@@ -1142,26 +2131,154 @@ class ChatClient(QMainWindow):
         menu.exec(pos)
 
     def get_selected_contact_username(self):
-        current_item = self.contacts_list.currentItem()
-        if current_item:
-            return current_item.data(Qt.ItemDataRole.UserRole)
+        index = self.contacts_list.currentIndex()
+        if index.isValid():
+            return index.data(Qt.ItemDataRole.UserRole)
         return None
 
     def update_contacts_list(self, contacts_data):
         try:
-            self.contacts_list.clear()
-            self._contacts_data = contacts_data
-            for contact in contacts_data:
-                if contact['username'] != self.username:
-                    item = QListWidgetItem()
-                    widget = ContactListItem(contact)
-                    item.setSizeHint(widget.sizeHint())
-                    print(f"Adding contact: {contact['username']}")
-                    self.contacts_list.addItem(item)
-                    self.contacts_list.setItemWidget(item, widget)
+            self.profiles.set_all(contacts_data)
+            # Most recent conversations first
+            ordered = sorted(
+                (username for username in self.profiles.profiles if username != self.username),
+                key=lambda username: self.conversations.get(username, {}).get('last_timestamp') or '',
+                reverse=True
+            )
+            self.contacts_model.set_contacts([self.contact_row(username) for username in ordered])
         except Exception as e:
             print(f"Error updating contacts list: {e}")
 
+    def contact_row(self, username):
+        summary = self.conversations.get(username)
+        return dict(
+            username=username,
+            last_preview=summary['last_preview'] if summary else None,
+            unread=self.unread_messages.get(username, 0)
+        )
+
+    def add_contact_item(self, contact):
+        username = contact['username']
+        if username == self.username:
+            return
+        if self.contacts_model.contact(username):
+            return
+        
+        profile = self.profiles.update(username, contact)
+        if self.store:
+            self.store.save_contact(profile.to_dict())
+        self.contacts_model.add(self.contact_row(username))
+
+    def refresh_contact_summary(self, username):
+        summary = self.conversations.get(username)
+        self.contacts_model.update(
+            username,
+            last_preview=summary['last_preview'] if summary else None,
+            unread=self.unread_messages.get(username, 0)
+        )
+
+    def update_conversation_summary(self, peer, sender, message_type, content, timestamp):
+        self.conversations[peer] = {
+            'peer': peer,
+            'last_sender': sender,
+            'last_message_type': message_type,
+            'last_preview': '[Image]' if message_type == 'image' else content.replace('<br>', ' ')[:100],
+            'last_timestamp': timestamp,
+            'unread_count': self.unread_messages.get(peer, 0)
+        }
+        if self.store:
+            self.store.save_conversation(self.conversations[peer])
+        self.refresh_contact_summary(peer)
+
+    def mark_conversation_read(self, peer):
+        had_unread = self.unread_messages.pop(peer, 0) > 0
+        if peer in self.conversations:
+            self.conversations[peer]['unread_count'] = 0
+            if had_unread and self.store:
+                self.store.save_conversation(self.conversations[peer])
+        self.contacts_model.update(peer, unread=0)
+        
+        if had_unread and self.session.is_open:
+            asyncio.get_event_loop().create_task(self.session.mark_read(peer))
+
+    def send_read_receipts(self):
+        # Peers stay queued while offline and go out after the next login
+        if not self.read_peers or not self.session.is_open:
+            return
+        asyncio.get_event_loop().create_task(self.mark_peers_read())
+
+    async def mark_peers_read(self):
+        peers, self.read_peers = self.read_peers, set()
+        for peer in peers:
+            await self.session.mark_read(peer)
+
+    def remove_contact_item(self, username):
+        # The profile stays known so existing messages from them still render
+        if self.store:
+            self.store.remove_contact(username)
+        self.contacts_model.remove(username)
+
+    def request_user_search(self):
+        query = self.search_input.text().strip()
+        if not query:
+            self.search_results.clear()
+            self.search_results.setVisible(False)
+            return
+        if not self.session.is_open or not self.username:
+            return
+        
+        asyncio.get_event_loop().create_task(self.session.search_users(query))
+
+    def show_user_search_results(self, query, results):
+        # Drop responses for queries the user has already typed past
+        if query != self.search_input.text().strip():
+            return
+        
+        self.search_results.clear()
+        for user in results:
+            label = f"{user['display_name'] or user['username']}  @{user['username']}"
+            if user['is_contact']:
+                label += "  ✓"
+            item = QListWidgetItem(label)
+            item.setData(Qt.ItemDataRole.UserRole, user)
+            self.search_results.addItem(item)
+        self.search_results.setVisible(bool(results))
+
+    def search_result_selected(self, item):
+        user = item.data(Qt.ItemDataRole.UserRole)
+        self.search_input.clear()
+        
+        if user['is_contact']:
+            index = self.contacts_model.index_of(user['username'])
+            if index.isValid():
+                self.contacts_list.setCurrentIndex(index)
+                self.contact_selected(index)
+        elif self.session.is_open:
+            asyncio.get_event_loop().create_task(self.session.add_contact(user['username']))
+
+    def request_add_contact(self):
+        if self.search_results.count():
+            self.search_result_selected(self.search_results.item(0))
+            return
+        
+        contact = self.search_input.text().strip()
+        if not self.session.is_open or not self.username or not contact:
+            return
+        
+        asyncio.get_event_loop().create_task(self.session.add_contact(contact))
+
+    def show_contact_menu(self, pos):
+        index = self.contacts_list.indexAt(pos)
+        if not index.isValid() or not self.session.is_open:
+            return
+        
+        menu = QMenu(self)
+        remove_action = menu.addAction("Remove contact")
+        if menu.exec(self.contacts_list.mapToGlobal(pos)) == remove_action:
+            asyncio.get_event_loop().create_task(
+                self.session.remove_contact(index.data(Qt.ItemDataRole.UserRole))
+            )
+
     def handle_login_success(self):
         self.login_btn.setVisible(False)
         self.profile_btn.setVisible(True)
@@ -1169,81 +2286,17 @@ class ChatClient(QMainWindow):
         self.profile_btn.setText(self.username[0].upper())
         
         if self.current_contact:
-            self.chat_title.setText(self.current_contact)
+            self.set_chat_title(self.current_contact)
         else:
-            self.chat_title.setText("Select a chat")
-        self.chat_title.setStyleSheet("font-size: 16px; font-weight: bold; color: white;")
+            self.set_chat_title("Select a chat")
 
-    def contact_selected(self, item):
-        contact_widget = self.contacts_list.itemWidget(item)
-        if not contact_widget:
-            print("No contact widget found")  # Debug log
-            return
-        
-        try:
-            self.current_contact = contact_widget.get_username()
-            display_name = contact_widget.get_display_name()
-            print(f"Selected contact: {self.current_contact} ({display_name})")  # Debug log
-            
-            if self.current_contact:
-                self.chat_title.setText(display_name)
-                self.chat_title.setStyleSheet("font-size: 16px; font-weight: bold; color: white;")
-                self.chat_history.clear()
-                
-                if self.current_contact in self.unread_messages:
-                    del self.unread_messages[self.current_contact]
-                
-                if self.current_contact in self.chat_histories:
-                    for message in self.chat_histories[self.current_contact]:
-                        self.append_chat_message(
-                            message['sender'],
-                            message['type'],
-                            message['content'],
-                            message['timestamp']
-                        )
-        except Exception as e:
-            print(f"Error in contact_selected: {e}")
-    
-    def create_chat_item(self, username, status=""):
-        widget = QWidget()
-        layout = QHBoxLayout(widget)
-        layout.setContentsMargins(5, 5, 5, 5)
-        
-        profile_pic = QLabel()
-        profile_pic.setFixedSize(40, 40)
-        profile_pic.setStyleSheet("""
-            background-color: #3d3d3d;
-            border-radius: 20px;
-            color: white;
-            qproperty-alignment: AlignCenter;
-        """)
-        profile_pic.setText(username[0].upper())
-        layout.addWidget(profile_pic)
-        
-        text_widget = QWidget()
-        text_layout = QVBoxLayout(text_widget)
-        text_layout.setContentsMargins(10, 0, 0, 0)
-        text_layout.setSpacing(2)
-        
-        name_label = QLabel(username)
-        name_label.setStyleSheet("font-weight: bold; color: white;")
-        text_layout.addWidget(name_label)
-        
-        if status:
-            status_label = QLabel(status)
-            status_label.setStyleSheet("color: #9ca3af; font-size: 12px;")
-            text_layout.addWidget(status_label)
-        
-        layout.addWidget(text_widget)
-        
-        return widget
-
-    def add_chat_item(self, profile_pic, name, last_message, time, is_online=False):
-        item = QListWidgetItem(self.chat_list)
-        chat_widget = ChatListItem(profile_pic, name, last_message, time, is_online)
-        item.setSizeHint(chat_widget.sizeHint())
-        self.chat_list.addItem(item)
-        self.chat_list.setItemWidget(item, chat_widget)
+    def set_chat_title(self, text, placeholder=False):
+        self.chat_title.setText(text)
+        if self.chat_title.property("placeholder") != placeholder:
+            # Re-polish only the title so the [placeholder] rule is re-evaluated
+            self.chat_title.setProperty("placeholder", placeholder)
+            self.chat_title.style().unpolish(self.chat_title)
+            self.chat_title.style().polish(self.chat_title)
 
     def show_theme_selector(self):
         themes = self.theme_manager.get_available_themes()
@@ -1266,12 +2319,40 @@ class ChatClient(QMainWindow):
                 if self.theme_manager.load_theme(theme):
                     self.save_settings({'current_theme': theme})
                     self.apply_current_theme()
+                    self.watch_current_theme()
                     QMessageBox.information(self, 'สำเร็จ', f'เปลี่ยน theme เป็น "{theme}" เรียบร้อยแล้ว')
                 else:
                     QMessageBox.warning(self, 'ผิดพลาด', f'ไม่สามารถโหลด theme "{theme}" ได้')
             except Exception as e:
                 QMessageBox.warning(self, 'ผิดพลาด', f'เกิดข้อผิดพลาด: {str(e)}')
     
+    def run_theme_bundle_task(self, label, job, args, on_finished):
+        # Theme zips are read and written on the thread pool; the dialog only
+        # shows progress, the job itself cannot be cancelled halfway
+        if self.theme_bundle_task is not None:
+            QMessageBox.warning(self, 'Warning', 'Another theme import/export is still running')
+            return
+        
+        dialog = QProgressDialog(label, None, 0, 100, self)
+        dialog.setWindowTitle('Theme')
+        dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        dialog.setMinimumDuration(300)
+        dialog.setAutoClose(False)
+        dialog.setValue(0)
+        
+        task = ThemeBundleTask(job, *args)
+        task.signals.progress.connect(dialog.setValue)
+        
+        def finished(result):
+            self.theme_bundle_task = None
+            dialog.close()
+            dialog.deleteLater()
+            on_finished(result)
+        
+        task.signals.finished.connect(finished)
+        self.theme_bundle_task = task
+        QThreadPool.globalInstance().start(task)
+    
     def import_theme(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self,
@@ -1281,10 +2362,22 @@ class ChatClient(QMainWindow):
         )
         
         if file_path:
-            if self.theme_manager.import_theme(file_path):
-                QMessageBox.information(self, 'Success', 'Theme imported successfully')
-            else:
-                QMessageBox.warning(self, 'Error', 'Failed to import theme')
+            self.run_theme_bundle_task(
+                'Importing theme...',
+                self.theme_manager.import_theme,
+                (file_path,),
+                self.theme_imported
+            )
+    
+    def theme_imported(self, theme_name):
+        if not theme_name:
+            QMessageBox.warning(self, 'Error', 'Failed to import theme')
+            return
+        
+        self.theme_manager.registry.scan()
+        if theme_name == self.theme_manager.current_theme_name:
+            self.reload_theme()
+        QMessageBox.information(self, 'Success', f'Theme "{theme_name}" imported successfully')
     
     def export_theme(self):
         if not self.theme_manager.current_theme_name:
@@ -1299,57 +2392,36 @@ class ChatClient(QMainWindow):
         )
         
         if file_path:
-            if self.theme_manager.export_theme(self.theme_manager.current_theme_name, file_path):
-                QMessageBox.information(self, 'Success', 'Theme exported successfully')
-            else:
-                QMessageBox.warning(self, 'Error', 'Failed to export theme')
+            self.run_theme_bundle_task(
+                'Exporting theme...',
+                self.theme_manager.export_theme,
+                (self.theme_manager.current_theme_name, file_path),
+                self.theme_exported
+            )
+    
+    def theme_exported(self, success):
+        if success:
+            QMessageBox.information(self, 'Success', 'Theme exported successfully')
+        else:
+            QMessageBox.warning(self, 'Error', 'Failed to export theme')
     
     def apply_current_theme(self):
         try:
-            if not self.theme_manager or not self.theme_manager.current_theme:
+            if not self.theme_manager:
                 return
-                
-            # Main Window
-            self.theme_manager.apply_theme_to_widget(self, "window")
-            
-            # Left Sidebar
-            if hasattr(self, 'left_sidebar'):
-                self.theme_manager.apply_theme_to_widget(self.left_sidebar, "sidebar")
-            
-            # Search Input
-            if hasattr(self, 'search_input'):
-                self.theme_manager.apply_theme_to_widget(self.search_input, "input_field")
             
-            # Chat Area and Components
-            if hasattr(self, 'chat_history'):
-                self.theme_manager.apply_theme_to_widget(self.chat_history, "chat_area")
+            # One application-level stylesheet; switching between themes that
+            # are already compiled only flips the window's theme property
+            self.theme_manager.apply_theme(self)
             
-            if hasattr(self, 'chat_title'):
-                self.theme_manager.apply_theme_to_widget(self.chat_title, "window")
-                
-            if hasattr(self, 'message_input'):
-                self.theme_manager.apply_theme_to_widget(self.message_input, "input_field")
-            
-            # Contact List
-            if hasattr(self, 'contacts_list'):
-                self.theme_manager.apply_theme_to_widget(self.contacts_list, "contact_list")
+            palette = self.theme_manager.current_palette()
+            self.setFont(palette.get('font', QApplication.font()))
             
-            # All Buttons
-            for button in self.findChildren(QPushButton):
-                self.theme_manager.apply_theme_to_widget(button, "buttons")
-                
-            # Special Buttons
-            if hasattr(self, 'send_btn'):
-                self.theme_manager.apply_theme_to_widget(self.send_btn, "buttons")
-            if hasattr(self, 'image_btn'):
-                self.theme_manager.apply_theme_to_widget(self.image_btn, "buttons")
+            # Bubbles and contact rows are painted by delegates
+            self.apply_bubble_palette(palette)
+            self.apply_contact_palette(palette)
+            self.apply_backgrounds()
             
-            # Message Bubbles
-            for bubble in self.findChildren(MessageBubble):
-                is_sender = bubble.property("is_sender")
-                style = "sent_message" if is_sender else "received_message"
-                self.theme_manager.apply_theme_to_widget(bubble, style)
-                
         except Exception as e:
             print(f"เกิดข้อผิดพลาดในการใช้ theme: {e}")
 
@@ -1357,33 +2429,7 @@ class ChatClient(QMainWindow):
         dialog = QDialog(self)
         dialog.setWindowTitle('Register')
         dialog.setModal(True)
-        dialog.setStyleSheet("""
-            QDialog {
-                background-color: #1a1a1a;
-            }
-            QLabel {
-                color: white;
-                font-size: 14px;
-            }
-            QLineEdit {
-                padding: 8px;
-                border-radius: 20px;
-                background-color: #2d2d2d;
-                color: white;
-                border: none;
-                font-size: 14px;
-            }
-            QPushButton {
-                padding: 8px 15px;
-                border-radius: 20px;
-                background-color: #3B82F6;
-                color: white;
-                border: none;
-            }
-            QPushButton:hover {
-                background-color: #2563EB;
-            }
-        """)
+        dialog.setObjectName('registerDialog')
         layout = QVBoxLayout(dialog)
         layout.setSpacing(10)
         
@@ -1405,12 +2451,7 @@ class ChatClient(QMainWindow):
         self.profile_image_path = ''
         profile_image_preview = QLabel()
         profile_image_preview.setFixedSize(100, 100)
-        profile_image_preview.setStyleSheet("""
-            QLabel {
-                background-color: #2d2d2d;
-                border-radius: 50px;
-            }
-        """)
+        profile_image_preview.setObjectName('profilePreview')
         profile_image_layout.addWidget(profile_image_preview)
         
         profile_image_btn = QPushButton('Select Image')
@@ -1423,12 +2464,7 @@ class ChatClient(QMainWindow):
         self.additional_image_path = ''
         additional_image_preview = QLabel()
         additional_image_preview.setFixedSize(200, 100)
-        additional_image_preview.setStyleSheet("""
-            QLabel {
-                background-color: #2d2d2d;
-                border-radius: 10px;
-            }
-        """)
+        additional_image_preview.setObjectName('additionalPreview')
         additional_image_layout.addWidget(additional_image_preview)
         
         additional_image_btn = QPushButton('Select Image')
@@ -1451,7 +2487,7 @@ class ChatClient(QMainWindow):
         
         # Status label
         status_label = QLabel('')
-        status_label.setStyleSheet('color: #FF4444;')
+        status_label.setObjectName('statusLabel')
         layout.addWidget(status_label)
         
         # Register button
@@ -1516,11 +2552,7 @@ class ChatClient(QMainWindow):
                 return
                 
             try:
-                if not self.websocket:
-                    self.websocket = await websockets.connect(
-                        'ws://localhost:8765',
-                        max_size=100 * 1024 * 1024  # 100MB
-                    )
+                await self.session.connect()
                 
                 # Convert images to base64
                 with open(self.profile_image_path, 'rb') as f:
@@ -1531,22 +2563,19 @@ class ChatClient(QMainWindow):
                     with open(self.additional_image_path, 'rb') as f:
                         additional_image = base64.b64encode(f.read()).decode('utf-8')
                 
-                await self.websocket.send(json.dumps({
-                    'type': 'register',
-                    'username': username_input.text(),
-                    'display_name': display_name_input.text(),
-                    'password': password_input.text(),
-                    'profile_image': profile_image,
-                    'additional_image': additional_image
-                }))
-                
-                response = json.loads(await self.websocket.recv())
+                result = await self.session.register(
+                    username_input.text(),
+                    password_input.text(),
+                    display_name_input.text(),
+                    profile_image,
+                    additional_image
+                )
                 
-                if response.get('status') == 'success':
+                if result.success:
                     QMessageBox.information(dialog, 'Success', 'Registration successful!')
                     dialog.accept()
                 else:
-                    status_label.setText(response.get('message', 'Registration failed'))
+                    status_label.setText(result.message or 'Registration failed')
             
             except Exception as e:
                 status_label.setText(f'Error: {str(e)}')
@@ -1562,6 +2591,7 @@ class ChatClient(QMainWindow):
         dialog = QDialog(self)
         dialog.setWindowTitle('Login')
         dialog.setModal(True)
+        dialog.setObjectName('loginDialog')
         layout = QVBoxLayout(dialog)
         
         username_input = QLineEdit()
@@ -1571,7 +2601,7 @@ class ChatClient(QMainWindow):
         password_input.setEchoMode(QLineEdit.EchoMode.Password)
         
         status_label = QLabel('')
-        status_label.setStyleSheet('color: red')
+        status_label.setObjectName('statusLabel')
         
         login_button = QPushButton('Login')
         
@@ -1588,91 +2618,56 @@ class ChatClient(QMainWindow):
                 
                 if not username or not password:
                     status_label.setText('Please enter username and password')
-                    status_label.setStyleSheet('color: red')
                     print("Empty username or password")
                     return
                 
                 status_label.setText('Connecting to server...')
                 print("Attempting to connect to server")
                 
-                if not self.websocket:
-                    try:
-                        print("Creating new websocket connection")
-                        self.websocket = await websockets.connect('ws://localhost:8765')
-                        print("Websocket connection established")
-                    except Exception as e:
-                        print(f"Websocket connection error: {e}")
-                        status_label.setText(f'Connection error: {str(e)}')
-                        return
-                
-                login_data = {
-                    'type': 'login',
-                    'username': username,
-                    'password': password
-                }
-                print(f"Sending login request: {login_data}")
-                
                 try:
-                    await self.websocket.send(json.dumps(login_data))
-                    print("Login request sent")
+                    await self.session.connect()
                 except Exception as e:
-                    print(f"Error sending login request: {e}")
-                    status_label.setText('Error sending login request')
+                    print(f"Websocket connection error: {e}")
+                    status_label.setText(f'Connection error: {str(e)}')
                     return
                 
+                print(f"Sending login request for {username}")
                 status_label.setText('Waiting for response...')
-                print("Waiting for server response")
                 
                 try:
-                    response = await asyncio.wait_for(self.websocket.recv(), timeout=10.0)
-                    print(f"Received response: {response}")
-                    response_data = json.loads(response)
+                    result = await asyncio.wait_for(
+                        self.session.login(username, password, since_id=last_message_id_for(username)),
+                        timeout=10.0
+                    )
                 except asyncio.TimeoutError:
                     print("Server response timeout")
                     status_label.setText('Server response timeout')
                     return
                 except Exception as e:
-                    print(f"Error receiving response: {e}")
+                    print(f"Error during login request: {e}")
                     status_label.setText('Error receiving response')
                     return
                 
-                if response_data['status'] == 'success':
+                if result.success:
                     print("Login successful")
+                    self.open_store(username)
                     self.username = username
                     self.setWindowTitle(f'Chat Application - {self.username}')
-                    
-                    self.update_contacts_list(response_data['contacts'])
-
-                    if 'chat_history' in response_data:
-                        for chat in response_data['chat_history']:
-                            contact = chat['receiver'] if chat['sender'] == self.username else chat['sender']
-                            if contact not in self.chat_histories:
-                                self.chat_histories[contact] = []
-                            
-                            self.chat_histories[contact].append({
-                                'timestamp': chat['timestamp'],
-                                'sender': chat['sender'],
-                                'type': chat['message_type'],
-                                'content': chat['content']
-                            })
-                    
-                    print("Starting message receiving loop")
-                    asyncio.get_event_loop().create_task(self.receive_messages())
+                    self.save_settings({'last_username': username})
+                    self.apply_login(result)
                     
                     self.handle_login_success()
                     
                     QMessageBox.information(dialog, 'Success', 'Login successful')
                     dialog.accept()
                 else:
-                    error_msg = response_data.get('message', 'Login failed')
+                    error_msg = result.message or 'Login failed'
                     print(f"Login failed: {error_msg}")
                     status_label.setText(error_msg)
-                    status_label.setStyleSheet('color: red')
             
             except Exception as e:
                 print(f"Unexpected error during login: {e}")
                 status_label.setText(f'Error: {str(e)}')
-                status_label.setStyleSheet('color: red')
         
         def handle_login():
             print("Login button clicked - creating task")
@@ -1690,199 +2685,159 @@ class ChatClient(QMainWindow):
         print("Showing login dialog")
         dialog.exec()
     
-    def append_message(self, sender, message_type, content):
-        if not self.current_contact:
-            return
-            
-        timestamp = datetime.now().strftime('%H:%M')
-        
-        if self.current_contact not in self.chat_histories:
-            self.chat_histories[self.current_contact] = []
-        
-        self.chat_histories[self.current_contact].append({
-            'timestamp': timestamp,
-            'sender': sender,
-            'type': message_type,
-            'content': content
-        })
-        
-        profile_image = None
-        for contact in self._contacts_data:
-            if contact['username'] == sender:
-                profile_image = contact.get('profile_image')
-                break
-        
-        if message_type == 'text':
-            self.chat_history.add_message(
-                content,
-                timestamp,
-                sender == self.username,
-                profile_image
-            )
-        elif message_type == 'image':
-            image_data = base64.b64decode(content)
-            image = QImage.fromData(image_data)
-            if not image.isNull():
-                pixmap = QPixmap.fromImage(image)
-                if pixmap.width() > 300:
-                    pixmap = pixmap.scaledToWidth(300)
-                
-                image_label = QLabel()
-                image_label.setPixmap(pixmap)
-                image_label.setStyleSheet("""
-                    border-radius: 15px;
-                    padding: 5px;
-                """)
-                
-                self.chat_history.add_message(
-                    "", 
-                    timestamp,
-                    sender == self.username,
-                    profile_image,
-                    image_label
-                )
+    def chat_message_for(self, message, view=None):
+        view = view or self.chat_history
+        sender = message.get('sender', 'Unknown')
+        
+        profile_image = self.profiles.profile_image(sender)
+        
+        image_content = image_path = None
+        text = message.get('content') or ''
+        if message.get('type') == 'image':
+            image_content, text = text, ""
+            if message.get('attachment') and self.store:
+                image_path = self.store.attachment_path(message['attachment'])
+            elif not image_content:
+                text = "[Image unavailable]"
+        
+        return view.create_message(
+            text,
+            message.get('timestamp', datetime.now().strftime('%H:%M')),
+            sender == self.username,
+            profile_image,
+            sender,
+            image_content=image_content,
+            image_path=image_path
+        )
 
     def display_message(self, message):
         try:
-            timestamp = message.get('timestamp', datetime.now().strftime('%H:%M'))
-            sender = message.get('sender', 'Unknown')
-            msg_type = message.get('type', 'text')
-            content = message.get('content', '')
-            
-            profile_image = None
-            for contact in self._contacts_data:
-                if contact['username'] == sender:
-                    profile_image = contact.get('profile_image')
-                    break
-            
-            if msg_type == 'text':
-                self.chat_history.add_message(
-                    content,
-                    timestamp,
-                    sender == self.username,
-                    profile_image
-                )
-            elif msg_type == 'image':
-                image_data = base64.b64decode(content)
-                image = QImage.fromData(image_data)
-                if not image.isNull():
-                    pixmap = QPixmap.fromImage(image)
-                    if pixmap.width() > 300:
-                        pixmap = pixmap.scaledToWidth(300)
-                    
-                    image_label = QLabel()
-                    image_label.setPixmap(pixmap)
-                    image_label.setStyleSheet("""
-                        border-radius: 15px;
-                        padding: 5px;
-                    """)
-                    
-                    self.chat_history.add_message(
-                        "",  
-                        timestamp,
-                        sender == self.username,
-                        profile_image,
-                        image_label
-                    )
-                    
+            self.chat_history.queue_message(self.chat_message_for(message))
         except Exception as e:
             print(f"Error displaying message: {e}")
 
-    def append_chat_message(self, sender, message_type, content, timestamp):
+    def append_chat_message(self, sender, message_type, content, timestamp, message_id=None):
         try:
             if not self.current_contact:
                 return
                 
-            if self.current_contact not in self.chat_histories:
-                self.chat_histories[self.current_contact] = []
-                
             message = {
+                'id': message_id,
                 'timestamp': timestamp,
                 'sender': sender,
                 'type': message_type,
                 'content': content
             }
             
-            self.chat_histories[self.current_contact].append(message)
-            
-            QTimer.singleShot(0, lambda: self.display_message(message))
+            self.remember_message(self.current_contact, message)
+            self.display_message(message)
+            return message
                 
         except Exception as e:
             print(f"Error in append_chat_message: {e}")
 
-    async def receive_messages(self):
-        while True:
+    def handle_incoming_message(self, event):
+        sender = event.sender
+        message_type = event.message_type
+        content = event.content
+        timestamp = datetime.now().strftime('%H:%M:%S')
+        
+        if sender == self.current_contact:
+            entry = self.append_chat_message(sender, message_type, content, timestamp, event.id)
+            # The server counted it as unread when saving it
+            self.read_peers.add(sender)
+            if not self.read_timer.isActive():
+                self.read_timer.start()
+        else:
+            # Conversations that were never opened stay on disk only
+            entry = {
+                'id': event.id,
+                'timestamp': timestamp,
+                'sender': sender,
+                'type': message_type,
+                'content': content
+            }
+            self.chat_histories.append(sender, entry)
+            
+            # Warm but hidden views are kept up to date in place
+            view = self.chat_views.view_for(sender)
+            if view:
+                view.queue_message(self.chat_message_for(entry, view))
+            self.unread_messages[sender] = self.unread_messages.get(sender, 0) + 1
+            
+            if not self.contacts_model.contact(sender):
+                self.add_contact_item({'username': sender, 'display_name': sender})
+        
+        if self.store and event.id:
+            self.save_messages([{
+                'id': event.id,
+                'sender': sender,
+                'receiver': self.username,
+                'message_type': message_type,
+                'content': content,
+                'timestamp': event.timestamp or timestamp
+            }], {event.id: entry} if entry else None)
+        
+        self.update_conversation_summary(
+            sender, sender, message_type, content, event.timestamp or timestamp
+        )
+        
+        if sender != self.current_contact:
             try:
-                message = json.loads(await self.websocket.recv())
-                print(f"Received message: {message}") 
-                
-                if message['type'] == 'message':
-                    sender = message['sender']
-                    message_type = message['message_type']
-                    content = message['content']
-                    timestamp = datetime.now().strftime('%H:%M:%S')
-                    
-                    if sender == self.current_contact:
-                        self.append_chat_message(sender, message_type, content, timestamp)
-                    
-                    if sender not in self.chat_histories:
-                        self.chat_histories[sender] = []
-                    
-                    self.chat_histories[sender].append({
-                        'timestamp': timestamp,
-                        'sender': sender,
-                        'type': message_type,
-                        'content': content
-                    })
-                    
-                    if sender != self.current_contact:
-                        items = self.contacts_list.findItems(sender, Qt.MatchFlag.MatchExactly)
-                        if items:
-                            items[0].setForeground(QColor(255, 0, 0))
-                            items[0].setText(f"{sender} (New Message!)")
-                        
-                        try:
-                            notification_text = f"Image from {sender}" if message_type == 'image' else f"{sender}: {content}"
-                            notification.notify(
-                                title='New Message',
-                                message=notification_text,
-                                app_icon=None,
-                                timeout=5
-                            )
-                        except:
-                            print("Failed to show notification")
-                
-                elif message['type'] == 'profile_update_result':
-                    if message['status'] == 'success':
-                        QMessageBox.information(self, 'Success', 'Profile updated successfully!')
-                    else:
-                        QMessageBox.warning(self, 'Error', 'Failed to update profile')
-                elif message['type'] == 'status_update':
-                    username = message['username']
-                    is_online = message['status'] == 'online'
-                    
-                    if username != self.username:
-                        for i in range(self.contacts_list.count()):
-                            item = self.contacts_list.item(i)
-                            widget = self.contacts_list.itemWidget(item)
-                            if widget and widget.get_username() == username:
-                                break
-                        else: 
-                            item = QListWidgetItem()
-                            widget = ContactListItem({
-                                'username': username,
-                                'display_name': username
-                            })
-                            item.setSizeHint(widget.sizeHint())
-                            self.contacts_list.addItem(item)
-                            self.contacts_list.setItemWidget(item, widget)
-                            print(f"Added new contact: {username}")
-                    
-                    self.status_updated.emit(username, is_online)
-                    
-            except Exception as e:
-                print(f"Error in receive_messages: {e}")
-                break
+                notification_text = f"Image from {sender}" if message_type == 'image' else f"{sender}: {content}"
+                notification.notify(
+                    title='New Message',
+                    message=notification_text,
+                    app_icon=None,
+                    timeout=5
+                )
+            except:
+                print("Failed to show notification")
+
+    def handle_message_ack(self, event):
+        sent = self.pending_messages.pop(event.client_id, None)
+        if sent:
+            sent['id'] = event.id
+            sent['timestamp'] = event.timestamp
+            if sent['entry']:
+                sent['entry']['id'] = event.id
+            if self.store:
+                self.save_messages([sent], {event.id: sent['entry']} if sent['entry'] else None)
+
+    def handle_contact_added(self, event):
+        if event.success:
+            self.add_contact_item(event.contact)
+            self.search_input.clear()
+        else:
+            QMessageBox.warning(self, 'Error', event.message or 'Failed to add contact')
+
+    def handle_contact_removed(self, event):
+        if event.success:
+            self.remove_contact_item(event.contact)
+
+    def handle_profile_update_result(self, event):
+        if event.success:
+            QMessageBox.information(self, 'Success', 'Profile updated successfully!')
+        else:
+            QMessageBox.warning(self, 'Error', 'Failed to update profile')
+
+    def handle_status_event(self, event):
+        username = event.username
+        if username != self.username and not self.contacts_model.contact(username):
+            known = self.profiles.get(username)
+            self.add_contact_item(known.to_dict() if known else {'username': username})
+            print(f"Added new contact: {username}")
+        
+        self.handle_status_update(username, event.online)
+        self.status_updated.emit(username, event.online)
+
+    def handle_reconnected(self, event):
+        # The session logged in again with our sync cursor; catch up on
+        # whatever arrived while the connection was down
+        print(f"Reconnected after {event.attempts} attempt(s)")
+        if event.login and event.login.success and self.store:
+            self.apply_login(event.login)
+        self.send_read_receipts()
 
     def send_message(self):
         if not self.current_contact:
@@ -1897,20 +2852,18 @@ class ChatClient(QMainWindow):
             try:
                 formatted_content = content.replace('\n', '<br>')
                 
-                message_data = {
-                    'type': 'message',
-                    'message_type': 'text',
-                    'sender': self.username,
-                    'receiver': self.current_contact,
-                    'content': formatted_content
-                }
-                
-                print(f"Sending message: {message_data}")
-                await self.websocket.send(json.dumps(message_data))
+                client_id = self.track_sent_message(self.current_contact, 'text', formatted_content)
+                print(f"Sending message {client_id} to {self.current_contact}")
+                await self.session.send_message(self.current_contact, formatted_content, 'text', client_id)
                 
                 self.message_input.clear()
                 timestamp = datetime.now().strftime('%H:%M')
-                self.append_chat_message(self.username, 'text', formatted_content, timestamp)
+                self.pending_messages[client_id]['entry'] = self.append_chat_message(
+                    self.username, 'text', formatted_content, timestamp
+                )
+                self.update_conversation_summary(
+                    self.current_contact, self.username, 'text', formatted_content, str(datetime.now())
+                )
                 
             except Exception as e:
                 print(f"Error sending message: {e}")
@@ -1937,201 +2890,146 @@ class ChatClient(QMainWindow):
                 
                 async def send():
                     try:
-                        await self.websocket.send(json.dumps({
-                            'type': 'message',
-                            'message_type': 'image',
-                            'sender': self.username,
-                            'receiver': self.current_contact,
-                            'content': image_data
-                        }))
+                        client_id = self.track_sent_message(self.current_contact, 'image', image_data)
+                        await self.session.send_message(self.current_contact, image_data, 'image', client_id)
                         
                         timestamp = datetime.now().strftime('%H:%M:%S')
-                        self.append_chat_message(self.username, 'image', image_data, timestamp)
+                        self.pending_messages[client_id]['entry'] = self.append_chat_message(
+                            self.username, 'image', image_data, timestamp
+                        )
+                        self.update_conversation_summary(
+                            self.current_contact, self.username, 'image', image_data, str(datetime.now())
+                        )
                         
                     except Exception as e:
                         QMessageBox.warning(self, 'Error', f'Failed to send image: {str(e)}')
                 
                 asyncio.get_event_loop().create_task(send())
 
-    def handle_message_received(self, sender, message_type, content):
-        contact_name = sender if sender != self.username else self.current_contact
-        
-        if contact_name not in self.chat_histories:
-            self.chat_histories[contact_name] = []
-            
-        timestamp = datetime.now().strftime('%H:%M:%S')
-        self.chat_histories[contact_name].append({
-            'timestamp': timestamp,
-            'sender': sender,
-            'type': message_type,
-            'content': content
-        })
-        
-        if sender != self.username and contact_name != self.current_contact:
-            if contact_name not in self.unread_messages:
-                self.unread_messages[contact_name] = 0
-            self.unread_messages[contact_name] += 1
-            
-            items = self.contacts_list.findItems(contact_name, Qt.MatchFlag.MatchExactly)
-            if items:
-                items[0].setForeground(QColor(255, 0, 0))
-                items[0].setText(f"{contact_name} (New Message!)")
-            
-            try:
-                notification_text = f"Image from {sender}" if message_type == 'image' else f"{sender}: {content}"
-                notification.notify(
-                    title='New Message',
-                    message=notification_text,
-                    app_icon=None, 
-                    timeout=5 
-                )
-            except:
-                print("Failed to show notification")
-        
-        if contact_name == self.current_contact:
-            self.append_message(sender, message_type, content)
-        
+    def track_sent_message(self, receiver, message_type, content):
+        # Held until the server acks with the message id, then written to the store
+        self.next_client_id += 1
+        self.pending_messages[self.next_client_id] = {
+            'sender': self.username,
+            'receiver': receiver,
+            'message_type': message_type,
+            'content': content,
+            'entry': None  # the chat_histories entry, given the id on ack
+        }
+        return self.next_client_id
+
     def handle_status_update(self, username, is_online):
-        items = self.contacts_list.findItems(username, Qt.MatchFlag.MatchExactly)
-        if not items:
-            item = QListWidgetItem(username)
-            self.contacts_list.addItem(item)
-        else:
-            item = items[0]
-        
-        item.setForeground(
-            QColor(0, 128, 0) if is_online else QColor(128, 128, 128)
-        )
+        if self.profiles.set_online(username, is_online):
+            self.contacts_model.profile_changed(username)
 
 
     
-    def contact_selected(self, item):
+    def contact_selected(self, index):
         try:
-            contact_widget = self.contacts_list.itemWidget(item)
-            if not contact_widget:
-                print("No contact widget found")
+            profile = index.data(ContactListModel.ProfileRole)
+            if not profile:
+                print("No contact found")
                 return
             
-            username = contact_widget.get_username()
-            display_name = contact_widget.get_display_name()
+            username = profile.username
+            display_name = profile.display_name
             
             print(f"Selected contact: {username} ({display_name})")
             
             self.current_contact = username
-            self.chat_history.clear()
+            self.chat_history, created = self.chat_views.show_conversation(username)
+            self.mark_conversation_read(username)
             
-            self.chat_title.setText(display_name)
-            self.chat_title.setStyleSheet("font-size: 16px; font-weight: bold; color: white;")
+            self.set_chat_title(display_name)
             
-            QTimer.singleShot(0, lambda: self.display_chat_history(username))
+            # A warm view is already up to date; only new views are filled
+            if created:
+                QTimer.singleShot(0, lambda: self.display_chat_history(username))
                     
         except Exception as e:
             print(f"Error in contact_selected: {e}")
 
     def display_chat_history(self, username):
         try:
-            if username in self.chat_histories:
-                for message in self.chat_histories[username]:
-                    timestamp = message.get('timestamp', datetime.now().strftime('%H:%M'))
-                    sender = message.get('sender', 'Unknown')
-                    msg_type = message.get('type', 'text')
-                    content = message.get('content', '')
-                    
-                    profile_image = None
-                    for contact in self._contacts_data:
-                        if contact['username'] == sender:
-                            profile_image = contact.get('profile_image')
-                            break
-                    
-                    if msg_type == 'text':
-                        self.chat_history.add_message(
-                            content,
-                            timestamp,
-                            sender == self.username,
-                            profile_image
-                        )
-                    elif msg_type == 'image':
-                        try:
-                            image_data = base64.b64decode(content)
-                            image = QImage.fromData(image_data)
-                            if not image.isNull():
-                                pixmap = QPixmap.fromImage(image)
-                                if pixmap.width() > 300:
-                                    pixmap = pixmap.scaledToWidth(300)
-                                
-                                image_label = QLabel()
-                                image_label.setPixmap(pixmap)
-                                image_label.setStyleSheet("""
-                                    border-radius: 15px;
-                                    padding: 5px;
-                                """)
-                                
-                                self.chat_history.add_message(
-                                    "",
-                                    timestamp,
-                                    sender == self.username,
-                                    profile_image,
-                                    image_label
-                                )
-                        except Exception as e:
-                            print(f"Error displaying image: {e}")
-                            
+            view = self.chat_views.view_for(username)
+            if view:
+                view.add_messages([
+                    self.chat_message_for(message, view) for message in self.history_for(username)
+                ])
         except Exception as e:
             print(f"Error loading chat history: {e}")
         
     def closeEvent(self, event):
-        if self.websocket:
-            asyncio.get_event_loop().create_task(
-                self.websocket.send(json.dumps({
-                    'type': 'save_unread',
-                    'username': self.username,
-                    'unread_messages': self.unread_messages
-                }))
-            )
+        self.read_timer.stop()
+        # Closing the last window stops the event loop, so the window stays
+        # up until read receipts and unread counts have reached the socket
+        if self.session.is_open and not self.closing:
+            self.closing = True
+            event.ignore()
+            asyncio.get_event_loop().create_task(self.flush_and_close())
+            return
         event.accept()
 
+    async def flush_and_close(self):
+        try:
+            await self.mark_peers_read()
+            await self.session.save_unread(self.unread_messages)
+            if not await self.session.flush(timeout=2.0):
+                print("Timed out sending read state before closing")
+        except Exception as e:
+            print(f"Error sending read state before closing: {e}")
+        self.close()
+
     def handle_profile_update(self, username: str, profile: dict):
-        self.profiles[username] = profile
-        
-        items = self.contacts_list.findItems(username, Qt.MatchFlag.MatchExactly)
-        if items:
-            item = items[0]
-            display_name = profile.get('display_name', username)
-            status = profile.get('status_message', '')
-            item.setText(f"{display_name}\n{status}" if status else display_name)
-            
-            if profile.get('profile_picture'):
-                pixmap = QPixmap()
-                pixmap.loadFromData(base64.b64decode(profile['profile_picture']))
-                pixmap = pixmap.scaled(32, 32, Qt.AspectRatioMode.KeepAspectRatio)
-                item.setIcon(QIcon(pixmap))
+        updated = self.profiles.update(username, profile)
+        if self.store and (username == self.username or self.contacts_model.contact(username)):
+            self.store.save_contact(updated.to_dict())
+        self.contacts_model.profile_changed(username)
+        if username == self.current_contact:
+            self.set_chat_title(updated.display_name)
+
+
+def run_polling_loop(app, loop):
+    # Fallback without qasync: step asyncio from a Qt timer. Network events
+    # wait up to one tick (50 ms) and the process wakes even when idle.
+    timer = QTimer()
+    timer.setInterval(50)
+    
+    def process_async_tasks():
+        loop.stop()
+        loop.run_forever()
+    
+    timer.timeout.connect(process_async_tasks)
+    timer.start()
+    
+    app.exec()
+    loop.close()
 
 
 if __name__ == '__main__':
     try:
         app = QApplication(sys.argv)
         
-        loop = asyncio.new_event_loop()
+        # qasync runs asyncio on top of Qt's event dispatcher, so socket
+        # readiness wakes the app immediately
+        if qasync is not None:
+            loop = qasync.QEventLoop(app)
+        else:
+            print("qasync not installed, falling back to 50ms polling")
+            loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
         client = ChatClient()
         client.show()
         
-        timer = QTimer()
-        timer.setInterval(50)
-        
-        def process_async_tasks():
-            loop.stop()
-            loop.run_forever()
-        
-        timer.timeout.connect(process_async_tasks)
-        timer.start()
-        
-        app.exec()
+        if qasync is not None:
+            with loop:
+                loop.run_forever()
+        else:
+            run_polling_loop(app, loop)
         
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
     finally:
-        loop.close()
         sys.exit()
\ No newline at end of file
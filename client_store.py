@@ -0,0 +1,399 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+
+def default_data_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(base, 'KukuriProtocol')
+
+def user_data_dir(username, data_dir=None):
+    # Usernames are arbitrary text, so escape everything that could act as a path
+    safe_name = quote(username, safe='').replace('.', '%2E')
+    return os.path.join(data_dir or default_data_dir(), safe_name)
+
+def store_exists(username, data_dir=None):
+    return os.path.exists(os.path.join(user_data_dir(username, data_dir), 'store.db'))
+
+def write_attachment(attachments_dir, content):
+    # Decodes an image payload into attachments/<sha256> unless it is there
+    # already. No database access, so it runs on a worker thread; returns
+    # (sha256, size), or None for a payload that isn't base64.
+    try:
+        data = base64.b64decode(content)
+    except (binascii.Error, TypeError, ValueError) as e:
+        print(f"Invalid image payload: {e}")
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(attachments_dir, digest)
+    if not os.path.exists(path):
+        # Two workers may write the same image; neither leaves a partial file
+        partial = f"{path}.{threading.get_ident()}.part"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+    return digest, len(data)
+
+def last_message_id_for(username, data_dir=None):
+    # Peek at the sync cursor without creating a store for a mistyped login
+    if not store_exists(username, data_dir):
+        return 0
+    store = ClientStore(username, data_dir)
+    try:
+        return store.last_message_id()
+    finally:
+        store.close()
+
+# Per-user on-disk copy of what the server has sent this client: contacts,
+# conversation summaries and messages (keyed by the server's message id, so
+# applying the same delta twice is harmless). Image payloads are written once
+# to attachments/<sha256> and messages only keep the reference.
+#
+# The sync cursor only moves on complete deltas (the login reply holds every
+# message of this user up to its newest id). Message ids are global, so a
+# live message says nothing about ids below it; one missed live, e.g. while
+# a second session held the connection, is then fetched by the next delta.
+class ClientStore:
+    def __init__(self, username, data_dir=None):
+        self.username = username
+        self.path = user_data_dir(username, data_dir)
+        self.attachments_dir = os.path.join(self.path, 'attachments')
+        os.makedirs(self.attachments_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(self.path, 'store.db'))
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contacts (
+            username TEXT PRIMARY KEY,
+            profile TEXT NOT NULL
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            peer TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            message_type TEXT NOT NULL,
+            content TEXT,
+            attachment TEXT,
+            timestamp TEXT NOT NULL
+        )
+        ''')
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_peer ON messages (peer, id)"
+        )
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            peer TEXT PRIMARY KEY,
+            last_sender TEXT,
+            last_message_type TEXT,
+            last_preview TEXT,
+            last_timestamp TEXT,
+            unread_count INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attachments (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL
+        )
+        ''')
+
+        # Single key/value table for sync cursors
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def last_message_id(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'last_message_id'")
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+    def save_contacts(self, contacts):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM contacts")
+        cursor.executemany(
+            "INSERT OR REPLACE INTO contacts (username, profile) VALUES (?, ?)",
+            [(contact['username'], json.dumps(contact)) for contact in contacts]
+        )
+        self.conn.commit()
+
+    def save_contact(self, contact):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO contacts (username, profile) VALUES (?, ?)",
+            (contact['username'], json.dumps(contact))
+        )
+        self.conn.commit()
+
+    def remove_contact(self, username):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM contacts WHERE username = ?", (username,))
+        self.conn.commit()
+
+    def get_contacts(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT profile FROM contacts")
+        return [json.loads(row[0]) for row in cursor.fetchall()]
+
+    def save_conversations(self, conversations):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM conversations")
+        cursor.executemany(
+            """INSERT OR REPLACE INTO conversations
+               (peer, last_sender, last_message_type, last_preview, last_timestamp, unread_count)
+               VALUES (:peer, :last_sender, :last_message_type, :last_preview, :last_timestamp, :unread_count)""",
+            conversations
+        )
+        self.conn.commit()
+
+    def save_conversation(self, summary):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """INSERT OR REPLACE INTO conversations
+               (peer, last_sender, last_message_type, last_preview, last_timestamp, unread_count)
+               VALUES (:peer, :last_sender, :last_message_type, :last_preview, :last_timestamp, :unread_count)""",
+            summary
+        )
+        self.conn.commit()
+
+    def get_conversations(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT peer, last_sender, last_message_type, last_preview,
+                   last_timestamp, unread_count
+            FROM conversations
+            ORDER BY last_timestamp DESC
+        """)
+        return [{
+            'peer': row[0],
+            'last_sender': row[1],
+            'last_message_type': row[2],
+            'last_preview': row[3],
+            'last_timestamp': row[4],
+            'unread_count': row[5]
+        } for row in cursor.fetchall()]
+
+    def store_attachment(self, cursor, content):
+        # None for a payload that isn't base64; callers keep it inline
+        written = write_attachment(self.attachments_dir, content)
+        if written is None:
+            return None
+        self.record_attachment(cursor, *written)
+        return written[0]
+
+    def record_attachment(self, cursor, digest, size):
+        cursor.execute(
+            "INSERT OR IGNORE INTO attachments (sha256, size) VALUES (?, ?)",
+            (digest, size)
+        )
+
+    def attachment_path(self, digest):
+        return os.path.join(self.attachments_dir, digest)
+
+    def load_attachment(self, digest):
+        try:
+            with open(os.path.join(self.attachments_dir, digest), 'rb') as f:
+                return base64.b64encode(f.read()).decode('utf-8')
+        except OSError as e:
+            print(f"Missing attachment {digest}: {e}")
+            return ''
+
+    def stored_ids(self, ids):
+        # The subset of `ids` already in the store
+        if not ids:
+            return set()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id FROM messages WHERE id BETWEEN ? AND ?", (min(ids), max(ids)))
+        return {row[0] for row in cursor.fetchall()} & set(ids)
+
+    def add_messages(self, messages, complete=False, attachments=None):
+        # messages use the server's chat_history shape: id, sender, receiver,
+        # message_type, content, timestamp. `complete` marks a server delta,
+        # which moves the sync cursor to its newest id. `attachments` holds
+        # image payloads already written with write_attachment, as
+        # {message id: (sha256, size) or None}; other images are written
+        # here. Returns the ids that were not stored yet.
+        if not messages:
+            return set()
+        cursor = self.conn.cursor()
+        ids = [message['id'] for message in messages]
+        stored = self.stored_ids(ids)
+        attachments = attachments or {}
+        
+        rows = []
+        for message in messages:
+            if message['id'] in stored:
+                continue
+            peer = message['receiver'] if message['sender'] == self.username else message['sender']
+            content, attachment = message['content'], None
+            if message['message_type'] == 'image':
+                if message['id'] in attachments:
+                    written = attachments[message['id']]
+                    if written:
+                        self.record_attachment(cursor, *written)
+                        attachment = written[0]
+                else:
+                    attachment = self.store_attachment(cursor, message['content'])
+                if attachment:
+                    content = None
+            rows.append((
+                message['id'], peer, message['sender'], message['message_type'],
+                content, attachment, str(message['timestamp'])
+            ))
+        cursor.executemany(
+            """INSERT OR IGNORE INTO messages
+               (id, peer, sender, message_type, content, attachment, timestamp)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        if complete:
+            cursor.execute(
+                """INSERT INTO sync_state (key, value) VALUES ('last_message_id', ?)
+                   ON CONFLICT (key) DO UPDATE SET
+                       value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))""",
+                (max(ids),)
+            )
+        self.conn.commit()
+        return {row[0] for row in rows}
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def get_messages(self, peer, limit=None, before_id=None):
+        # The newest `limit` messages older than before_id, oldest first.
+        # Images come back as attachment references, not payloads.
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """SELECT id, sender, message_type, content, attachment, timestamp
+               FROM messages
+               WHERE peer = ? AND id < ?
+               ORDER BY id DESC
+               LIMIT ?""",
+            (peer, before_id if before_id is not None else sys.maxsize, limit if limit else -1)
+        )
+        return [{
+            'id': row[0],
+            'sender': row[1],
+            'type': row[2],
+            'content': row[3],
+            'attachment': row[4],
+            'timestamp': row[5]
+        } for row in reversed(cursor.fetchall())]
+
+# Bounded in-memory window over a ClientStore: the most recent messages of the
+# conversations used last. Past the per-conversation cap the oldest messages
+# are dropped, past the total cap whole conversations are evicted LRU; both
+# can be read back from the store. The client swaps image payloads for
+# attachment references once they are written, so only those stay resident.
+class HistoryCache:
+    def __init__(self, store=None, per_conversation=500, total=5000):
+        self.store = store
+        self.per_conversation = per_conversation
+        self.total = total
+        self.conversations = OrderedDict()  # {peer: [message, ...]}, least recently used first
+        self.has_older = {}  # {peer: whether the store has messages before the resident ones}
+        self.count = 0
+
+    def __contains__(self, peer):
+        return peer in self.conversations
+
+    def get(self, peer):
+        messages = self.conversations.get(peer)
+        if messages is None:
+            messages = self.store.get_messages(peer, self.per_conversation) if self.store else []
+            self.conversations[peer] = messages
+            self.has_older[peer] = len(messages) == self.per_conversation
+            self.count += len(messages)
+        self.conversations.move_to_end(peer)
+        self.enforce_total(peer)
+        return messages
+
+    def append(self, peer, message):
+        messages = self.conversations.get(peer)
+        if messages is None:
+            return
+        messages.append(message)
+        self.count += 1
+        self.trim(peer)
+        self.enforce_total(peer)
+
+    def trim(self, peer):
+        # Back to the per-conversation cap, e.g. after scrolling back
+        messages = self.conversations.get(peer)
+        excess = len(messages) - self.per_conversation if messages else 0
+        if excess > 0:
+            del messages[:excess]
+            self.count -= excess
+            self.has_older[peer] = True
+
+    def load_older(self, peer, count):
+        messages = self.conversations.get(peer)
+        if messages is None or not self.store or not self.has_older.get(peer):
+            return []
+        first_id = next((message['id'] for message in messages if message.get('id')), None)
+        if first_id is None and messages:
+            return []
+        older = self.store.get_messages(peer, count, first_id)
+        self.has_older[peer] = len(older) == count
+        # Scrolled-back messages stay until the next append or trim()
+        messages[:0] = older
+        self.count += len(older)
+        self.enforce_total(peer)
+        return older
+
+    def enforce_total(self, keep):
+        while self.count > self.total and len(self.conversations) > 1:
+            peer = next(iter(self.conversations))
+            if peer == keep:
+                self.conversations.move_to_end(peer)
+                continue
+            self.evict(peer)
+
+    def evict(self, peer):
+        messages = self.conversations.pop(peer, None)
+        if messages is not None:
+            self.count -= len(messages)
+            self.has_older.pop(peer, None)
+
+    def stats(self):
+        text_bytes = sum(
+            len(message.get('content') or '')
+            for messages in self.conversations.values()
+            for message in messages
+        )
+        return {
+            'conversations': len(self.conversations),
+            'messages': self.count,
+            'text_bytes': text_bytes
+        }
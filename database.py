@@ -1,35 +1,206 @@
 import sqlite3
+import time
+from bisect import bisect_left, insort
 from datetime import datetime
 
-class ChatDatabase:
-    def __init__(self, db_name="chat.db"):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.create_tables()
-    
-    def get_user_chat_history(self, username):
+USER_COLUMNS = (
+    'username', 'password', 'display_name', 'status_message', 'profile_image',
+    'additional_image', 'current_theme', 'registration_date', 'last_seen'
+)
+
+class UserRecord:
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, *values):
+        for name, value in zip(USER_COLUMNS, values):
+            setattr(self, name, value)
+
+    def to_profile(self):
+        return {
+            'username': self.username,
+            'display_name': self.display_name,
+            'status_message': self.status_message,
+            'profile_image': self.profile_image,
+            'additional_image': self.additional_image,
+            'last_seen': self.last_seen
+        }
+
+# Prefix index over usernames and display names: a sorted list of
+# (key, username) pairs, so a lookup is one bisect plus a scan of the hits.
+class UserSearchIndex:
+    def __init__(self):
+        self.entries = []
+        self.keys = {}  # {username: set of indexed keys}
+
+    @staticmethod
+    def index_keys(record):
+        keys = {record.username.casefold()}
+        if record.display_name:
+            display_name = record.display_name.casefold()
+            keys.add(display_name)
+            keys.update(display_name.split())
+        return keys
+
+    def build(self, records):
+        self.keys = {record.username: self.index_keys(record) for record in records}
+        self.entries = sorted(
+            (key, username) for username, keys in self.keys.items() for key in keys
+        )
+
+    def add(self, record):
+        new_keys = self.index_keys(record)
+        old_keys = self.keys.get(record.username, set())
+        for key in old_keys - new_keys:
+            self._discard((key, record.username))
+        for key in new_keys - old_keys:
+            insort(self.entries, (key, record.username))
+        self.keys[record.username] = new_keys
+
+    def remove(self, username):
+        for key in self.keys.pop(username, ()):
+            self._discard((key, username))
+
+    def _discard(self, entry):
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def search(self, prefix, limit=20):
+        prefix = prefix.casefold().strip()
+        if not prefix:
+            return []
+        
+        results = []
+        i = bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(results) < limit:
+            key, username = self.entries[i]
+            if not key.startswith(prefix):
+                break
+            if username not in results:
+                results.append(username)
+            i += 1
+        return results
+
+# In-memory copy of the users table. Writes through ChatDatabase update it
+# directly; writes from other connections are picked up from user_changes
+# (filled by triggers) once PRAGMA data_version moves, re-reading only the
+# changed usernames. The check runs at most once per `sync_interval` seconds,
+# except on a lookup miss, so a user just registered elsewhere is found.
+class UserDirectory:
+    MAX_CHANGE_LOG = 10000
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, conn, sync_interval=1.0):
+        self.conn = conn
+        self.sync_interval = sync_interval
+        self.users = {}  # {username: UserRecord}
+        self.index = UserSearchIndex()
+        self.last_change = 0
+        self.data_version = None
+        self.next_sync = 0.0
+        self.next_prune = 0.0
+        self.prune()
+        self.load()
+
+    def load(self):
         cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT sender, receiver, message_type, content, timestamp
-            FROM chat_history
-            WHERE sender = ? OR receiver = ?
-            ORDER BY timestamp ASC
-        """, (username, username))
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes")
+        self.last_change = cursor.fetchone()[0]
+        cursor.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users")
+        self.users = {row[0]: UserRecord(*row) for row in cursor.fetchall()}
+        self.index.build(self.users.values())
+        self.data_version = self._data_version()
+
+    def _data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def prune(self):
+        # Every login and profile write adds a row; keep only the newest ones.
+        # Readers that fall behind the kept window reload everything.
+        self.next_prune = time.monotonic() + self.PRUNE_INTERVAL
+        self.conn.execute(
+            "DELETE FROM user_changes WHERE seq <= (SELECT MAX(seq) FROM user_changes) - ?",
+            (self.MAX_CHANGE_LOG,)
+        )
+        self.conn.commit()
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if now < self.next_sync and not force:
+            return
+        self.next_sync = now + self.sync_interval
+        if now >= self.next_prune:
+            self.prune()
         
-        history = []
-        for row in cursor.fetchall():
-            history.append({
-                'sender': row[0],
-                'receiver': row[1],
-                'message_type': row[2],
-                'content': row[3],
-                'timestamp': row[4]
-            })
-        return history
+        data_version = self._data_version()
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT MIN(seq) FROM user_changes")
+        oldest = cursor.fetchone()[0]
+        if oldest is not None and oldest > self.last_change + 1:
+            # Change log was pruned past our position
+            self.load()
+            return
+        
+        cursor.execute(
+            "SELECT seq, username FROM user_changes WHERE seq > ? ORDER BY seq",
+            (self.last_change,)
+        )
+        changed = set()
+        for seq, username in cursor.fetchall():
+            self.last_change = seq
+            changed.add(username)
+        for username in changed:
+            self.reload(username)
 
-    def get_all_users(self):
+    def reload(self, username):
         cursor = self.conn.cursor()
-        cursor.execute("SELECT username FROM users")
-        return cursor.fetchall()
+        cursor.execute(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE username = ?",
+            (username,)
+        )
+        row = cursor.fetchone()
+        if row:
+            self.put(UserRecord(*row))
+        else:
+            self.users.pop(username, None)
+            self.index.remove(username)
+
+    def put(self, record):
+        # Also called after a record is modified in place, to re-index it
+        self.users[record.username] = record
+        self.index.add(record)
+
+    def get(self, username):
+        self.sync()
+        record = self.users.get(username)
+        if record is None:
+            self.sync(force=True)
+            record = self.users.get(username)
+        return record
+
+    def all(self):
+        self.sync()
+        return list(self.users.values())
+
+    def search(self, prefix, limit=20):
+        self.sync()
+        return [self.users[username] for username in self.index.search(prefix, limit)]
+
+def message_preview(message_type, content, limit=100):
+    if message_type == 'image':
+        return '[Image]'
+    return (content or '').replace('<br>', ' ').replace('\n', ' ')[:limit]
+
+class ChatDatabase:
+    def __init__(self, db_name="chat.db"):
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.create_tables()
+        self.search_enabled = self.create_search_index()
+        self.users = UserDirectory(self.conn)
 
     def create_tables(self):
         cursor = self.conn.cursor()
@@ -48,6 +219,36 @@ class ChatDatabase:
         )
         ''')
         
+        cursor.execute("PRAGMA table_info(users)")
+        if 'current_theme' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE users ADD COLUMN current_theme TEXT")
+        
+        # Change log for UserDirectory, filled by triggers so every writer is covered
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL
+        )
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_insert_log AFTER INSERT ON users
+        BEGIN
+            INSERT INTO user_changes (username) VALUES (NEW.username);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_update_log AFTER UPDATE ON users
+        BEGIN
+            INSERT INTO user_changes (username) VALUES (NEW.username);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_delete_log AFTER DELETE ON users
+        BEGIN
+            INSERT INTO user_changes (username) VALUES (OLD.username);
+        END
+        ''')
+
         # chat_history
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -61,50 +262,303 @@ class ChatDatabase:
             FOREIGN KEY (receiver) REFERENCES users (username)
         )
         ''')
+        # Per-user delta sync (id > since_id) on either side of the conversation
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_history_sender ON chat_history (sender, id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_history_receiver ON chat_history (receiver, id)"
+        )
+        
+        # contacts (owner -> contact), used to scope presence/profile fan-out
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'contacts'"
+        )
+        contacts_exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contacts (
+            owner TEXT NOT NULL,
+            contact TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (owner, contact),
+            FOREIGN KEY (owner) REFERENCES users (username),
+            FOREIGN KEY (contact) REFERENCES users (username)
+        )
+        ''')
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_contacts_contact ON contacts (contact)"
+        )
+        
+        if not contacts_exists:
+            # Existing databases: everyone you have chatted with becomes a contact
+            cursor.execute('''
+            INSERT OR IGNORE INTO contacts (owner, contact, created_at)
+            SELECT sender, receiver, MIN(timestamp) FROM chat_history
+            WHERE sender != receiver GROUP BY sender, receiver
+            UNION ALL
+            SELECT receiver, sender, MIN(timestamp) FROM chat_history
+            WHERE sender != receiver GROUP BY receiver, sender
+            ''')
+        
+        # Materialized per-user chat list, maintained by save_message
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'conversations'"
+        )
+        conversations_exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            owner TEXT NOT NULL,
+            peer TEXT NOT NULL,
+            last_sender TEXT NOT NULL,
+            last_message_type TEXT NOT NULL,
+            last_preview TEXT NOT NULL,
+            last_timestamp DATETIME NOT NULL,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (owner, peer),
+            FOREIGN KEY (owner) REFERENCES users (username),
+            FOREIGN KEY (peer) REFERENCES users (username)
+        )
+        ''')
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversations_recent ON conversations (owner, last_timestamp DESC)"
+        )
+        
+        if not conversations_exists:
+            cursor.execute('''
+            INSERT INTO conversations
+                (owner, peer, last_sender, last_message_type, last_preview, last_timestamp)
+            SELECT owner, peer, sender, message_type,
+                   CASE WHEN message_type = 'image' THEN '[Image]'
+                        ELSE substr(replace(content, '<br>', ' '), 1, 100) END,
+                   timestamp
+            FROM (
+                SELECT owner, peer, sender, message_type, content, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY owner, peer ORDER BY id DESC) AS rn
+                FROM (
+                    SELECT sender AS owner, receiver AS peer, * FROM chat_history
+                    UNION ALL
+                    SELECT receiver, sender, * FROM chat_history WHERE sender != receiver
+                )
+            )
+            WHERE rn = 1
+            ''')
         
         self.conn.commit()
     
+    def create_search_index(self):
+        # FTS5 index over text messages only (external content, so the text
+        # itself is not duplicated). The participants column holds sender and
+        # receiver so search_messages() can restrict the MATCH to one user's
+        # conversations. New rows are indexed by trigger; rows that existed
+        # before the index was created are backfilled in batches by
+        # index_search_batch().
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'message_search'"
+            )
+            index_exists = cursor.fetchone() is not None
+            if index_exists:
+                cursor.execute("PRAGMA table_info(message_search)")
+                if 'participants' not in [row[1] for row in cursor.fetchall()]:
+                    # Index from before the participants column: rebuild it
+                    cursor.execute("DROP TRIGGER IF EXISTS chat_history_search_insert")
+                    cursor.execute("DROP TRIGGER IF EXISTS chat_history_search_delete")
+                    cursor.execute("DROP TABLE message_search")
+                    index_exists = False
+            
+            cursor.execute('''
+            CREATE VIEW IF NOT EXISTS message_search_source AS
+            SELECT id, content, sender || ' ' || receiver AS participants
+            FROM chat_history
+            ''')
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                content,
+                participants,
+                content = 'message_search_source',
+                content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable: {e}")
+            return False
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_index_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            backfill_cursor INTEGER NOT NULL,
+            backfill_until INTEGER NOT NULL
+        )
+        ''')
+        if not index_exists:
+            cursor.execute(
+                "INSERT OR REPLACE INTO search_index_state (id, backfill_cursor, backfill_until) "
+                "SELECT 1, 0, COALESCE(MAX(id), 0) FROM chat_history"
+            )
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_history_search_insert AFTER INSERT ON chat_history
+        WHEN NEW.message_type = 'text'
+        BEGIN
+            INSERT INTO message_search (rowid, content, participants)
+            VALUES (NEW.id, NEW.content, NEW.sender || ' ' || NEW.receiver);
+        END
+        ''')
+        # Only rows already in the index may be removed from it
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_history_search_delete AFTER DELETE ON chat_history
+        WHEN OLD.message_type = 'text' AND (
+            OLD.id <= (SELECT backfill_cursor FROM search_index_state WHERE id = 1) OR
+            OLD.id > (SELECT backfill_until FROM search_index_state WHERE id = 1)
+        )
+        BEGIN
+            INSERT INTO message_search (message_search, rowid, content, participants)
+            VALUES ('delete', OLD.id, OLD.content, OLD.sender || ' ' || OLD.receiver);
+        END
+        ''')
+        self.conn.commit()
+        return True
+
+    def index_search_batch(self, batch_size=2000):
+        # Returns True while there are still pre-existing rows to index
+        if not self.search_enabled:
+            return False
+        
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT backfill_cursor, backfill_until FROM search_index_state WHERE id = 1"
+        )
+        backfill_cursor, backfill_until = cursor.fetchone()
+        if backfill_cursor >= backfill_until:
+            return False
+        
+        cursor.execute(
+            """SELECT id, content, sender || ' ' || receiver FROM chat_history
+               WHERE id > ? AND id <= ? AND message_type = 'text'
+               ORDER BY id LIMIT ?""",
+            (backfill_cursor, backfill_until, batch_size)
+        )
+        rows = cursor.fetchall()
+        cursor.executemany(
+            "INSERT INTO message_search (rowid, content, participants) VALUES (?, ?, ?)", rows
+        )
+        
+        backfill_cursor = rows[-1][0] if len(rows) == batch_size else backfill_until
+        cursor.execute(
+            "UPDATE search_index_state SET backfill_cursor = ? WHERE id = 1",
+            (backfill_cursor,)
+        )
+        self.conn.commit()
+        return backfill_cursor < backfill_until
+
+    def search_messages(self, username, query, limit=20, offset=0):
+        terms = [term.replace('"', '""') for term in (query or '').split()]
+        if not self.search_enabled or not terms:
+            return []
+        # Quote every term so user input is never parsed as FTS syntax;
+        # the last one is a prefix match for search-as-you-type. The user
+        # filter is part of the MATCH, so only that user's messages are
+        # ranked; the tokenizer splits names on punctuation, so the exact
+        # sender/receiver check stays as well.
+        participant = username.replace('"', '""')
+        match = ('content : (' + ' '.join(f'"{term}"' for term in terms) + '*)'
+                 f' AND participants : "{participant}"')
+        
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT c.id, c.sender, c.receiver, c.timestamp,
+                   snippet(message_search, 0, '<b>', '</b>', '…', 12)
+            FROM message_search
+            JOIN chat_history c ON c.id = message_search.rowid
+            WHERE message_search MATCH ? AND (c.sender = ? OR c.receiver = ?)
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        """, (match, username, username, limit, offset))
+        return [{
+            'id': row[0],
+            'sender': row[1],
+            'receiver': row[2],
+            'timestamp': row[3],
+            'snippet': row[4]
+        } for row in cursor.fetchall()]
+
     def register_user(self, username, password, display_name=None, profile_image=None, additional_image=None):
+        # Stored as text so cached records match what SELECT returns
+        registration_date = datetime.now().isoformat(" ")
         try:
             cursor = self.conn.cursor()
             cursor.execute(
                 """INSERT INTO users 
                    (username, password, display_name, profile_image, additional_image, registration_date) 
                    VALUES (?, ?, ?, ?, ?, ?)""",
-                (username, password, display_name or username, profile_image, additional_image, datetime.now())
+                (username, password, display_name or username, profile_image, additional_image, registration_date)
             )
             self.conn.commit()
-            return True
         except sqlite3.IntegrityError:
             return False
+        
+        self.users.put(UserRecord(
+            username, password, display_name or username, None, profile_image,
+            additional_image, None, registration_date, None
+        ))
+        return True
     
     def verify_user(self, username, password):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT password FROM users WHERE username = ?",
-            (username,)
-        )
-        result = cursor.fetchone()
-        return result is not None and result[0] == password
+        record = self.users.get(username)
+        return record is not None and record.password == password
     
     def update_user_status(self, username, is_online):
         cursor = self.conn.cursor()
-        last_seen = datetime.now() if is_online else None
+        last_seen = datetime.now().isoformat(" ") if is_online else None
         cursor.execute(
             "UPDATE users SET last_seen = ? WHERE username = ?",
             (last_seen, username)
         )
         self.conn.commit()
+        
+        record = self.users.get(username)
+        if record:
+            record.last_seen = last_seen
     
     def save_message(self, sender, receiver, message_type, content):
         cursor = self.conn.cursor()
+        now = datetime.now()
         cursor.execute(
             """INSERT INTO chat_history 
                (sender, receiver, message_type, content, timestamp)
                VALUES (?, ?, ?, ?, ?)""",
-            (sender, receiver, message_type, content, datetime.now())
+            (sender, receiver, message_type, content, now)
+        )
+        message_id = cursor.lastrowid
+        # Talking to someone makes both sides contacts of each other
+        if sender != receiver:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO contacts (owner, contact, created_at) VALUES (?, ?, ?)",
+                [(sender, receiver, now), (receiver, sender, now)]
+            )
+        
+        preview = message_preview(message_type, content)
+        summaries = [(sender, receiver, sender, message_type, preview, now, 0)]
+        if sender != receiver:
+            summaries.append((receiver, sender, sender, message_type, preview, now, 1))
+        cursor.executemany(
+            """INSERT INTO conversations
+               (owner, peer, last_sender, last_message_type, last_preview, last_timestamp, unread_count)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (owner, peer) DO UPDATE SET
+                   last_sender = excluded.last_sender,
+                   last_message_type = excluded.last_message_type,
+                   last_preview = excluded.last_preview,
+                   last_timestamp = excluded.last_timestamp,
+                   unread_count = unread_count + excluded.unread_count""",
+            summaries
         )
         self.conn.commit()
+        return message_id, str(now)
     
     def get_chat_history(self, user1, user2):
         cursor = self.conn.cursor()
@@ -118,30 +572,29 @@ class ChatDatabase:
         )
         return cursor.fetchall()
     
-    def get_user_chat_history(self, username):
+    def get_user_chat_history(self, username, since_id=0):
         cursor = self.conn.cursor()
         cursor.execute(
-            """SELECT sender, receiver, message_type, content, timestamp
+            """SELECT id, sender, receiver, message_type, content, timestamp
                FROM chat_history
-               WHERE sender = ? OR receiver = ?
-               ORDER BY timestamp ASC""",
-            (username, username)
+               WHERE (sender = ? OR receiver = ?) AND id > ?
+               ORDER BY id ASC""",
+            (username, username, since_id)
         )
         history = []
         for row in cursor.fetchall():
             history.append({
-                'sender': row[0],
-                'receiver': row[1],
-                'message_type': row[2],
-                'content': row[3],
-                'timestamp': row[4]
+                'id': row[0],
+                'sender': row[1],
+                'receiver': row[2],
+                'message_type': row[3],
+                'content': row[4],
+                'timestamp': row[5]
             })
         return history
 
     def get_all_users(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT username FROM users")
-        return [row[0] for row in cursor.fetchall()]  # username
+        return [record.username for record in self.users.all()]
 
     def update_profile(self, username: str, display_name: str = None, 
                       status_message: str = None, profile_picture: str = None,
@@ -160,7 +613,7 @@ class ChatDatabase:
                 values.append(status_message)
             
             if profile_picture is not None:
-                updates.append("profile_picture = ?")
+                updates.append("profile_image = ?")
                 values.append(profile_picture)
             
             if current_theme is not None:
@@ -175,68 +628,128 @@ class ChatDatabase:
             
             cursor.execute(query, values)
             self.conn.commit()
-            return True
             
         except Exception as e:
             print(f"Error updating profile: {e}")
             return False
+        
+        record = self.users.get(username)
+        if record:
+            if display_name is not None:
+                record.display_name = display_name
+            if status_message is not None:
+                record.status_message = status_message
+            if profile_picture is not None:
+                record.profile_image = profile_picture
+            if current_theme is not None:
+                record.current_theme = current_theme
+            self.users.put(record)
+        return True
     
     def get_profile(self, username: str) -> dict:
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT username, display_name, status_message, 
-                       profile_picture, current_theme, last_seen
-                FROM users WHERE username = ?
-            """, (username,))
-            
-            result = cursor.fetchone()
-            if result:
-                return {
-                    'username': result[0],
-                    'display_name': result[1] or result[0],
-                    'status_message': result[2] or "",
-                    'profile_picture': result[3],
-                    'current_theme': result[4],
-                    'last_seen': result[5]
-                }
-            return None
-            
-        except Exception as e:
-            print(f"Error getting profile: {e}")
+        record = self.users.get(username)
+        if record is None:
             return None
+        return {
+            'username': record.username,
+            'display_name': record.display_name or record.username,
+            'status_message': record.status_message or "",
+            'profile_picture': record.profile_image,
+            'current_theme': record.current_theme,
+            'last_seen': record.last_seen
+        }
         
     def get_user_profile(self, username):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT username, display_name, status_message, 
-                   profile_image, additional_image, last_seen
-            FROM users WHERE username = ?
-        """, (username,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'username': row[0],
-                'display_name': row[1],
-                'status_message': row[2],
-                'profile_image': row[3],
-                'additional_image': row[4],
-                'last_seen': row[5]
-            }
-        return None
+        record = self.users.get(username)
+        return record.to_profile() if record else None
+
+    def search_users(self, prefix, limit=20):
+        return [record.to_profile() for record in self.users.search(prefix, limit)]
 
     def get_all_users_with_profiles(self):
+        return [record.to_profile() for record in self.users.all()]
+
+    def add_contact(self, owner, contact):
+        if not owner or not contact or owner == contact:
+            return False
+        if self.users.get(contact) is None:
+            return False
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO contacts (owner, contact, created_at) VALUES (?, ?, ?)",
+            (owner, contact, datetime.now())
+        )
+        self.conn.commit()
+        return True
+
+    def remove_contact(self, owner, contact):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "DELETE FROM contacts WHERE owner = ? AND contact = ?",
+            (owner, contact)
+        )
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def get_contacts(self, username):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT contact FROM contacts WHERE owner = ?", (username,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_contact_watchers(self, username):
+        # Reverse lookup: everyone who has `username` in their contact list
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT owner FROM contacts WHERE contact = ?", (username,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_contacts_with_profiles(self, username):
+        profiles = []
+        for contact in self.get_contacts(username):
+            record = self.users.get(contact)
+            if record:
+                profiles.append(record.to_profile())
+        return profiles
+
+    def get_conversations(self, username):
         cursor = self.conn.cursor()
         cursor.execute("""
-            SELECT username, display_name, status_message, 
-                   profile_image, additional_image, last_seen
-            FROM users
-        """)
+            SELECT peer, last_sender, last_message_type, last_preview,
+                   last_timestamp, unread_count
+            FROM conversations
+            WHERE owner = ?
+            ORDER BY last_timestamp DESC
+        """, (username,))
         return [{
-            'username': row[0],
-            'display_name': row[1],
-            'status_message': row[2],
-            'profile_image': row[3],
-            'additional_image': row[4],
-            'last_seen': row[5]
-        } for row in cursor.fetchall()]
\ No newline at end of file
+            'peer': row[0],
+            'last_sender': row[1],
+            'last_message_type': row[2],
+            'last_preview': row[3],
+            'last_timestamp': row[4],
+            'unread_count': row[5]
+        } for row in cursor.fetchall()]
+
+    def mark_conversation_read(self, owner, peer):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "UPDATE conversations SET unread_count = 0 WHERE owner = ? AND peer = ? AND unread_count != 0",
+            (owner, peer)
+        )
+        self.conn.commit()
+
+    def set_unread_counts(self, owner, unread_counts):
+        rows = []
+        for peer, count in unread_counts.items():
+            # Counts come from the client; skip anything that isn't a sane count
+            try:
+                count = int(count)
+            except (TypeError, ValueError, OverflowError):
+                continue
+            if 0 <= count < 2 ** 31:
+                rows.append((count, owner, peer))
+        
+        cursor = self.conn.cursor()
+        cursor.executemany(
+            "UPDATE conversations SET unread_count = ? WHERE owner = ? AND peer = ?",
+            rows
+        )
+        self.conn.commit()
\ No newline at end of file
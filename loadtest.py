@@ -0,0 +1,72 @@
+import asyncio
+import base64
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+import zlib
+
+import websockets
+
+# Helpers shared by the tools that drive a ChatServer under load
+# (benchmarks/bench_load.py, benchmarks/bench_event_loop.py and traffic.py):
+# throwaway server processes, synthetic images and latency percentiles.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_png(width, height, seed):
+    # Noisy RGB image so it doesn't compress to nothing; built with zlib
+    # to keep the tools free of imaging dependencies
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    png = (b'\x89PNG\r\n\x1a\n'
+           + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+           + chunk(b'IDAT', zlib.compress(rows, 1))
+           + chunk(b'IEND', b''))
+    return base64.b64encode(png).decode('utf-8')
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': round(percentile(ordered, 50), 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 95), 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 99), 3) if ordered else None,
+        'max_ms': round(ordered[-1], 3) if ordered else None,
+    }
+
+
+def start_server(port, workdir):
+    # A ChatServer in its own process, with chat.db in `workdir`
+    code = ("import sys; sys.path.insert(0, {!r}); from server import ChatServer; "
+            "ChatServer(port={}).run()").format(ROOT, port)
+    return subprocess.Popen(
+        [sys.executable, '-c', code], cwd=workdir,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_for_server(url, timeout=15.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            async with websockets.connect(url):
+                return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
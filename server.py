@@ -5,30 +5,26 @@ from database import ChatDatabase
 import base64
 from PIL import Image
 import io
+import argparse
+import os
+from traffic import TrafficRecorder
 
 class ChatServer:
-    def __init__(self, host="localhost", port=8765):
+    def __init__(self, host="localhost", port=8765, record_path=None):
         self.host = host
         self.port = port
         self.db = ChatDatabase()
         self.active_connections = {}  # {username: websocket}
+        self.connection_users = {}  # {websocket: username}
+        # Optional capture of inbound traffic for replay (see traffic.py)
+        self.recorder = TrafficRecorder(record_path) if record_path else None
+    
+    async def reply(self, websocket, request, response):
+        # Echo the caller's request_id so clients can match replies to requests
+        if request.get('request_id') is not None:
+            response['request_id'] = request['request_id']
+        await websocket.send(json.dumps(response))
     
-    def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS unread_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            sender TEXT NOT NULL,
-            count INTEGER DEFAULT 0,
-            FOREIGN KEY (username) REFERENCES users (username),
-            FOREIGN KEY (sender) REFERENCES users (username)
-        )
-        ''')
-        
-        self.conn.commit()
-
     async def register_handler(self, websocket, data):
         username = data.get('username')
         password = data.get('password')
@@ -37,7 +33,7 @@ class ChatServer:
             response = {'type': 'register', 'status': 'success'}
         else:
             response = {'type': 'register', 'status': 'error', 'message': 'Username already exists'}
-        await websocket.send(json.dumps(response))
+        await self.reply(websocket, data, response)
     
     async def login_handler(self, websocket, data):
         username = data.get('username')
@@ -45,49 +41,37 @@ class ChatServer:
         
         if self.db.verify_user(username, password):
             self.active_connections[username] = websocket
+            self.connection_users[websocket] = username
             self.db.update_user_status(username, True)
             
             contacts = []
-            for user in self.db.get_all_users_with_profiles():
-                if user['profile_image']:
-                    user['profile_image'] = self.resize_image_base64(
-                        user['profile_image'], 
-                        max_size=(100, 100)
-                    )
-                if user['additional_image']:
-                    user['additional_image'] = self.resize_image_base64(
-                        user['additional_image'],
-                        max_size=(200, 100)
-                    )
-                contacts.append(user)
+            own_profile = self.db.get_user_profile(username)
+            if own_profile:
+                contacts.append(self.prepare_contact(own_profile))
+            for user in self.db.get_contacts_with_profiles(username):
+                contacts.append(self.prepare_contact(user))
             
-            chat_history = self.db.get_user_chat_history(username)
+            # Clients with a local store only need messages newer than their cursor
+            since_id = data.get('since_id') or 0
+            chat_history = self.db.get_user_chat_history(username, since_id)
             
             response = {
                 'type': 'login',
                 'status': 'success',
                 'contacts': contacts,
+                'conversations': self.db.get_conversations(username),
                 'chat_history': chat_history
             }
             
-            await websocket.send(json.dumps(response))
+            await self.reply(websocket, data, response)
             
-            for other_username, other_ws in self.active_connections.items():
-                if other_username != username:
-                    try:
-                        await other_ws.send(json.dumps({
-                            'type': 'status_update',
-                            'username': username,
-                            'status': 'online'
-                        }))
-                    except Exception as e:
-                        print(f"Error sending status update: {e}")
+            await self.broadcast_status(username, True)
         else:
-            await websocket.send(json.dumps({
+            await self.reply(websocket, data, {
                 'type': 'login',
                 'status': 'error',
                 'message': 'Invalid username or password'
-            }))
+            })
     
     async def message_handler(self, websocket, data):
         sender = data.get('sender')
@@ -95,29 +79,97 @@ class ChatServer:
         message_type = data.get('message_type')
         content = data.get('content')
         
-        self.db.save_message(sender, receiver, message_type, content)
+        message_id, timestamp = self.db.save_message(sender, receiver, message_type, content)
         
         if receiver in self.active_connections:
             await self.active_connections[receiver].send(json.dumps({
                 'type': 'message',
+                'id': message_id,
                 'sender': sender,
                 'message_type': message_type,
-                'content': content
+                'content': content,
+                'timestamp': timestamp
             }))
+        
+        # Tell the sender the server id so it can file the message in its store
+        await self.reply(websocket, data, {
+            'type': 'message_ack',
+            'client_id': data.get('client_id'),
+            'id': message_id,
+            'receiver': receiver,
+            'timestamp': timestamp
+        })
     
     async def broadcast_status(self, username, is_online):
-        status_message = json.dumps({
+        await self.notify_watchers(username, {
             'type': 'status_update',
             'username': username,
             'status': 'online' if is_online else 'offline'
         })
+    
+    async def notify_watchers(self, username, payload, include_self=False):
+        # Fan-out only to online users who have `username` in their contacts
+        message = json.dumps(payload)
+        recipients = self.db.get_contact_watchers(username)
+        if include_self:
+            recipients.append(username)
+        
+        for user in recipients:
+            conn = self.active_connections.get(user)
+            if conn is None:
+                continue
+            try:
+                await conn.send(message)
+            except Exception as e:
+                print(f"Error notifying {user}: {e}")
+    
+    def prepare_contact(self, user):
+        if user['profile_image']:
+            user['profile_image'] = self.resize_image_base64(
+                user['profile_image'], 
+                max_size=(100, 100)
+            )
+        if user['additional_image']:
+            user['additional_image'] = self.resize_image_base64(
+                user['additional_image'],
+                max_size=(200, 100)
+            )
+        user['online'] = user['username'] in self.active_connections
+        return user
+    
+    async def add_contact_handler(self, websocket, data):
+        username = self.connection_users.get(websocket)
+        contact = data.get('contact')
+        if not username:
+            return
+        
+        if self.db.add_contact(username, contact):
+            profile = self.db.get_user_profile(contact)
+            response = {
+                'type': 'add_contact',
+                'status': 'success',
+                'contact': self.prepare_contact(profile)
+            }
+        else:
+            response = {
+                'type': 'add_contact',
+                'status': 'error',
+                'message': 'User not found'
+            }
+        await self.reply(websocket, data, response)
+    
+    async def remove_contact_handler(self, websocket, data):
+        username = self.connection_users.get(websocket)
+        contact = data.get('contact')
+        if not username:
+            return
         
-        for user, conn in self.active_connections.items():
-            if user != username:
-                try:
-                    await conn.send(status_message)
-                except:
-                    pass
+        removed = self.db.remove_contact(username, contact)
+        await self.reply(websocket, data, {
+            'type': 'remove_contact',
+            'status': 'success' if removed else 'error',
+            'contact': contact
+        })
     
     def resize_image_base64(self, base64_str, max_size=(100, 100)):
         try:
@@ -161,13 +213,16 @@ class ChatServer:
                     'message': 'Username already exists'
                 }
         
-        await websocket.send(json.dumps(response))                
+        await self.reply(websocket, data, response)
 
     async def handle_client(self, websocket, path):
+        connection_id = self.recorder.open_connection() if self.recorder else None
         try:
             async for message in websocket:
                 data = json.loads(message)
                 message_type = data.get('type')
+                if self.recorder:
+                    self.recorder.record(connection_id, data)
                 
                 if message_type == 'register':
                     await self.register_handler(websocket, data)
@@ -179,33 +234,111 @@ class ChatServer:
                     await self.handle_profile_update(websocket, data)
                 elif message_type == 'profile_request':
                     await self.handle_profile_request(websocket, data)
+                elif message_type == 'add_contact':
+                    await self.add_contact_handler(websocket, data)
+                elif message_type == 'remove_contact':
+                    await self.remove_contact_handler(websocket, data)
+                elif message_type == 'user_search':
+                    await self.user_search_handler(websocket, data)
+                elif message_type == 'search':
+                    await self.search_handler(websocket, data)
+                elif message_type == 'mark_read':
+                    await self.mark_read_handler(websocket, data)
+                elif message_type == 'save_unread':
+                    await self.save_unread_handler(websocket, data)
                 
         except websockets.exceptions.ConnectionClosed:
-            for username, conn in self.active_connections.items():
-                if conn == websocket:
-                    del self.active_connections[username]
-                    self.db.update_user_status(username, False)
-                    await self.broadcast_status(username, False)
-                    break
+            pass
+        finally:
+            if self.recorder:
+                self.recorder.close_connection(connection_id)
+            username = self.connection_users.pop(websocket, None)
+            if username and self.active_connections.get(username) is websocket:
+                del self.active_connections[username]
+                self.db.update_user_status(username, False)
+                await self.broadcast_status(username, False)
     
-    def save_unread_messages(self, username, unread_data):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM unread_messages WHERE username = ?", (username,))
+    async def search_handler(self, websocket, data):
+        username = self.connection_users.get(websocket)
+        if not username:
+            return
         
-        for sender, count in unread_data.items():
-            cursor.execute(
-                "INSERT INTO unread_messages (username, sender, count) VALUES (?, ?, ?)",
-                (username, sender, count)
-            )
-        self.conn.commit()
+        query = data.get('query', '')
+        try:
+            limit = max(1, min(int(data.get('limit', 20)), 50))
+            offset = max(0, int(data.get('offset', 0)))
+        except (TypeError, ValueError, OverflowError):
+            await self.reply(websocket, data, {
+                'type': 'search',
+                'status': 'error',
+                'query': query,
+                'message': 'limit and offset must be integers'
+            })
+            return
+        
+        # Fetch one extra row to know whether another page exists
+        results = self.db.search_messages(username, query, limit + 1, offset)
+        await self.reply(websocket, data, {
+            'type': 'search',
+            'query': query,
+            'offset': offset,
+            'results': results[:limit],
+            'has_more': len(results) > limit
+        })
 
-    def get_unread_messages(self, username):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT sender, count FROM unread_messages WHERE username = ?",
-            (username,)
-        )
-        return dict(cursor.fetchall())
+    async def user_search_handler(self, websocket, data):
+        username = self.connection_users.get(websocket)
+        if not username:
+            return
+        
+        query = data.get('query', '')
+        try:
+            limit = max(1, min(int(data.get('limit', 10)), 20))
+        except (TypeError, ValueError, OverflowError):
+            await self.reply(websocket, data, {
+                'type': 'user_search',
+                'status': 'error',
+                'query': query,
+                'message': 'limit must be an integer'
+            })
+            return
+        contacts = set(self.db.get_contacts(username))
+        
+        results = []
+        # One extra in case the requester matches their own query
+        for user in self.db.search_users(query, limit + 1):
+            if user['username'] == username:
+                continue
+            results.append({
+                'username': user['username'],
+                'display_name': user['display_name'],
+                'status_message': user['status_message'],
+                'is_contact': user['username'] in contacts
+            })
+        
+        await self.reply(websocket, data, {
+            'type': 'user_search',
+            'query': query,
+            'results': results[:limit]
+        })
+
+    async def build_search_index(self):
+        # Backfill the search index for messages saved before it existed,
+        # yielding to the event loop between batches
+        while self.db.index_search_batch():
+            await asyncio.sleep(0)
+
+    async def mark_read_handler(self, websocket, data):
+        username = self.connection_users.get(websocket)
+        peer = data.get('peer')
+        if username and peer:
+            self.db.mark_conversation_read(username, peer)
+
+    async def save_unread_handler(self, websocket, data):
+        username = self.connection_users.get(websocket)
+        unread_messages = data.get('unread_messages')
+        if username and isinstance(unread_messages, dict):
+            self.db.set_unread_counts(username, unread_messages)
 
     async def handle_profile_update(self, websocket, data):
         username = data.get('username')
@@ -216,7 +349,7 @@ class ChatServer:
             username=username,
             display_name=data.get('display_name'),
             status_message=data.get('status_message'),
-            profile_picture=data.get('profile_picture'),
+            profile_picture=data.get('profile_picture') or data.get('profile_image'),
             current_theme=data.get('current_theme')
         )
         
@@ -228,16 +361,12 @@ class ChatServer:
                 'profile': profile
             }
             
-            for other_username, other_ws in self.active_connections.items():
-                try:
-                    await other_ws.send(json.dumps(update_message))
-                except:
-                    pass
+            await self.notify_watchers(username, update_message, include_self=True)
         
-        await websocket.send(json.dumps({
+        await self.reply(websocket, data, {
             'type': 'profile_update_result',
             'status': 'success' if success else 'error'
-        }))
+        })
     
     async def handle_profile_request(self, websocket, data):
         requested_username = data.get('requested_username')
@@ -246,10 +375,10 @@ class ChatServer:
         
         profile = self.db.get_profile(requested_username)
         if profile:
-            await websocket.send(json.dumps({
+            await self.reply(websocket, data, {
                 'type': 'profile_data',
                 'profile': profile
-            }))
+            })
 
     def run(self):
         start_server = websockets.serve(
@@ -259,9 +388,23 @@ class ChatServer:
             max_size=100 * 1024 * 1024  # 100MB
         )
         asyncio.get_event_loop().run_until_complete(start_server)
+        asyncio.get_event_loop().create_task(self.build_search_index())
         print(f"Chat server running on ws://{self.host}:{self.port}")
-        asyncio.get_event_loop().run_forever()
+        if self.recorder:
+            print(f"Recording inbound traffic to {self.recorder.path}")
+        try:
+            asyncio.get_event_loop().run_forever()
+        finally:
+            if self.recorder:
+                self.recorder.close()
 
 if __name__ == "__main__":
-    server = ChatServer()
+    parser = argparse.ArgumentParser(description='Kukuri chat server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--record', help='capture inbound traffic to this file (gzip JSON lines)')
+    args = parser.parse_args()
+    if args.record and os.path.exists(args.record):
+        parser.error(f"capture file {args.record} already exists")
+    server = ChatServer(args.host, args.port, record_path=args.record)
     server.run()
\ No newline at end of file
@@ -1,24 +1,279 @@
 import os
+import re
 import json
+import stat
 import shutil
-from pathlib import Path
-from PyQt6.QtGui import QColor, QFont, QImage
-from PyQt6.QtWidgets import QMessageBox
+import hashlib
+import tempfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from PyQt6.QtCore import QObject, QRunnable, QSize, Qt, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QGuiApplication, QImage, QImageReader, QPixmap, QPixmapCache
+from PyQt6.QtWidgets import QApplication, QMessageBox, QWidget
 from typing import Optional, Dict, Any
 
+class AssetDecodeTask(QRunnable):
+    class Signals(QObject):
+        finished = pyqtSignal(object, QImage)
+
+    def __init__(self, key: str, path: str, target: QSize):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = AssetDecodeTask.Signals()
+        self.key = key
+        self.path = path
+        self.target = target
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            self.signals.finished.emit(self, QImage())
+            return
+        # ถอดรหัสใน worker thread และให้ QImageReader ย่อภาพระหว่างอ่านเลย
+        reader = QImageReader(self.path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid() and (size.width() > self.target.width() or size.height() > self.target.height()):
+            reader.setScaledSize(size.scaled(self.target, Qt.AspectRatioMode.KeepAspectRatioByExpanding))
+        image = reader.read()
+        if image.isNull():
+            print(f"Error decoding theme asset {self.path}: {reader.errorString()}")
+        # ส่งผลกลับเสมอแม้ถูกยกเลิก เพื่อปล่อย task ออกจาก ThemeAssetLoader.cancelled
+        self.signals.finished.emit(self, image)
+
+class ThemeAssetLoader(QObject):
+    """โหลด asset ของ theme ล่วงหน้าใน thread pool แล้วเก็บ pixmap ที่ย่อแล้วไว้ใน QPixmapCache"""
+    loaded = pyqtSignal(str)  # cache key ของ asset ที่พร้อมใช้
+
+    CACHE_LIMIT_KB = 64 * 1024
+
+    # task ที่ถูกยกเลิกแต่ pool เริ่มรันไปแล้ว pool ไม่ได้เป็นเจ้าของ จึงต้องเก็บไว้จนกว่า run() จะจบ
+    cancelled = set()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool.globalInstance()
+        self.tasks = set()
+        self.target = QSize()  # ขนาดหน้าต่างเป็น device pixel
+        if QPixmapCache.cacheLimit() < self.CACHE_LIMIT_KB:
+            QPixmapCache.setCacheLimit(self.CACHE_LIMIT_KB)
+
+    def target_size(self) -> QSize:
+        if self.target.isValid():
+            return self.target
+        # ยังไม่รู้ขนาดหน้าต่าง ใช้ขนาดจอซึ่งใหญ่กว่าหน้าต่างเสมอ
+        screen = QGuiApplication.primaryScreen()
+        if screen is None:
+            return QSize(1920, 1080)
+        return screen.size() * screen.devicePixelRatio()
+
+    def set_target(self, size: QSize, device_pixel_ratio: float) -> bool:
+        """ตั้งขนาดเป้าหมาย คืนค่า True ถ้าต้องย่อภาพใหม่ (หน้าต่างใหญ่ขึ้น)"""
+        # เก็บขนาดใหญ่สุดที่เคยเห็น ภาพที่ใหญ่กว่าหน้าต่างก็วาดตรงกลางได้โดยไม่ต้องย่อใหม่
+        width = round(size.width() * device_pixel_ratio)
+        height = round(size.height() * device_pixel_ratio)
+        if self.target.isValid() and width <= self.target.width() and height <= self.target.height():
+            return False
+        self.target = QSize(max(width, self.target.width()), max(height, self.target.height()))
+        return True
+
+    @staticmethod
+    def release(task, image):
+        ThemeAssetLoader.cancelled.discard(task)
+
+    def cancel(self, task):
+        task.cancelled = True
+        if not self.pool.tryTake(task):
+            ThemeAssetLoader.cancelled.add(task)
+        self.tasks.discard(task)
+
+    def key(self, theme_name: str, theme_dir: Path, asset_path: str) -> str:
+        # ใส่ mtime ของไฟล์ด้วย ภาพที่ถูกแก้จึงได้ key ใหม่แทนที่จะใช้ pixmap เก่าใน cache
+        try:
+            mtime = (theme_dir / asset_path).stat().st_mtime_ns
+        except OSError:
+            mtime = 0
+        target = self.target_size()
+        return f"theme-asset:{theme_name}:{asset_path}:{mtime}:{target.width()}x{target.height()}"
+
+    def pixmap(self, key: str) -> Optional[QPixmap]:
+        """pixmap ที่ถอดรหัสแล้ว หรือ None ถ้ายังไม่พร้อม (ไม่ถอดรหัสใน GUI thread)"""
+        pixmap = QPixmapCache.find(key)
+        return pixmap if pixmap is not None and not pixmap.isNull() else None
+
+    def preload(self, theme_name: str, theme_dir: Path, asset_paths):
+        """เริ่มถอดรหัส asset ของ theme ที่ยังไม่อยู่ใน cache และยังไม่ได้สั่งไว้ คืน {cache key: asset path}"""
+        target = self.target_size()
+        keys = {self.key(theme_name, theme_dir, asset_path): asset_path for asset_path in asset_paths}
+        
+        # งานของ theme หรือขนาดเดิมที่ไม่ต้องใช้แล้ว
+        for task in [task for task in self.tasks if task.key not in keys]:
+            self.cancel(task)
+        pending = {task.key for task in self.tasks}
+        
+        for key, asset_path in keys.items():
+            if key in pending or self.pixmap(key) is not None:
+                continue
+            task = AssetDecodeTask(key, str(theme_dir / asset_path), target)
+            task.signals.finished.connect(ThemeAssetLoader.release)
+            task.signals.finished.connect(self.task_finished)
+            self.tasks.add(task)
+            self.pool.start(task)
+        return keys
+
+    def task_finished(self, task, image):
+        if task not in self.tasks:
+            return
+        self.tasks.discard(task)
+        if image.isNull():
+            return
+        # QImage -> QPixmap ไม่ต้องถอดรหัสซ้ำ จึงทำใน GUI thread ได้
+        pixmap = QPixmap.fromImage(image)
+        screen = QGuiApplication.primaryScreen()
+        if screen is not None:
+            pixmap.setDevicePixelRatio(screen.devicePixelRatio())
+        QPixmapCache.insert(task.key, pixmap)
+        self.loaded.emit(task.key)
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            self.cancel(task)
+
+class ThemeRegistry:
+    """ดัชนี theme ในโฟลเดอร์ themes และ cache ของ theme ที่ parse และตรวจสอบแล้ว"""
+
+    def __init__(self, themes_dir: Path, validate):
+        self.themes_dir = themes_dir
+        self.validate = validate  # (theme_name, theme_data) -> bool
+        self.index: Dict[str, tuple] = {}  # {theme_name: (mtime_ns, size) ของ theme.json}
+        self.cache: Dict[str, tuple] = {}  # {theme_name: ((mtime_ns, size), theme_data หรือ None ถ้าใช้ไม่ได้)}
+        self.scan()
+
+    def _stat(self, theme_name: str) -> Optional[tuple]:
+        try:
+            stat = (self.themes_dir / theme_name / "theme.json").stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def scan(self):
+        """อ่านรายชื่อ theme และขนาด/เวลาแก้ไขของ theme.json ใหม่ทั้งหมด"""
+        index = {}
+        if self.themes_dir.exists():
+            for theme_dir in self.themes_dir.iterdir():
+                # โฟลเดอร์ที่ขึ้นต้นด้วยจุดเป็นของชั่วคราวระหว่าง import
+                if theme_dir.is_dir() and not theme_dir.name.startswith("."):
+                    key = self._stat(theme_dir.name)
+                    if key is not None:
+                        index[theme_dir.name] = key
+        self.index = index
+        self.cache = {name: entry for name, entry in self.cache.items() if index.get(name) == entry[0]}
+
+    def refresh(self, theme_name: str) -> bool:
+        """stat theme เดียวใหม่ คืนค่า True ถ้า theme.json เปลี่ยนไปจากที่ cache ไว้"""
+        key = self._stat(theme_name)
+        if key is None:
+            self.index.pop(theme_name, None)
+        else:
+            self.index[theme_name] = key
+        entry = self.cache.get(theme_name)
+        if entry is not None and entry[0] == key:
+            return False
+        self.cache.pop(theme_name, None)
+        return True
+
+    def names(self) -> list[str]:
+        """รายชื่อ theme จากดัชนี (ไม่อ่านดิสก์)"""
+        return sorted(self.index)
+
+    def get(self, theme_name: str) -> Optional[Dict[str, Any]]:
+        """theme ที่ parse และตรวจสอบแล้ว อ่านไฟล์เฉพาะครั้งแรกหรือเมื่อไฟล์เปลี่ยน"""
+        key = self.index.get(theme_name)
+        if key is None:
+            print(f"Theme file not found: {self.themes_dir / theme_name / 'theme.json'}")
+            return None
+        
+        entry = self.cache.get(theme_name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        
+        try:
+            with open(self.themes_dir / theme_name / "theme.json", "r", encoding="utf-8") as f:
+                theme_data = json.load(f)
+        except Exception as e:
+            print(f"Error loading theme: {e}")
+            return None
+        
+        if not self.validate(theme_name, theme_data):
+            theme_data = None
+        self.cache[theme_name] = (key, theme_data)
+        return theme_data
+
+class ThemeBundleTask(QRunnable):
+    """รัน import/export theme ใน thread pool แล้วรายงานความคืบหน้ากลับมาที่ GUI thread"""
+    class Signals(QObject):
+        progress = pyqtSignal(int)  # เปอร์เซ็นต์
+        finished = pyqtSignal(object)  # ผลลัพธ์ของงาน
+
+    def __init__(self, job, *args):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = ThemeBundleTask.Signals()
+        self.job = job
+        self.args = args
+        self.percent = -1
+
+    def report(self, done: int, total: int):
+        percent = min(100, done * 100 // total) if total else 100
+        # ส่ง signal เฉพาะตอนเปอร์เซ็นต์เปลี่ยน ไม่ใช่ทุก chunk
+        if percent != self.percent:
+            self.percent = percent
+            self.signals.progress.emit(percent)
+
+    def run(self):
+        self.signals.finished.emit(self.job(*self.args, progress=self.report))
+
 class ThemeManager:
+    ROOT_OBJECT_NAME = "chatWindow"
+    # style section ที่ QSS ติดตั้งบน widget ของมันเอง (objectName) แทน stylesheet ระดับ QApplication
+    # ตอน hot reload จึง polish ใหม่แค่ widget นั้น ส่วน section อื่นกระทบทั้งหน้าต่างอยู่แล้ว
+    SECTION_WIDGETS = {
+        "header": ("chatHeader",),
+        "sidebar": ("sidebar",),
+        "chat_area": ("chatArea",),
+        "contact_list": ("chatListPanel",),
+        "input_field": ("searchInput", "messageInputContainer"),
+    }
+    # style section ที่ client วาด background_image ให้ (ดู SectionBackground และ ChatListView ใน client)
+    BACKGROUND_SECTIONS = ("window", "header", "sidebar", "chat_area", "contact_list", "input_field")
+    MANIFEST_NAME = "manifest.json"
+    MAX_BUNDLE_FILES = 256
+    MAX_BUNDLE_FILE_SIZE = 32 * 1024 * 1024
+    MAX_BUNDLE_SIZE = 128 * 1024 * 1024
+    MAX_COMPRESSION_RATIO = 200
+    BUNDLE_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, themes_dir: str = "themes"):
         self.themes_dir = Path(themes_dir)
         self.current_theme: Optional[Dict[str, Any]] = None
         self.current_theme_name: Optional[str] = None
+        self.base_stylesheet = ""
+        self.compiled: Dict[str, tuple] = {}  # {theme_name: ({style section: qss}, palette)}
+        self.compiled_from: Dict[str, dict] = {}  # {theme_name: theme_data ที่ใช้ compile}
+        self.installed_stylesheet: Optional[str] = None
+        self.installed_sections: Dict[str, str] = {}  # {style section: qss ที่ติดตั้งบน widget ของ section}
+        self.asset_keys: Dict[str, str] = {}  # {asset path: cache key ที่ preload ล่าสุด}
         
         if not self.themes_dir.exists():
             self.themes_dir.mkdir()
         
         if not (self.themes_dir / "default").exists():
             self._create_default_theme()
+        
+        self.registry = ThemeRegistry(self.themes_dir, self._validate_theme)
+        self.assets = ThemeAssetLoader()
     
-    def _validate_theme(self, theme_data: dict) -> bool:
+    def _validate_theme(self, theme_name: str, theme_data: dict, theme_dir: Optional[Path] = None) -> bool:
         """ตรวจสอบความถูกต้องของ theme"""
         required_fields = ["name", "author", "version", "styles"]
         if not all(field in theme_data for field in required_fields):
@@ -30,8 +285,8 @@ class ThemeManager:
             print("Missing required styles in theme")
             return False
             
-        if "assets" in theme_data and self.current_theme_name:
-            theme_dir = self.themes_dir / self.current_theme_name
+        if "assets" in theme_data:
+            theme_dir = theme_dir or self.themes_dir / theme_name
             for asset_name, asset_path in theme_data["assets"].items():
                 full_path = theme_dir / asset_path
                 if not full_path.exists():
@@ -42,12 +297,7 @@ class ThemeManager:
 
     def get_available_themes(self) -> list[str]:
         """รับรายชื่อ theme ที่มีทั้งหมด"""
-        themes = []
-        if self.themes_dir.exists():
-            for theme_dir in self.themes_dir.iterdir():
-                if theme_dir.is_dir() and (theme_dir / "theme.json").exists():
-                    themes.append(theme_dir.name)
-        return themes
+        return self.registry.names()
 
     def _create_default_theme(self):
         """สร้าง default theme"""
@@ -109,189 +359,450 @@ class ThemeManager:
     
     def load_theme(self, theme_name: str) -> bool:
         """โหลด theme จากชื่อ"""
-        theme_path = self.themes_dir / theme_name / "theme.json"
-        if not theme_path.exists():
-            print(f"Theme file not found: {theme_path}")
+        theme_data = self.registry.get(theme_name)
+        if theme_data is None:
+            self.current_theme_name = None
             return False
         
         try:
-            with open(theme_path, "r", encoding="utf-8") as f:
-                theme_data = json.load(f)
-            
-            self.current_theme_name = theme_name
-            
-            if not self._validate_theme(theme_data):
-                self.current_theme_name = None
-                return False
-            
-            self.current_theme = theme_data
-            return True
-            
+            # compile ใหม่เฉพาะเมื่อ registry ให้ข้อมูลชุดใหม่มา
+            if self.compiled_from.get(theme_name) is not theme_data:
+                self.compiled[theme_name] = self.compile_theme(theme_name, theme_data)
+                self.compiled_from[theme_name] = theme_data
         except Exception as e:
             print(f"Error loading theme: {e}")
             self.current_theme_name = None
             return False
+        
+        self.current_theme_name = theme_name
+        self.current_theme = theme_data
+        self.preload_assets()
+        return True
     
-    def import_theme(self, theme_path: str) -> bool:
-        """นำเข้า theme จากไฟล์ zip"""
+    def _bundle_entry_path(self, name: str) -> PurePosixPath:
+        """ตรวจชื่อไฟล์ใน bundle ไม่ให้ออกนอกโฟลเดอร์ theme"""
+        path = PurePosixPath(name)
+        if (not name or "\\" in name or path.is_absolute() or ":" in path.parts[0]
+                or any(part in ("", ".", "..") for part in path.parts)):
+            raise ValueError(f"Unsafe path in theme bundle: {name!r}")
+        return path
+
+    def import_theme(self, theme_path: str, progress=None) -> Optional[str]:
+        """นำเข้า theme จากไฟล์ zip คืนชื่อ theme ที่ติดตั้ง (เรียกจาก worker thread ได้)"""
+        staging = None
         try:
-            import zipfile
             with zipfile.ZipFile(theme_path, 'r') as zip_ref:
-                if "theme.json" not in [file.filename for file in zip_ref.filelist]:
-                    print("No theme.json found in zip file")
-                    return False
+                entries = [info for info in zip_ref.infolist() if not info.is_dir()]
+                if len(entries) > self.MAX_BUNDLE_FILES:
+                    raise ValueError(f"Theme bundle has more than {self.MAX_BUNDLE_FILES} files")
                 
-                theme_data = json.loads(zip_ref.read("theme.json"))
-                theme_name = theme_data["name"]
+                # ตรวจจาก header ก่อนแตกไฟล์ แต่ตอนแตกจริงก็นับไบต์ซ้ำอีกรอบ
+                declared_total = 0
+                for info in entries:
+                    self._bundle_entry_path(info.filename)
+                    if stat.S_ISLNK(info.external_attr >> 16):
+                        raise ValueError(f"Symbolic link in theme bundle: {info.filename}")
+                    if info.file_size > self.MAX_BUNDLE_FILE_SIZE:
+                        raise ValueError(f"{info.filename} is larger than {self.MAX_BUNDLE_FILE_SIZE} bytes")
+                    if info.file_size > max(info.compress_size, 1) * self.MAX_COMPRESSION_RATIO:
+                        raise ValueError(f"{info.filename} is compressed suspiciously well")
+                    declared_total += info.file_size
+                if declared_total > self.MAX_BUNDLE_SIZE:
+                    raise ValueError(f"Theme bundle is larger than {self.MAX_BUNDLE_SIZE} bytes")
                 
-                theme_dir = self.themes_dir / theme_name
-                theme_dir.mkdir(exist_ok=True)
+                names = {info.filename for info in entries}
+                if "theme.json" not in names:
+                    raise ValueError("No theme.json found in zip file")
                 
-                zip_ref.extractall(theme_dir)
+                manifest = None
+                if self.MANIFEST_NAME in names:
+                    manifest = json.loads(zip_ref.read(self.MANIFEST_NAME))["files"]
+                    listed = names - {self.MANIFEST_NAME}
+                    if set(manifest) != listed:
+                        raise ValueError("Theme bundle files do not match its manifest")
+                else:
+                    print("Theme bundle has no manifest, skipping integrity check")
                 
-                return True
+                # แตกไฟล์ลงโฟลเดอร์ชั่วคราวใน themes/ เพื่อให้ย้ายเข้าที่ได้ด้วย os.replace
+                staging = Path(tempfile.mkdtemp(prefix=".import-", dir=self.themes_dir))
+                written = 0
+                for info in entries:
+                    if info.filename == self.MANIFEST_NAME:
+                        continue
+                    target = staging.joinpath(*self._bundle_entry_path(info.filename).parts)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    digest = hashlib.sha256()
+                    size = 0
+                    with zip_ref.open(info) as source, open(target, "wb") as out:
+                        while True:
+                            chunk = source.read(self.BUNDLE_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            size += len(chunk)
+                            written += len(chunk)
+                            if size > self.MAX_BUNDLE_FILE_SIZE or written > self.MAX_BUNDLE_SIZE:
+                                raise ValueError(f"{info.filename} expands beyond the size limit")
+                            digest.update(chunk)
+                            out.write(chunk)
+                            if progress:
+                                progress(written, declared_total)
+                    if manifest is not None and manifest[info.filename] != digest.hexdigest():
+                        raise ValueError(f"Checksum mismatch for {info.filename}")
+            
+            with open(staging / "theme.json", "r", encoding="utf-8") as f:
+                theme_data = json.load(f)
+            theme_name = str(theme_data.get("name", ""))
+            if (not theme_name or theme_name.startswith(".") or len(theme_name) > 64
+                    or re.search(r'[\\/:*?"<>|\x00-\x1f]', theme_name)):
+                raise ValueError(f"Invalid theme name: {theme_name!r}")
+            if not self._validate_theme(theme_name, theme_data, staging):
+                raise ValueError("Theme bundle contains an invalid theme")
+            
+            # ติดตั้งแบบ atomic: ย้ายของเดิมออกก่อน แล้วค่อยย้ายของใหม่เข้าที่
+            theme_dir = self.themes_dir / theme_name
+            previous = None
+            if theme_dir.exists():
+                previous = Path(tempfile.mkdtemp(prefix=".replaced-", dir=self.themes_dir)) / theme_name
+                os.replace(theme_dir, previous)
+            try:
+                os.replace(staging, theme_dir)
+            except OSError:
+                if previous is not None:
+                    os.replace(previous, theme_dir)
+                raise
+            staging = None
+            if previous is not None:
+                shutil.rmtree(previous.parent, ignore_errors=True)
+            return theme_name
         except Exception as e:
             print(f"Error importing theme: {e}")
-            return False
+            return None
+        finally:
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
     
-    def export_theme(self, theme_name: str, export_path: str) -> bool:
-        """ส่งออก theme เป็นไฟล์ zip"""
+    def export_theme(self, theme_name: str, export_path: str, progress=None) -> bool:
+        """ส่งออก theme เป็นไฟล์ zip พร้อม manifest (เรียกจาก worker thread ได้)"""
+        partial = f"{export_path}.part"
         try:
-            import zipfile
             theme_dir = self.themes_dir / theme_name
+            files = sorted(path for path in theme_dir.rglob("*") if path.is_file())
+            total = sum(path.stat().st_size for path in files)
+            done = 0
+            manifest = {}
+            
+            with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_DEFLATED) as zip_ref:
+                for file_path in files:
+                    name = file_path.relative_to(theme_dir).as_posix()
+                    digest = hashlib.sha256()
+                    with open(file_path, "rb") as source, zip_ref.open(name, "w", force_zip64=True) as out:
+                        while True:
+                            chunk = source.read(self.BUNDLE_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            digest.update(chunk)
+                            out.write(chunk)
+                            done += len(chunk)
+                            if progress:
+                                progress(done, total)
+                    manifest[name] = digest.hexdigest()
+                zip_ref.writestr(self.MANIFEST_NAME, json.dumps({"version": 1, "files": manifest}, indent=4))
             
-            with zipfile.ZipFile(export_path, 'w') as zip_ref:
-                for file_path in theme_dir.rglob("*"):
-                    if file_path.is_file():
-                        zip_ref.write(file_path, file_path.relative_to(theme_dir))
+            os.replace(partial, export_path)
             return True
         except Exception as e:
             print(f"Error exporting theme: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
             return False
     
-    def apply_theme_to_widget(self, widget, widget_type: str):
-        """ใช้ theme กับ widget"""
-        if not self.current_theme:
-            return
-        
-        styles = self.current_theme["styles"]
-        if widget_type not in styles:
-            return
-        
-        style = styles[widget_type]
-        stylesheet_parts = []
-        
-        # กำหนด base selector ตามประเภท widget
-        if widget_type in ["sent_message", "received_message"]:
-            base_selector = "QLabel[class='message']"
-        elif widget_type == "buttons":
-            base_selector = "QPushButton"
-        elif widget_type == "input_field":
-            base_selector = "QLineEdit, QTextEdit"  # เพิ่ม QTextEdit
-        elif widget_type == "chat_area":
-            base_selector = "QWidget"  # เปลี่ยนจาก QTextEdit เป็น QWidget
-        elif widget_type == "contact_list":
-            base_selector = "QListWidget"
-        elif widget_type == "window":
-            base_selector = "QWidget"
-        elif widget_type == "header":
-            base_selector = "QWidget#header"
-        elif widget_type == "sidebar":
-            base_selector = "QWidget#sidebar"
-        else:
-            base_selector = "QWidget"
+    def _declarations(self, style: dict, keys: tuple) -> list[str]:
+        """แปลงค่าใน style เป็น QSS declarations"""
+        declarations = []
         
-        # สร้าง main style
-        main_style = []
-        
-        # จัดการพื้นหลัง
-        if "background" in style:
-            if ("background_image" in style and 
-                "assets" in self.current_theme and 
-                self.current_theme_name is not None):
-                
-                image_path = str(self.themes_dir / self.current_theme_name / style["background_image"])
-                image_path = image_path.replace('\\', '/')
-                
-                if Path(image_path).exists():
-                    main_style.append(f"background-image: url('{image_path}');")
-                    main_style.append("background-repeat: no-repeat;")
-                    main_style.append("background-position: center;")
-                    main_style.append("background-attachment: fixed;")
-                    if "background_opacity" in style:
-                        main_style.append(f"background-color: rgba(255, 255, 255, {style['background_opacity']});")
-                else:
-                    main_style.append(f"background-color: {style['background']};")
+        # จัดการพื้นหลัง (ภาพพื้นหลังไม่ใส่เป็น url() เพราะ Qt จะถอดรหัสใน GUI thread
+        # ตอนวาดครั้งแรก client วาด pixmap ที่โหลดไว้ล่วงหน้าทับสีนี้แทน)
+        if "background" in keys and "background" in style:
+            if "background_image" in keys and style.get("background_image") and "background_opacity" in style:
+                declarations.append(f"background-color: rgba(255, 255, 255, {style['background_opacity']});")
             else:
-                main_style.append(f"background-color: {style['background']};")
+                declarations.append(f"background-color: {style['background']};")
         
-        # จัดการสีตัวอักษร
-        if "text_color" in style:
-            main_style.append(f"color: {style['text_color']};")
+        if "text_color" in keys and "text_color" in style:
+            declarations.append(f"color: {style['text_color']};")
         
-        # จัดการเส้นขอบ
-        if "border_color" in style:
-            main_style.append(f"border: 1px solid {style['border_color']};")
+        if "border_color" in keys and "border_color" in style:
+            declarations.append(f"border: 1px solid {style['border_color']};")
         
-        if "border_radius" in style:
-            main_style.append(f"border-radius: {style['border_radius']}px;")
+        if "border_bottom" in keys and "border_bottom" in style:
+            declarations.append(f"border-bottom: {style['border_bottom']};")
         
-        # จัดการ padding
-        if "padding" in style:
+        if "border_radius" in keys and "border_radius" in style:
+            declarations.append(f"border-radius: {style['border_radius']}px;")
+        
+        if "padding" in keys and "padding" in style:
             padding = style["padding"]
             if isinstance(padding, list) and len(padding) == 4:
-                main_style.append(f"padding: {padding[0]}px {padding[1]}px {padding[2]}px {padding[3]}px;")
-        
-        # รวม style หลัก
-        if main_style:
-            stylesheet_parts.append(f"{base_selector} {{ {' '.join(main_style)} }}")
-        
-        # จัดการ hover effects สำหรับปุ่ม
-        if widget_type == "buttons":
-            if "hover_background" in style:
-                stylesheet_parts.append(f"{base_selector}:hover {{ background-color: {style['hover_background']}; }}")
-            if "pressed_background" in style:
-                stylesheet_parts.append(f"{base_selector}:pressed {{ background-color: {style['pressed_background']}; }}")
-            if "disabled_background" in style:
-                stylesheet_parts.append(f"{base_selector}:disabled {{ background-color: {style['disabled_background']}; }}")
-        
-        # จัดการ selected state สำหรับ contact list
-        if widget_type == "contact_list":
-            if "selected_background" in style:
-                stylesheet_parts.append(f"{base_selector}::item:selected {{ background: {style['selected_background']}; }}")
-            if "hover_background" in style:
-                stylesheet_parts.append(f"{base_selector}::item:hover {{ background: {style['hover_background']}; }}")
-            if "online_color" in style:
-                stylesheet_parts.append(f"{base_selector}::item[online=true] {{ color: {style['online_color']}; }}")
-            if "offline_color" in style:
-                stylesheet_parts.append(f"{base_selector}::item[online=false] {{ color: {style['offline_color']}; }}")
+                declarations.append(f"padding: {padding[0]}px {padding[1]}px {padding[2]}px {padding[3]}px;")
+        
+        if "font_size" in keys and "font_size" in style:
+            declarations.append(f"font-size: {style['font_size']}px;")
+        
+        return declarations
+
+    def compile_theme(self, theme_name: str, theme_data: dict) -> tuple[dict, dict]:
+        """แปลง theme เป็น QSS แยกตาม style section และ palette สำหรับ delegate (ทำครั้งเดียวตอนโหลด)"""
+        styles = theme_data["styles"]
+        scope = f'#{self.ROOT_OBJECT_NAME}[theme="{self._property_value(theme_name)}"]'
+        rules: Dict[str, list] = {}  # {style section: [QSS rule]}
+        
+        def rule(name, selectors, declarations):
+            if declarations:
+                selector = ", ".join(f"{scope}{s}" for s in selectors)
+                rules.setdefault(name, []).append(f"{selector} {{ {' '.join(declarations)} }}")
+        
+        def section(name, selectors, keys):
+            if name in styles:
+                rule(name, selectors, self._declarations(styles[name], keys))
+        
+        for name, style in styles.items():
+            if isinstance(style, dict) and style.get("background_image") and name not in self.BACKGROUND_SECTIONS:
+                print(f"Theme {theme_name}: background_image is not supported in {name}, ignoring it")
+        
+        # ส่วนประกอบหลัก จับคู่ด้วย objectName ที่ client ตั้งไว้
+        section("window", [""], ("background", "background_image", "text_color"))
+        section("header", [" #chatHeader"], ("background", "background_image", "border_bottom", "padding"))
+        section("header", [" QLabel#chatTitle"], ("text_color", "font_size"))
+        section("sidebar", [" #sidebar"], ("background", "background_image", "padding"))
+        section("chat_area", [" #chatArea", " ChatHistory", " ChatHistory QWidget", " ChatHistory QListView"],
+                ("background", "background_image", "text_color"))
+        section("contact_list", [" #chatListPanel"], ("background", "background_image"))
+        section("input_field", [" QLineEdit#searchInput"],
+                ("background", "text_color", "border_color", "border_radius", "padding", "font_size"))
+        section("input_field", [" #messageInputContainer"], ("background", "background_image", "border_color"))
+        section("input_field", [" QTextEdit#messageInput"], ("text_color", "font_size"))
+        section("buttons", [" QPushButton"],
+                ("background", "text_color", "border_radius", "padding", "font_size"))
+        
+        buttons = styles.get("buttons", {})
+        for state, key in (("hover", "hover_background"), ("pressed", "pressed_background"),
+                           ("disabled", "disabled_background")):
+            if key in buttons:
+                rule("buttons", [f" QPushButton:{state}"], [f"background-color: {buttons[key]};"])
+        
+        sidebar = styles.get("sidebar", {})
+        sidebar_button = []
+        if "selected_background" in sidebar:
+            sidebar_button.append(f"background-color: {sidebar['selected_background']};")
+        if "icon_color" in sidebar:
+            sidebar_button.append(f"color: {sidebar['icon_color']};")
+        rule("sidebar", [" #sidebar QPushButton"], sidebar_button)
+        sidebar_hover = []
+        if "hover_background" in sidebar:
+            sidebar_hover.append(f"background-color: {sidebar['hover_background']};")
+        if "text_color" in sidebar:
+            sidebar_hover.append(f"color: {sidebar['text_color']};")
+        rule("sidebar", [" #sidebar QPushButton:hover"], sidebar_hover)
         
         # จัดการ scrollbar
-        if "scrollbar" in self.current_theme["styles"]:
-            scrollbar = self.current_theme["styles"]["scrollbar"]
-            if "width" in scrollbar:
-                stylesheet_parts.append(f"{base_selector} QScrollBar:vertical {{ width: {scrollbar['width']}px; }}")
-            if "background" in scrollbar:
-                stylesheet_parts.append(f"{base_selector} QScrollBar:vertical {{ background: {scrollbar['background']}; }}")
-            if "handle_color" in scrollbar:
-                stylesheet_parts.append(f"{base_selector} QScrollBar::handle:vertical {{ background: {scrollbar['handle_color']}; }}")
-            if "handle_hover_color" in scrollbar:
-                stylesheet_parts.append(f"{base_selector} QScrollBar::handle:vertical:hover {{ background: {scrollbar['handle_hover_color']}; }}")
-        
-        # รวม stylesheet และใช้กับ widget
-        if stylesheet_parts:
-            full_stylesheet = " ".join(stylesheet_parts)
-            print(f"Applying stylesheet to {widget_type}:")
-            print(full_stylesheet)
-            try:
-                widget.setStyleSheet(full_stylesheet)
-            except Exception as e:
-                print(f"Error applying stylesheet: {e}")
+        scrollbar = styles.get("scrollbar", {})
+        scrollbar_style = []
+        if "width" in scrollbar:
+            scrollbar_style.append(f"width: {scrollbar['width']}px;")
+        if "background" in scrollbar:
+            scrollbar_style.append(f"background: {scrollbar['background']};")
+        rule("scrollbar", [" QScrollBar:vertical"], scrollbar_style)
+        if "handle_color" in scrollbar:
+            rule("scrollbar", [" QScrollBar::handle:vertical"], [f"background: {scrollbar['handle_color']};"])
+        if "handle_hover_color" in scrollbar:
+            rule("scrollbar", [" QScrollBar::handle:vertical:hover"], [f"background: {scrollbar['handle_hover_color']};"])
         
-        # จัดการฟอนต์
-        if "font_family" in style and "font_size" in style:
-            try:
-                font = QFont(style["font_family"], style["font_size"])
-                widget.setFont(font)
-            except Exception as e:
-                print(f"Error setting font: {e}")
\ No newline at end of file
+        # สีที่ delegate วาดเอง (bubble และรายชื่อ) ไม่ผ่าน QSS
+        chat_area = styles.get("chat_area", {})
+        sent = styles.get("sent_message", {})
+        received = styles.get("received_message", {})
+        contacts = styles.get("contact_list", {})
+        colors = {
+            "sent_background": sent.get("background") or chat_area.get("sent_message_bg"),
+            "sent_text": sent.get("text_color"),
+            "received_background": received.get("background") or chat_area.get("received_message_bg"),
+            "received_text": received.get("text_color"),
+            "timestamp": chat_area.get("timestamp_color"),
+            "contact_selected": contacts.get("selected_background"),
+            "contact_hover": contacts.get("hover_background"),
+            "contact_name": contacts.get("text_color"),
+            "contact_online": contacts.get("online_color"),
+            "contact_unread": contacts.get("unread_color"),
+        }
+        palette = {}
+        for key, value in colors.items():
+            color = parse_color(value)
+            if color is not None:
+                palette[key] = color
+        
+        window = styles.get("window", {})
+        if "font_family" in window and "font_size" in window:
+            palette["font"] = QFont(window["font_family"], window["font_size"])
+        
+        return {name: "\n".join(section_rules) for name, section_rules in rules.items()}, palette
+
+    def _property_value(self, theme_name: str) -> str:
+        return theme_name.replace('\\', '').replace('"', '')
+
+    def application_stylesheet(self) -> str:
+        """รวม base stylesheet กับ section ที่ไม่มี widget ของตัวเองจาก theme ที่ compile แล้วทั้งหมด"""
+        return "\n".join([self.base_stylesheet] + [
+            qss for sections, _ in self.compiled.values()
+            for name, qss in sections.items() if name not in self.SECTION_WIDGETS
+        ])
+
+    def section_stylesheet(self, section: str) -> str:
+        """QSS ของ style section เดียวจาก theme ที่ compile แล้วทั้งหมด"""
+        return "\n".join(sections[section] for sections, _ in self.compiled.values() if section in sections)
+
+    def reload_current_theme(self) -> set:
+        """โหลด theme ปัจจุบันใหม่ถ้า theme.json หรือไฟล์ asset เปลี่ยน คืนชื่อ style section ที่เปลี่ยน"""
+        theme_name = self.current_theme_name
+        if not theme_name:
+            return set()
+        old_keys = self.asset_keys
+        if not self.registry.refresh(theme_name):
+            # theme.json เหมือนเดิม แต่ไฟล์ภาพอาจถูกแก้ ซึ่ง key ของ asset มี mtime อยู่ด้วย
+            self.preload_assets()
+            return self._asset_sections(old_keys)
+        
+        old_theme = self.current_theme or {}
+        new_theme = self.registry.get(theme_name)
+        if new_theme is None:
+            # ไฟล์ยังเขียนไม่เสร็จหรือผิดรูปแบบ ใช้ theme เดิมต่อไป
+            print(f"Theme {theme_name} is invalid, keeping the previous version")
+            return set()
+        if not self.load_theme(theme_name):
+            return set()
+        
+        old_styles = old_theme.get("styles", {})
+        new_styles = new_theme["styles"]
+        if old_theme.get("assets") != new_theme.get("assets"):
+            return set(old_styles) | set(new_styles)
+        return {
+            section for section in set(old_styles) | set(new_styles)
+            if old_styles.get(section) != new_styles.get(section)
+        } | self._asset_sections(old_keys)
+
+    def _asset_sections(self, old_keys: dict) -> set:
+        """style section ที่ใช้ asset ซึ่งไฟล์เปลี่ยนไปจาก key ชุดก่อน"""
+        changed = {path for path, key in self.asset_keys.items() if old_keys.get(path, key) != key}
+        if not changed:
+            return set()
+        for path in changed:
+            QPixmapCache.remove(old_keys[path])
+        return {
+            section for section, style in self.current_theme["styles"].items()
+            if isinstance(style, dict) and style.get("background_image") in changed
+        }
+
+    def _asset_paths(self, theme_data: dict) -> set:
+        """ภาพพื้นหลังที่ client วาดจริง (asset อื่นไม่มีใครอ่าน จึงไม่ถอดรหัสไว้)"""
+        paths = set()
+        for section in self.BACKGROUND_SECTIONS:
+            style = theme_data["styles"].get(section)
+            if isinstance(style, dict) and style.get("background_image"):
+                paths.add(style["background_image"])
+        return paths
+
+    def preload_assets(self):
+        """ถอดรหัส asset ของ theme ปัจจุบันใน background"""
+        self.asset_keys = {}
+        if self.current_theme:
+            paths = self._asset_paths(self.current_theme)
+            if paths:
+                keys = self.assets.preload(self.current_theme_name, self.themes_dir / self.current_theme_name, paths)
+                self.asset_keys = {asset_path: key for key, asset_path in keys.items()}
+
+    def asset_files(self) -> list:
+        """ไฟล์ asset ของ theme ปัจจุบัน (ให้ client เฝ้าดูการแก้ไข)"""
+        if not self.current_theme:
+            return []
+        theme_dir = self.themes_dir / self.current_theme_name
+        return [theme_dir / asset_path for asset_path in sorted(self._asset_paths(self.current_theme))]
+
+    def background_key(self, section: str) -> Optional[str]:
+        """cache key ของภาพพื้นหลังของ style section ใน theme ปัจจุบัน"""
+        if not self.current_theme:
+            return None
+        image = self.current_theme["styles"].get(section, {}).get("background_image")
+        if not image:
+            return None
+        return self.asset_keys.get(image)
+
+    def current_palette(self) -> dict:
+        """palette ของ theme ปัจจุบัน"""
+        if self.current_theme_name in self.compiled:
+            return self.compiled[self.current_theme_name][1]
+        return {}
+
+    def install_stylesheet(self) -> bool:
+        """ติดตั้ง stylesheet ระดับ QApplication ถ้ามีการเปลี่ยนแปลง คืนค่า True ถ้าติดตั้งใหม่"""
+        app = QApplication.instance()
+        stylesheet = self.application_stylesheet()
+        if app is None or stylesheet == self.installed_stylesheet:
+            return False
+        self.installed_stylesheet = stylesheet
+        app.setStyleSheet(stylesheet)
+        return True
+
+    def install_sections(self, window: QWidget, sections) -> bool:
+        """ติดตั้ง QSS ของ section ที่เปลี่ยนบน widget ของ section นั้นเท่านั้น คืนค่า True ถ้าติดตั้งใหม่"""
+        installed = False
+        for section in sections:
+            if section not in self.SECTION_WIDGETS:
+                continue
+            stylesheet = self.section_stylesheet(section)
+            if self.installed_sections.get(section) == stylesheet:
+                continue
+            self.installed_sections[section] = stylesheet
+            for name in self.SECTION_WIDGETS[section]:
+                widget = window.findChild(QWidget, name)
+                if widget is not None:
+                    widget.setStyleSheet(stylesheet)
+            installed = True
+        return installed
+
+    def apply_theme(self, window: QWidget):
+        """ใช้ theme ปัจจุบันกับหน้าต่างหลัก ผ่าน stylesheet ระดับ QApplication"""
+        window.setObjectName(self.ROOT_OBJECT_NAME)
+        window.setProperty("theme", self._property_value(self.current_theme_name or ""))
+        
+        # parse stylesheet ใหม่เฉพาะเมื่อมี theme ที่เพิ่ง compile
+        self.install_sections(window, self.SECTION_WIDGETS)
+        if self.install_stylesheet():
+            return
+        
+        # theme เดิมที่ compile ไว้แล้ว: แค่ polish ใหม่ตาม property
+        style = window.style()
+        for widget in [window] + window.findChildren(QWidget):
+            style.unpolish(widget)
+            style.polish(widget)
+            widget.update()
+
+
+def parse_color(value) -> Optional[QColor]:
+    """แปลงสีจาก theme (#hex, ชื่อสี หรือ rgb()/rgba()) เป็น QColor"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    match = re.fullmatch(r"rgba?\(([^)]*)\)", value)
+    if match:
+        try:
+            parts = [float(part) for part in match.group(1).split(",")]
+        except ValueError:
+            return None
+        if len(parts) not in (3, 4):
+            return None
+        color = QColor(*(int(part) for part in parts[:3]))
+        if len(parts) == 4:
+            alpha = parts[3]
+            color.setAlpha(int(alpha * 255) if alpha <= 1 else int(alpha))
+        return color
+    color = QColor(value)
+    return color if color.isValid() else None
\ No newline at end of file
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import gzip
+import hashlib
+import itertools
+import json
+import tempfile
+import time
+
+import websockets
+
+from loadtest import latency_summary, make_png, start_server, wait_for_server
+
+# Capture files are gzip'd JSON lines, one per event:
+#   {"t": seconds since capture start, "c": connection id, "e": "open"}
+#   {"t": ..., "c": ..., "f": inbound frame, redacted}
+#   {"t": ..., "c": ..., "e": "close"}
+# Passwords are replaced by a token derived from the username, so a register
+# and a later login of the same user still match on replay. Image payloads
+# are replaced by their length and re-inflated to a generated PNG of about
+# that size, so the server still decodes and thumbnails real images.
+
+PASSWORD_FIELDS = ('password', 'current_password', 'new_password')
+IMAGE_FIELDS = ('profile_image', 'additional_image', 'profile_picture')
+IMAGE_PLACEHOLDER = 'redacted-image:'
+
+
+def password_token(username):
+    return 'redacted-' + hashlib.sha256(f"kukuri-replay:{username}".encode('utf-8')).hexdigest()[:16]
+
+def redact(frame):
+    redacted = dict(frame)
+    for key in PASSWORD_FIELDS:
+        if redacted.get(key):
+            redacted[key] = password_token(str(frame.get('username')))
+    for key in IMAGE_FIELDS:
+        if isinstance(redacted.get(key), str) and redacted[key]:
+            redacted[key] = f"{IMAGE_PLACEHOLDER}{len(redacted[key])}"
+    if frame.get('type') == 'message' and frame.get('message_type') == 'image' \
+            and isinstance(frame.get('content'), str):
+        redacted['content'] = f"{IMAGE_PLACEHOLDER}{len(frame['content'])}"
+    return redacted
+
+generated_images = {}  # {base64 length: PNG}
+
+def image_of_size(length):
+    # Noise PNG whose base64 is about `length` characters: a square of RGB
+    # pixels at 3 bytes each plus a filter byte per row
+    cache = generated_images
+    if length not in cache:
+        size = max(64, length * 3 // 4 - 64)
+        width = max(1, int((size / 3) ** 0.5))
+        height = max(1, round(size / (width * 3 + 1)))
+        cache[length] = make_png(width, height, length)
+    return cache[length]
+
+def inflate(frame):
+    inflated = dict(frame)
+    for key, value in frame.items():
+        if isinstance(value, str) and value.startswith(IMAGE_PLACEHOLDER):
+            inflated[key] = image_of_size(int(value[len(IMAGE_PLACEHOLDER):]))
+    return inflated
+
+
+# Writes inbound frames to a new capture file; one file holds one server
+# run, since timestamps and connection ids start over with every run.
+# Called from the server's event loop, so it only serializes and hands the
+# line to the gzip stream; the stream is flushed when a connection closes.
+class TrafficRecorder:
+    def __init__(self, path):
+        self.path = path
+        # Raises FileExistsError rather than mixing two runs in one capture
+        self.file = gzip.open(path, 'xt', encoding='utf-8', compresslevel=6)
+        self.started = time.monotonic()
+        self.connection_ids = itertools.count(1)
+
+    def write(self, record):
+        record['t'] = round(time.monotonic() - self.started, 6)
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def open_connection(self):
+        connection_id = next(self.connection_ids)
+        self.write({'c': connection_id, 'e': 'open'})
+        return connection_id
+
+    def record(self, connection_id, frame):
+        self.write({'c': connection_id, 'f': redact(frame)})
+
+    def close_connection(self, connection_id):
+        self.write({'c': connection_id, 'e': 'close'})
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_capture(path):
+    # A server that was killed leaves no gzip trailer; everything up to the
+    # last flush is still readable
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except EOFError:
+            return
+
+
+# Re-drives a capture against a server: one websocket per recorded
+# connection, every frame sent at its recorded offset divided by `speed`.
+# Keeping the schedule keeps cross-connection order (a login before the
+# messages it authorizes), so there is no unthrottled mode. Each frame gets
+# a fresh request_id, which the server echoes, so reply latency is measured
+# per request type.
+class TrafficReplayer:
+    def __init__(self, path, url, speed=1.0):
+        self.path = path
+        self.url = url
+        self.speed = speed
+        self.records = list(read_capture(path))
+        # Skip the idle stretch between server start and the first connection
+        self.offset = self.records[0]['t'] if self.records else 0.0
+        self.request_ids = itertools.count(1)
+        self.sent = {}  # {request_id: (frame type, send time)}
+        self.latencies = {}  # {frame type: [ms, ...]}
+        self.lags = []  # how late each frame went out against the schedule
+        self.counts = {'frames': 0, 'replies': 0, 'error_replies': 0, 'pushed': 0, 'connect_errors': 0, 'send_errors': 0}
+
+    def users_to_register(self):
+        # Users that log in without registering in the capture already
+        # existed on the recorded server; create them first
+        registered = set()
+        users = {}
+        for record in self.records:
+            frame = record.get('f') or {}
+            if frame.get('type') == 'register':
+                registered.add(frame.get('username'))
+            elif frame.get('type') == 'login' and frame.get('username') not in registered:
+                users.setdefault(frame.get('username'), frame.get('password'))
+        return users
+
+    async def prepare(self):
+        for username, password in self.users_to_register().items():
+            async with websockets.connect(self.url) as websocket:
+                await websocket.send(json.dumps({
+                    'type': 'register',
+                    'username': username,
+                    'password': password,
+                    'display_name': username
+                }))
+                await websocket.recv()
+
+    async def read_replies(self, websocket):
+        try:
+            async for raw in websocket:
+                frame = json.loads(raw)
+                sent = self.sent.pop(frame.get('request_id'), None)
+                if sent is None:
+                    self.counts['pushed'] += 1
+                    continue
+                self.counts['replies'] += 1
+                if frame.get('status') == 'error':
+                    # Usually means the replay diverged from the recording
+                    self.counts['error_replies'] += 1
+                kind, started = sent
+                self.latencies.setdefault(kind, []).append((time.perf_counter() - started) * 1000)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def run_connection(self, records, started):
+        websocket = None
+        reader = None
+        try:
+            for record in records:
+                delay = started + (record['t'] - self.offset) / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.lags.append(max(0.0, -delay) * 1000)
+
+                event = record.get('e')
+                if event == 'open':
+                    try:
+                        websocket = await websockets.connect(self.url, max_size=100 * 1024 * 1024)
+                    except OSError:
+                        self.counts['connect_errors'] += 1
+                        return
+                    reader = asyncio.get_running_loop().create_task(self.read_replies(websocket))
+                elif event == 'close':
+                    break
+                elif websocket is not None:
+                    frame = dict(record['f'])
+                    request_id = next(self.request_ids)
+                    frame['request_id'] = request_id
+                    self.sent[request_id] = (frame.get('type'), time.perf_counter())
+                    try:
+                        await websocket.send(json.dumps(frame))
+                        self.counts['frames'] += 1
+                    except websockets.exceptions.ConnectionClosed:
+                        self.counts['send_errors'] += 1
+                        break
+        finally:
+            if websocket is not None:
+                # Give in-flight replies a moment before hanging up
+                await asyncio.sleep(0.2)
+                await websocket.close()
+            if reader is not None:
+                await reader
+
+    async def run(self):
+        await self.prepare()
+        connections = {}
+        for record in self.records:
+            # Images are generated up front so it doesn't skew the schedule
+            if 'f' in record:
+                record['f'] = inflate(record['f'])
+            connections.setdefault(record['c'], []).append(record)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.run_connection(records, started) for records in connections.values()
+        ))
+        elapsed = time.perf_counter() - started
+        recorded = self.records[-1]['t'] - self.offset if self.records else 0.0
+        return {
+            'capture': self.path,
+            'speed': self.speed,
+            'connections': len(connections),
+            'recorded_seconds': round(recorded, 3),
+            'replay_seconds': round(elapsed, 3),
+            **self.counts,
+            'unanswered': len(self.sent),
+            'schedule_lag_ms': latency_summary(self.lags),
+            'reply_ms': {kind: latency_summary(samples) for kind, samples in sorted(self.latencies.items())},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a captured traffic file against a chat server')
+    parser.add_argument('capture', help='capture file written by ChatServer(record_path=...)')
+    parser.add_argument('--speed', type=float, default=1.0, help='time scale, e.g. 10 replays ten times faster')
+    parser.add_argument('--port', type=int, default=8791, help='port for the fresh server started for the replay')
+    parser.add_argument('--url', help='replay against an already running server instead')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+
+    server = None
+    url = args.url
+    if not url:
+        server = start_server(args.port, tempfile.mkdtemp(prefix='kukuri-replay-'))
+        url = f'ws://localhost:{args.port}'
+    try:
+        asyncio.run(wait_for_server(url))
+        result = asyncio.run(TrafficReplayer(args.capture, url, args.speed).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()